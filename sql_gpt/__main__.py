@@ -1,13 +1,18 @@
 import argparse
 import json
+import sys
 
-from sql_gpt.constants import MAX_AGENT_RECURSION_LIMIT
-from sql_gpt.graph import Graph
-from sql_gpt.llm import LLM
-from sql_gpt.querier import Querier
-from sql_gpt.state import ChatState
+from sql_gpt.constants import (
+    BATCH_CONCURRENCY,
+    MAX_AGENT_RECURSION_LIMIT,
+    MAX_PROMPT_TOKENS,
+)
+from sql_gpt.tracing import StartupProfile
 
 if __name__ == "__main__":
+    # Only what is needed to parse the arguments is imported up front, the agent and its
+    # backends are imported once the arguments select them.
+    profile = StartupProfile()
     parser = argparse.ArgumentParser(description="SQL GPT CLI")
     parser.add_argument(
         "-l",
@@ -21,6 +26,41 @@ if __name__ == "__main__":
         type=str,
         help="json string of LLM parameters (e.g., '{\"temperature\": 0.5}')",
     )
+    parser.add_argument(
+        "--llm-cache",
+        action="store_true",
+        help="cache LLM responses in memory and on disk",
+    )
+    parser.add_argument(
+        "--llm-cache-kwargs",
+        type=str,
+        help="json string of LLM cache parameters (e.g., '{\"ttl_seconds\": 86400}')",
+    )
+    parser.add_argument(
+        "--examples",
+        action="store_true",
+        help="prompt with verified question and SQL examples, learned from answered questions",
+    )
+    parser.add_argument(
+        "--examples-kwargs",
+        type=str,
+        help="json string of example store parameters (e.g., '{\"k\": 5}')",
+    )
+    parser.add_argument(
+        "--auto-refresh",
+        action="store_true",
+        help="before every question, ingest the rows appended to the files of the loaded tables",
+    )
+    parser.add_argument(
+        "--sessions",
+        action="store_true",
+        help="save the session as it goes, so that it can be resumed later with /resume",
+    )
+    parser.add_argument(
+        "--sessions-kwargs",
+        type=str,
+        help='json string of session store parameters (e.g., \'{"path": "sessions.sqlite"}\')',
+    )
     parser.add_argument(
         "-e",
         "--executor",
@@ -33,15 +73,183 @@ if __name__ == "__main__":
         type=str,
         help='json string of executor parameters (e.g., \'{"database": "my_database.db"}\')',
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--max-prompt-tokens",
+        type=int,
+        default=MAX_PROMPT_TOKENS,
+        help="token budget of the prompts sent to the LLM, older history is compacted to fit",
+    )
+    parser.add_argument(
+        "--candidates",
+        type=int,
+        default=1,
+        help="number of SQL candidates to generate at once and try in parallel",
+    )
+    parser.add_argument(
+        "--consensus",
+        action="store_true",
+        help="pick the candidate whose result most candidates agree on, instead of the first "
+        "candidate to succeed",
+    )
+    parser.add_argument(
+        "--trace-file",
+        type=str,
+        help="JSONL file to append a span for every agent run, LLM call and SQL query to",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        type=str,
+        help="file to write aggregated metrics to in the Prometheus text format",
+    )
+    parser.add_argument(
+        "--batch",
+        type=str,
+        help="answer the questions of a JSONL file ('-' for stdin) instead of chatting, "
+        "writing the results as JSONL to stdout",
+    )
+    parser.add_argument(
+        "--load",
+        type=str,
+        nargs="+",
+        action="append",
+        default=[],
+        metavar="PATH",
+        help="file, directory or glob to load before the batch or server, optionally followed "
+        "by a table columns description file (repeatable)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=BATCH_CONCURRENCY,
+        help="number of batch questions answered concurrently",
+    )
+    parser.add_argument(
+        "--serve",
+        type=str,
+        metavar="[HOST:]PORT",
+        help="serve concurrent chat sessions over HTTP instead of chatting",
+    )
+    parser.add_argument(
+        "--server-kwargs",
+        type=str,
+        help="json string of server parameters (e.g., '{\"max_sessions\": 64}')",
+    )
+    parser.add_argument(
+        "--import-profile",
+        type=str,
+        nargs="?",
+        const="-",
+        metavar="FILE",
+        help="write the startup time breakdown as JSON to a file (stderr if omitted), once "
+        "ready for the first question",
+    )
+    with profile.phase("arguments"):
+        args = parser.parse_args()
 
-    # Initialize ChatState with LLM and Querier
-    chat_state = ChatState(
-        model=LLM.get(args.llm, json.loads(args.llm_kwargs) if args.llm_kwargs else {}),
-        querier=Querier.get(
+    with profile.phase("import_agent"):
+        from sql_gpt.context import ContextManager
+        from sql_gpt.examples import ExampleStore
+        from sql_gpt.graph import compile_graph
+        from sql_gpt.llm import LLM
+        from sql_gpt.logging import logger
+        from sql_gpt.querier import Querier
+        from sql_gpt.sessions import SessionStore
+        from sql_gpt.state import ChatState
+        from sql_gpt.tracing import JsonlExporter, PrometheusExporter, tracer
+
+    if args.trace_file:
+        tracer.exporters.append(JsonlExporter(args.trace_file))
+    if args.metrics_file:
+        tracer.exporters.append(PrometheusExporter(args.metrics_file))
+
+    with profile.phase("llm"):
+        model = LLM.get(
+            args.llm,
+            json.loads(args.llm_kwargs) if args.llm_kwargs else {},
+            (
+                json.loads(args.llm_cache_kwargs or "{}")
+                if args.llm_cache or args.llm_cache_kwargs
+                else None
+            ),
+        )
+    with profile.phase("querier"):
+        querier = Querier.get(
             args.executor,
             json.loads(args.executor_kwargs) if args.executor_kwargs else {},
-        ),
+        )
+    example_store = None
+    if args.examples or args.examples_kwargs:
+        with profile.phase("examples"):
+            example_store = ExampleStore(**json.loads(args.examples_kwargs or "{}"))
+    with profile.phase("graph"):
+        # compiled once, and reused by the batch runner and the server
+        compile_graph(asynchronous=bool(args.batch))
+
+    if args.batch:
+        with profile.phase("import_batch"):
+            from sql_gpt.batch import open_questions, read_questions, run_batch
+        if args.import_profile:
+            profile.write(args.import_profile)
+        try:
+            with open_questions(args.batch) as questions:
+                run_batch(
+                    model,
+                    querier,
+                    args.load,
+                    read_questions(questions),
+                    sys.stdout,
+                    args.concurrency,
+                    args.max_prompt_tokens,
+                    example_store,
+                )
+        finally:
+            querier.close()
+        sys.exit(0)
+
+    if args.serve:
+        with profile.phase("import_server"):
+            from sql_gpt.server import SessionManager, serve
+        if args.import_profile:
+            profile.write(args.import_profile)
+        host, _, port = args.serve.rpartition(":")
+        serve(
+            SessionManager(
+                model,
+                querier,
+                args.load,
+                max_prompt_tokens=args.max_prompt_tokens,
+                example_store=example_store,
+                **json.loads(args.server_kwargs or "{}"),
+            ),
+            host or "127.0.0.1",
+            int(port),
+        )
+        sys.exit(0)
+
+    session_store = None
+    if args.sessions or args.sessions_kwargs:
+        with profile.phase("sessions"):
+            session_store = SessionStore(**json.loads(args.sessions_kwargs or "{}"))
+    session_id = session_store.create() if session_store is not None else None
+    if session_id is not None:
+        logger.critical(f"This session is saved, resume it later with /resume {session_id}")
+
+    # Initialize ChatState with LLM and Querier
+    chat_state = ChatState(
+        model=model,
+        querier=querier,
+        context_manager=ContextManager(max_tokens=args.max_prompt_tokens),
+        candidates=args.candidates,
+        auto_refresh=args.auto_refresh,
+        consensus=args.consensus,
+        example_store=example_store,
+        session_store=session_store,
+        session_id=session_id,
     )
-    graph = Graph().graph
-    graph.invoke(chat_state, config={"recursion_limit": MAX_AGENT_RECURSION_LIMIT})
+    if args.import_profile:
+        profile.write(args.import_profile)
+    graph = compile_graph()
+    try:
+        graph.invoke(chat_state, config={"recursion_limit": MAX_AGENT_RECURSION_LIMIT})
+    finally:
+        querier.close()
@@ -1,41 +1,187 @@
-from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+import asyncio
+import contextvars
+import glob
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Tuple
 
-from sql_gpt.constants import MAX_RETRY_SQL_GENERATION
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+from sql_gpt.cache import fingerprint
+from sql_gpt.constants import (
+    CLARIFICATION_PREFIX,
+    LOAD_FILE_EXTENSIONS,
+    LOAD_USAGE,
+    LOAD_WORKERS,
+    MAX_RETRY_SQL_GENERATION,
+    REFRESH_USAGE,
+    RESUME_USAGE,
+    SQL_ERROR_PREFIX,
+    SQL_RESULT_PREFIX,
+)
+from sql_gpt.context import PromptStats, count_message_tokens, count_tokens
+from sql_gpt.digest import digest, is_small, render_small
+from sql_gpt.examples import LoadedTable
 from sql_gpt.logging import log, logger
-from sql_gpt.state import ChatState, DataLoadEvent, SqlEvent
+from sql_gpt.querier import (
+    CancelScope,
+    Querier,
+    QueryCancelledError,
+    QueryResult,
+    QueryTimeoutError,
+    ValidationResult,
+    cancel_scope,
+)
+from sql_gpt.retrieval import SchemaIndex
+from sql_gpt.sessions import SessionStore
+from sql_gpt.sql import statement_end
+from sql_gpt.state import Candidate, ChatState, DataLoadEvent, SqlEvent
+from sql_gpt.tracing import tracer
+
+
+def invoke_llm(state: ChatState, prompt: List[BaseMessage]) -> BaseMessage:
+    """
+    Invokes the LLM of the state, tracing the call latency and token counts.
+    """
+    with tracer.span("llm", model=type(state.model).__name__) as span:
+        response = state.model.invoke(prompt)
+        record_usage(span, prompt, response, state.prompt_stats)
+    return response
+
+
+async def ainvoke_llm(state: ChatState, prompt: List[BaseMessage]) -> BaseMessage:
+    """
+    Invokes the LLM of the state asynchronously, tracing the call latency and token counts.
+    """
+    with tracer.span("llm", model=type(state.model).__name__) as span:
+        response = await state.model.ainvoke(prompt)
+        record_usage(span, prompt, response, state.prompt_stats)
+    return response
+
+
+def stream_llm(
+    state: ChatState,
+    prompt: List[BaseMessage],
+    on_chunk: Callable[[str], None] | None = None,
+    is_complete: Callable[[str], bool] | None = None,
+) -> BaseMessage:
+    """
+    Streams the response of the LLM of the state, handing every chunk to `on_chunk`, and stops
+    reading as soon as `is_complete` holds for the text received so far. Traces the call
+    latency, the time to the first chunk and token counts.
+    """
+    with tracer.span("llm", model=type(state.model).__name__, streamed=1) as span:
+        stime = time.perf_counter()
+        chunks: List[str] = []
+        stream = state.model.stream(prompt)
+        try:
+            for chunk in stream:
+                if not chunks and span.recording:
+                    span.set(first_chunk_seconds=time.perf_counter() - stime)
+                chunks.append(chunk)
+                if on_chunk is not None:
+                    on_chunk(chunk)
+                if is_complete is not None and is_complete("".join(chunks)):
+                    state.model.on_stream_complete(prompt, "".join(chunks))
+                    break
+        finally:
+            stream.close()
+        response = AIMessage(content="".join(chunks))
+        record_usage(span, prompt, response, state.prompt_stats)
+    return response
+
+
+def record_usage(
+    span, prompt: List[BaseMessage], response: BaseMessage, stats: PromptStats | None = None
+) -> None:
+    """
+    Records the token counts of an LLM call on its span, estimating missing counts, along with
+    the estimated prefix cache share of the prompt and the cached tokens the provider reports.
+    """
+    if span.recording:
+        usage = getattr(response, "usage_metadata", None) or {}
+        span.set(
+            prompt_tokens=usage.get("input_tokens", count_message_tokens(prompt)),
+            completion_tokens=usage.get("output_tokens", count_tokens(str(response.content))),
+        )
+        if stats is not None:
+            span.set(
+                prefix_tokens=stats.prefix_tokens,
+                estimated_cached_tokens=stats.cached_prefix_tokens,
+                estimated_cached_share=round(stats.cached_prefix_share, 4),
+            )
+        cached = (usage.get("input_token_details") or {}).get("cache_read")
+        if cached is not None:
+            span.set(cached_tokens=cached)
 
 
 def prompter(state: ChatState) -> ChatState:
     """
-    Gets user input and processes special commands (/q to quit, /load to load data).
+    Gets user input and processes special commands (/q to quit, /load to load data, /refresh
+    to ingest new rows of the loaded files, /resume to resume a saved session).
     Updates the state with the new user question or additional clarification details.
     """
-    # print last message content
-    logger.critical(state.messages[-1].content)
-    # get user input prompt
-    user_input = input(">>> User prompt (/q to quit, /load to load data): ")
+    if state.session_store is not None and state.session_id is not None:
+        state.session_store.checkpoint(state)
+    if state.inputs is not None:
+        # scripted session, quit once the inputs are exhausted
+        user_input = state.inputs.pop(0) if state.inputs else "/q"
+    else:
+        # print last message content, unless it was streamed already
+        if not state.last_message_shown:
+            logger.critical(state.messages[-1].content)
+        state.last_message_shown = False
+        # get user input prompt
+        user_input = input(">>> User prompt (/q to quit, /load to load data): ")
     # if requesting to quit, set next step to END
     if user_input.lower().startswith("/q"):
         state.next_step = "END"
     # if requesting to load data, parse the command and set the next step to load_table
     elif user_input.lower().startswith("/load"):
-        try:
-            # Expected format: /load table_name table_columns_description
-            _, table_name, table_columns_description = user_input.split()
+        # Expected format: /load [--union] table_name [table_columns_description]
+        load_args = user_input.split()[1:]
+        union = bool(load_args) and load_args[0] == "--union"
+        load_args = load_args[union:]
+        if len(load_args) in (1, 2):
             state.data_load_event = DataLoadEvent(
-                table_name=table_name,
-                table_columns_description=table_columns_description,
+                table_name=load_args[0],
+                table_columns_description=load_args[1] if len(load_args) == 2 else None,
+                union=union,
             )
             state.next_step = "load_table"
-        except Exception:
-            logger.exception(
-                "Error parsing load command. Expected usage: /load <table_name> "
-                "<table_columns_description>"
+        else:
+            logger.error(f"Error parsing load command. Expected usage: {LOAD_USAGE}")
+            state.update_history(
+                SystemMessage(
+                    content=f"Please load your data first using the command {LOAD_USAGE}"
+                )
             )
+            state.next_step = "prompter"
+    # if requesting to refresh tables, set the next step to refresh_table
+    elif user_input.lower().startswith("/refresh"):
+        state.tables_to_refresh = user_input.split()[1:]
+        state.next_step = "refresh_table"
+    # if requesting to resume a saved session, set the next step to resume_session
+    elif user_input.lower().startswith("/resume"):
+        resume_args = user_input.split()[1:]
+        if state.session_store is None:
+            state.update_history(
+                SystemMessage(content="Sessions are not saved, enable them with --sessions.")
+            )
+            state.next_step = "prompter"
+        elif len(resume_args) == 1:
+            state.resume_session_id = resume_args[0]
+            state.next_step = "resume_session"
+        else:
+            logger.error(f"Error parsing resume command. Expected usage: {RESUME_USAGE}")
             state.update_history(
                 SystemMessage(
-                    content="Please load your data first using the command /load <table_name> "
-                    "<table_columns_description>"
+                    content=f"Please resume a session using the command {RESUME_USAGE}. "
+                    f"Recent sessions: {', '.join(state.session_store.list())}"
                 )
             )
             state.next_step = "prompter"
@@ -43,60 +189,319 @@ def prompter(state: ChatState) -> ChatState:
     elif not state.table_schemas:
         # If no table schemas are loaded, inform the user.
         state.update_history(
-            SystemMessage(
-                content="Please load your data first using the command /load <table_name> "
-                "<table_columns_description>"
-            )
+            SystemMessage(content=f"Please load your data first using the command {LOAD_USAGE}")
         )
         state.next_step = "prompter"
     # otherwise it is a user question to parse
     else:
         # This new input could be a new question or clarification details.
+        # Reset the SQL event state, keeping the question a clarification refers to.
+        original_question = None
+        if state.sql_event.clarifying:
+            original_question = state.sql_event.original_question or state.sql_event.user_question
+        state.sql_event = SqlEvent(user_question=user_input, original_question=original_question)
+        if state.auto_refresh:
+            # tables reused from a resumed session are not tracked until loaded again
+            changed = {
+                table_name
+                for table_name in state.loaded_tables
+                if state.querier.table_path(table_name) is None
+            }
+            changed |= set(state.querier.changed_tables()) & set(state.loaded_tables)
+            if changed:
+                refresh_tables(state, sorted(changed))
+        state.select_schemas(user_input)
+        state.select_examples(user_input)
         state.update_history(HumanMessage(content=user_input))
-        # Reset the SQL event state.
-        state.sql_event = SqlEvent(user_question=user_input)
         state.next_step = "build_query"
     return state
 
 
+async def aprompter(state: ChatState) -> ChatState:
+    """
+    Asynchronous prompter, waiting for interactive input in a worker thread.
+    """
+    if state.inputs is None:
+        return await asyncio.to_thread(prompter, state)
+    return prompter(state)
+
+
+def expand_paths(pattern: str) -> List[str]:
+    """
+    Expands a directory or glob pattern into the sorted list of data files it contains.
+    """
+    if os.path.isdir(pattern):
+        return sorted(
+            os.path.join(pattern, name)
+            for name in os.listdir(pattern)
+            if name.lower().removesuffix(".gz").endswith(LOAD_FILE_EXTENSIONS)
+        )
+    if glob.has_magic(pattern):
+        return sorted(glob.glob(pattern, recursive=True))
+    return [pattern]
+
+
+def load_file(
+    state: ChatState, path: str, table_columns_description: str | None
+) -> Tuple[str | None, str, LoadedTable | None]:
+    """
+    Loads a single file into a table, and reads or generates its column descriptions.
+    """
+    try:
+        table_name = state.querier.load_table(path)
+    except Exception as e:
+        logger.exception("Error loading data into DuckDB. Please check the file path and format.")
+        return None, f"Loading data from '{path}' failed with error:{str(e)}", None
+
+    try:
+        if table_columns_description:
+            with open(table_columns_description, "r") as fp:
+                meta = fp.read()
+        else:
+            meta = state.querier.describe_table(table_name)
+        loaded = LoadedTable(
+            path=path,
+            table_columns_description=table_columns_description,
+            schema_fingerprint=schema_fingerprint(state.querier, table_name, meta),
+            meta=meta,
+        )
+    except Exception as e:
+        logger.exception("Error loading data into DuckDB. Please check the file path and format.")
+        return None, f"Loading table column schemas failed with error:{str(e)}", None
+    return table_name, meta, loaded
+
+
+def schema_fingerprint(querier: Querier, table_name: str, meta: str) -> str:
+    """
+    Fingerprints the table by its column names and types, or by its descriptions if the
+    querier cannot list the columns.
+    """
+    columns = querier.table_columns(table_name)
+    return fingerprint(json.dumps(columns) if columns else meta)
+
+
 @log
 def load_table(state: ChatState) -> ChatState:
     """
     If applicable load files to tables, reads table column metadata, and appends the table schema
     to the state.
+
+    Directories and glob patterns load each matching file into its own table, concurrently,
+    or with the union option all files of a glob pattern into a single table.
+    Without a column description file, the descriptions are generated from the table data.
     """
-    table_name = state.data_load_event.table_name
+    pattern: str = state.data_load_event.table_name  # type: ignore
+    paths = expand_paths(pattern)
+    if state.data_load_event.union and paths:
+        paths = [pattern]
     table_columns_description = state.data_load_event.table_columns_description
     state.next_step = "prompter"
+    if not paths:
+        state.update_history(
+            SystemMessage(content=f"No data files found in '{state.data_load_event.table_name}'.")
+        )
+        return state
 
-    try:
-        table_name = state.querier.load_table(table_name)  # type: ignore
-    except Exception as e:
-        logger.exception("Error loading data into DuckDB. Please check the file path and format.")
-        state.update_history(SystemMessage(content=f"Loading data failed with error:{str(e)}"))
+    with ThreadPoolExecutor(max_workers=min(LOAD_WORKERS, len(paths))) as pool:
+        loads = list(
+            pool.map(lambda path: load_file(state, path, table_columns_description), paths)
+        )
+
+    for table_name, meta, loaded in loads:
+        if table_name is None:
+            state.update_history(SystemMessage(content=meta))
+            continue
+        state.loaded_tables[table_name] = loaded
+        # Append the loaded table info to the state.
+        table_info = f"Table: {table_name}\n{meta}\n"
+        state.table_schemas += table_info
+        state.schema_index.add_table(table_name, meta)
+        # Update conversation history.
+        state.update_history(
+            SystemMessage(content=f"Table '{table_name}' loaded with metadata:\n{table_info}")
+        )
+    state.model.on_schema_change(state.table_schemas)
+    if state.example_store is not None:
+        # examples of files whose schema changed no longer apply
+        state.example_store.prune(state.loaded_tables)
+    return state
+
+
+async def aload_table(state: ChatState) -> ChatState:
+    """
+    Asynchronous table loader, loading the files in a worker thread.
+    """
+    return await asyncio.to_thread(load_table, state)
+
+
+def refresh_tables(state: ChatState, table_names: List[str]) -> List[str]:
+    """
+    Refreshes the tables from their files concurrently, and updates the schemas of the tables
+    that changed. Returns a summary line per table.
+    """
+
+    def refresh(table_name: str) -> str:
+        try:
+            refresh = state.querier.refresh_table(table_name, state.loaded_tables[table_name].path)
+            if not refresh.changed:
+                return f"Table '{table_name}' is up to date, at version {refresh.version}."
+            loaded = state.loaded_tables[table_name]
+            meta = (
+                loaded.meta
+                if loaded.table_columns_description
+                else state.querier.describe_table(table_name)
+            )
+            state.loaded_tables[table_name] = loaded.model_copy(
+                update={
+                    "meta": meta,
+                    "schema_fingerprint": schema_fingerprint(state.querier, table_name, meta),
+                }
+            )
+        except Exception as e:
+            logger.exception(f"Error refreshing table '{table_name}'.")
+            return f"Refreshing table '{table_name}' failed with error:{str(e)}"
+        change = f"{refresh.appended_rows} rows appended" + (
+            f", {refresh.new_files} new files" if refresh.new_files else ""
+        )
+        if refresh.rebuilt:
+            change = "loaded again from its files"
+        return (
+            f"Table '{table_name}' refreshed to version {refresh.version}, {change} in "
+            f"{refresh.seconds:.2f} seconds."
+        )
+
+    with ThreadPoolExecutor(max_workers=max(min(LOAD_WORKERS, len(table_names)), 1)) as pool:
+        summaries = list(pool.map(refresh, table_names))
+
+    state.table_schemas = "".join(
+        f"Table: {table_name}\n{table.meta}\n" for table_name, table in state.loaded_tables.items()
+    )
+    for table_name in table_names:
+        state.schema_index.add_table(table_name, state.loaded_tables[table_name].meta)
+    state.model.on_schema_change(state.table_schemas)
+    if state.example_store is not None:
+        state.example_store.prune(state.loaded_tables)
+    return summaries
+
+
+@log
+def refresh_table(state: ChatState) -> ChatState:
+    """
+    Ingests the rows appended to the files of the requested tables, or of all loaded tables,
+    keeping the table names.
+    """
+    state.next_step = "prompter"
+    if not state.loaded_tables:
+        state.update_history(
+            SystemMessage(content=f"Please load your data first using the command {LOAD_USAGE}")
+        )
+        return state
+    unknown = [name for name in state.tables_to_refresh if name not in state.loaded_tables]
+    if unknown:
+        state.update_history(
+            SystemMessage(
+                content=f"Unknown tables {', '.join(unknown)}. Expected usage: {REFRESH_USAGE} "
+                f"with tables among {', '.join(state.loaded_tables)}."
+            )
+        )
         return state
+    summaries = refresh_tables(state, state.tables_to_refresh or list(state.loaded_tables))
+    state.update_history(SystemMessage(content="\n".join(summaries)))
+    return state
+
+
+async def arefresh_table(state: ChatState) -> ChatState:
+    """
+    Asynchronous table refresh, ingesting the files in a worker thread.
+    """
+    return await asyncio.to_thread(refresh_table, state)
+
 
-    # Load metadata
+def restore_table(
+    state: ChatState, table_name: str, table: LoadedTable
+) -> Tuple[LoadedTable | None, str]:
+    """
+    Restores a table of a saved session under its saved name. A table the database still
+    holds with the same columns is reused as is, otherwise it is loaded again from its file.
+    """
     try:
-        with open(table_columns_description, "r") as fp:  # type: ignore
-            meta = fp.read()
+        reusable = state.querier.table_path(table_name) in (None, table.path) and (
+            schema_fingerprint(state.querier, table_name, table.meta) == table.schema_fingerprint
+        )
+    except Exception:
+        reusable = False
+    if reusable:
+        return table, ""
+    try:
+        state.querier.load_table(table.path, name=table_name)
+        table_fingerprint = schema_fingerprint(state.querier, table_name, table.meta)
     except Exception as e:
-        logger.exception("Error loading data into DuckDB. Please check the file path and format.")
+        logger.exception(f"Error restoring table '{table_name}' from '{table.path}'.")
+        return None, f"Restoring table '{table_name}' from '{table.path}' failed with error:{e}"
+    return table.model_copy(update={"schema_fingerprint": table_fingerprint}), ""
+
+
+@log
+def resume_session(state: ChatState) -> ChatState:
+    """
+    Resumes a saved session: its history, and its tables restored concurrently.
+    """
+    stime = time.perf_counter()
+    state.next_step = "prompter"
+    store: SessionStore = state.session_store  # type: ignore
+    saved = store.load(state.resume_session_id)  # type: ignore
+    if saved is None:
         state.update_history(
-            SystemMessage(content=f"Loading table column schemas failed with error:{str(e)}")
+            SystemMessage(
+                content=f"Unknown session '{state.resume_session_id}'. "
+                f"Recent sessions: {', '.join(store.list())}"
+            )
         )
         return state
 
-    # Append the loaded table info to the state.
-    table_info = f"Table: {table_name}\n{meta}\n"
-    state.table_schemas += table_info
-    # Update conversation history.
+    with ThreadPoolExecutor(max_workers=max(min(LOAD_WORKERS, len(saved.tables)), 1)) as pool:
+        restored = list(
+            pool.map(lambda item: restore_table(state, *item), list(saved.tables.items()))
+        )
+
+    state.session_id = saved.session_id
+    state.messages = saved.messages
+    state.question_retries = saved.question_retries
+    state.sql_event = SqlEvent()
+    state.table_schemas = ""
+    state.schema_index = SchemaIndex()
+    state.loaded_tables = {}
+    errors = []
+    for table_name, (table, message) in zip(saved.tables, restored):
+        if table is None:
+            errors.append(message)
+            continue
+        state.table_schemas += f"Table: {table_name}\n{table.meta}\n"
+        state.schema_index.add_table(table_name, table.meta)
+        state.loaded_tables[table_name] = table
+    state.model.on_schema_change(state.table_schemas)
     state.update_history(
-        SystemMessage(content=f"Table '{table_name}' loaded with metadata:\n{table_info}")
+        SystemMessage(
+            content="\n".join(
+                [
+                    f"Session '{saved.session_id}' resumed with {len(state.loaded_tables)} "
+                    f"tables and {len(saved.messages)} messages in "
+                    f"{time.perf_counter() - stime:.2f} seconds.",
+                    *errors,
+                ]
+            )
+        )
     )
     return state
 
 
+async def aresume_session(state: ChatState) -> ChatState:
+    """
+    Asynchronous session resume, restoring the tables in a worker thread.
+    """
+    return await asyncio.to_thread(resume_session, state)
+
+
 @log
 def build_query(state: ChatState) -> ChatState:
     """
@@ -112,24 +517,257 @@ def build_query(state: ChatState) -> ChatState:
         the query.
 
     Returns only the SQL query text (or a clarification question) without extra commentary.
+
+    The response is streamed, and reading stops as soon as a complete SQL statement arrived,
+    without waiting for trailing fences, whitespace or commentary.
+
+    With several candidates configured, the candidates are generated at once and tried in
+    parallel instead.
+    """
+    if state.candidates > 1:
+        return speculate_query(state)
+    return parse_query_response(
+        state, stream_llm(state, state.get_history(), is_complete=is_query_complete)
+    )
+
+
+@log
+async def abuild_query(state: ChatState) -> ChatState:
     """
-    llm_response = state.model.invoke(state.get_history())
+    Asynchronous version of `build_query`.
+    """
+    if state.candidates > 1:
+        return await asyncio.to_thread(speculate_query, state)
+    return parse_query_response(state, await ainvoke_llm(state, state.get_history()))
+
 
+def is_query_complete(text: str) -> bool:
+    """
+    Returns whether the streamed response holds a complete SQL statement, terminated by a
+    semicolon or a closing code fence. Clarification questions are read in full.
+    """
+    text = text.lstrip()
+    if text.startswith("[CLARIFICATION]") or "[CLARIFICATION]".startswith(text):
+        return False
+    if text.startswith("```"):
+        body, fence, _ = text[3:].partition("```")
+        if fence:
+            return True
+        text = body.removeprefix("sql")
+    return statement_end(text) is not None
+
+
+def parse_query_response(state: ChatState, llm_response: BaseMessage) -> ChatState:
+    """
+    Records the generated SQL query, or routes a clarification question back to the user.
+    """
     # If a clarification is needed, ask for more details.
-    if llm_response.content.startswith("[CLARIFICATION]"):
+    if llm_response.content.lstrip().startswith("[CLARIFICATION]"):
         clarification_text = llm_response.content.split("[CLARIFICATION]")[1].strip()
         clarification_msg = (
-            "Your question is ambiguous. "
-            f"Please provide additional details: {clarification_text}"
+            f"{CLARIFICATION_PREFIX} Please provide additional details: {clarification_text}"
         )
         state.update_history(AIMessage(content=clarification_msg))
+        state.sql_event.clarifying = True
         state.next_step = "prompter"
         return state
 
-    query_text = llm_response.content.replace("```sql", "").replace("```", "").strip()
+    query_text = clean_query(llm_response.content)
     logger.debug(query_text)
     state.update_history(AIMessage(content=query_text))
     state.sql_event.sql_text = query_text
+    state.next_step = "validate_query"
+    return state
+
+
+def clean_query(text: str) -> str:
+    """
+    Strips code fences and any text following the first complete SQL statement.
+    """
+    query_text = text.replace("```sql", "").replace("```", "").strip()
+    end = statement_end(query_text)
+    return query_text[:end] if end is not None else query_text
+
+
+def speculate_query(state: ChatState) -> ChatState:
+    """
+    Generates several SQL candidates at once, and validates and executes them in parallel.
+    The first candidate to succeed is kept, or with consensus the earliest candidate of the
+    largest group of identical results. If all candidates fail, they count as a single retry.
+
+    The wall-clock time is traced against an estimate of the serial retry loop, which would
+    have paid a generation and a try for every failed candidate before the chosen one.
+    """
+    with tracer.span("speculate", candidates=state.candidates) as span:
+        stime = time.perf_counter()
+        prompt = state.get_history()
+        with tracer.span("llm", model=type(state.model).__name__) as llm_span:
+            responses = state.model.candidates(prompt, state.candidates)
+            record_usage(
+                llm_span,
+                prompt,
+                AIMessage(content="\n".join(str(response.content) for response in responses)),
+                state.prompt_stats,
+            )
+        llm_seconds = time.perf_counter() - stime
+        queries = [
+            clean_query(str(response.content))
+            for response in responses
+            if not str(response.content).lstrip().startswith("[CLARIFICATION]")
+        ]
+        if not queries:
+            return parse_query_response(state, responses[0])
+
+        outcomes = try_candidates(state.querier, queries, state.consensus)
+        chosen = pick_candidate(outcomes, state.consensus)
+        wall_seconds = time.perf_counter() - stime
+        # the serial loop pays a generation and a try for every failed candidate, and a
+        # final one for the successful candidate
+        tried = [outcome for outcome in outcomes if outcome.sql_result is None]
+        tried += [chosen] if chosen is not None else []
+        serial_seconds = sum(llm_seconds + outcome.seconds for outcome in tried)
+        logger.debug(
+            f"Speculated {len(queries)} candidates in {wall_seconds:.2f} seconds, against an "
+            f"estimated {serial_seconds:.2f} seconds for serial retries."
+        )
+        if span.recording:
+            span.set(
+                succeeded=sum(outcome.sql_result is not None for outcome in outcomes),
+                failed=sum(outcome.sql_result is None for outcome in outcomes),
+                wall_seconds=wall_seconds,
+                serial_estimate_seconds=serial_seconds,
+            )
+
+    if chosen is not None:
+        state.update_history(AIMessage(content=chosen.sql_text))
+        state.sql_event.sql_text = chosen.sql_text
+        return record_query_result(state, chosen.sql_result)  # type: ignore
+    state.update_history(AIMessage(content=queries[0]))
+    state.sql_event.sql_text = queries[0]
+    errors = sorted(outcomes, key=lambda outcome: outcome.index)
+    return handle_sql_error(
+        state,
+        "\n".join(dict.fromkeys(str(outcome.error) for outcome in errors)),
+        any(outcome.schema_error for outcome in errors),
+    )
+
+
+def try_candidates(querier: Querier, queries: List[str], consensus: bool) -> List[Candidate]:
+    """
+    Validates and executes the candidate queries in parallel, on cursors of the querier.
+    Without consensus it stops as soon as a candidate succeeds, interrupting the queries of
+    the other candidates and waiting for them to release their cursors.
+    """
+    scope = CancelScope()
+    pool = ThreadPoolExecutor(max_workers=len(queries))
+    futures = [
+        pool.submit(contextvars.copy_context().run, try_candidate, querier, index, sql_text, scope)
+        for index, sql_text in enumerate(queries)
+    ]
+    outcomes = []
+    for future in as_completed(futures):
+        outcomes.append(future.result())
+        if not consensus and outcomes[-1].sql_result is not None:
+            break
+    scope.cancel()
+    pool.shutdown(wait=True, cancel_futures=True)
+    return outcomes
+
+
+def try_candidate(
+    querier: Querier, index: int, sql_text: str, scope: CancelScope | None = None
+) -> Candidate:
+    """
+    Validates and executes a single candidate query, in the cancel scope if given.
+    """
+    if scope is not None:
+        cancel_scope.set(scope)
+    stime = time.perf_counter()
+    candidate = Candidate(index=index, sql_text=sql_text)
+    validation = querier.validate(sql_text)
+    if validation.errors:
+        candidate.error = "\n".join(validation.errors)
+        candidate.schema_error = validation.schema_error
+    else:
+        try:
+            candidate.sql_result = querier.query(sql_text)
+        except Exception as e:
+            candidate.error = str(e)
+            candidate.schema_error = querier.is_schema_error(e)
+    candidate.seconds = time.perf_counter() - stime
+    return candidate
+
+
+def pick_candidate(outcomes: List[Candidate], consensus: bool) -> Candidate | None:
+    """
+    Picks the first successful candidate, or with consensus the earliest candidate of the
+    largest group of identical results.
+    """
+    succeeded = [outcome for outcome in outcomes if outcome.sql_result is not None]
+    if not succeeded:
+        return None
+    if not consensus:
+        return succeeded[0]
+    groups: Dict[str, List[Candidate]] = defaultdict(list)
+    for outcome in sorted(succeeded, key=lambda outcome: outcome.index):
+        result = outcome.sql_result
+        groups[repr((result.columns, result.data))].append(outcome)  # type: ignore
+    return max(groups.values(), key=lambda group: (len(group), -group[0].index))[0]
+
+
+def handle_sql_error(state: ChatState, error: str, schema_error: bool = False) -> ChatState:
+    """
+    Records a failed SQL attempt, and routes back to query regeneration until the retry limit.
+    """
+    state.sql_event.sql_result = None
+    state.sql_event.error = error
+    state.sql_event.retry_count += 1
+    if not state.sql_event.full_schema and schema_error:
+        # the selected schemas missed a table or column, retry with all schemas
+        state.sql_event.full_schema = True
+    if state.sql_event.retry_count > MAX_RETRY_SQL_GENERATION:
+        state.update_history(
+            AIMessage(
+                content="Sorry, I was unable to execute the user requests "
+                "after several attempts."
+            )
+        )
+        state.record_retries()
+        state.next_step = "prompter"
+    else:
+        state.update_history(AIMessage(content=f"{SQL_ERROR_PREFIX}\n{error}\n"))
+        state.next_step = "build_query"
+    return state
+
+
+@log
+def validate_query(state: ChatState) -> ChatState:
+    """
+    Validates the generated SQL query against the loaded tables without executing it.
+    Invalid or dangerous queries are sent back for regeneration with compact error hints.
+    """
+    validation = state.querier.validate(state.sql_event.sql_text)  # type: ignore
+    return apply_validation(state, validation)
+
+
+@log
+async def avalidate_query(state: ChatState) -> ChatState:
+    """
+    Asynchronous version of `validate_query`.
+    """
+    validation = await state.querier.avalidate(state.sql_event.sql_text)  # type: ignore
+    return apply_validation(state, validation)
+
+
+def apply_validation(state: ChatState, validation: ValidationResult) -> ChatState:
+    """
+    Routes a valid query to execution, and an invalid one back to regeneration.
+    """
+    for warning in validation.warnings:
+        logger.debug(f"SQL validation warning: {warning}")
+    if validation.errors:
+        logger.error(f"SQL validation failed: {' '.join(validation.errors)}")
+        return handle_sql_error(state, "\n".join(validation.errors), validation.schema_error)
     state.next_step = "execute_query"
     return state
 
@@ -142,29 +780,48 @@ def execute_query(state: ChatState) -> ChatState:
     """
     try:
         result = state.querier.query(state.sql_event.sql_text)  # type: ignore
-        state.sql_event.sql_result = result
-        state.sql_event.error = None
-        state.next_step = "post_execution"
     except Exception as e:
-        state.sql_event.sql_result = None
-        state.sql_event.error = str(e)
-        state.sql_event.retry_count += 1
-        logger.exception("SQL execution failed with error: %s", str(e))
-        if state.sql_event.retry_count > MAX_RETRY_SQL_GENERATION:
-            state.update_history(
-                AIMessage(
-                    content="Sorry, I was unable to execute the user requests "
-                    "after several attempts."
-                )
-            )
-            state.next_step = "prompter"
-        else:
-            state.update_history(
-                AIMessage(
-                    content=(f"Generated SQL query raised this error:\n{state.sql_event.error}\n")
-                )
-            )
-            state.next_step = "build_query"
+        return record_query_error(state, e)
+    return record_query_result(state, result)
+
+
+@log
+async def aexecute_query(state: ChatState) -> ChatState:
+    """
+    Asynchronous version of `execute_query`.
+    """
+    try:
+        result = await state.querier.aquery(state.sql_event.sql_text)  # type: ignore
+    except Exception as e:
+        return record_query_error(state, e)
+    return record_query_result(state, result)
+
+
+def record_query_result(state: ChatState, result: QueryResult) -> ChatState:
+    """
+    Records the query result, and routes it to interpretation.
+    """
+    state.sql_event.sql_result = result
+    state.sql_event.error = None
+    state.next_step = "post_execution"
+    return state
+
+
+def record_query_error(state: ChatState, error: Exception) -> ChatState:
+    """
+    Returns to the user on cancellation, and otherwise routes the error to query regeneration.
+    """
+    if isinstance(error, QueryCancelledError):
+        logger.error(str(error))
+        state.sql_event.error = str(error)
+        state.update_history(AIMessage(content=str(error)))
+        state.next_step = "prompter"
+    elif isinstance(error, QueryTimeoutError):
+        logger.error(str(error))
+        handle_sql_error(state, str(error))
+    else:
+        logger.error(f"SQL execution failed with error: {error}", exc_info=error)
+        handle_sql_error(state, str(error), state.querier.is_schema_error(error))
     return state
 
 
@@ -172,21 +829,80 @@ def execute_query(state: ChatState) -> ChatState:
 def post_execution(state: ChatState) -> ChatState:
     """
     Processes the SQL query result and generates a concise, human-readable summary.
+    Small results are shown as they are, while larger results are reduced to a compact digest
+    before being summarized by the LLM. In an interactive session the summary is printed as it
+    streams in.
+    """
+    prompt = interpretation_prompt(state)
+    if prompt is None:
+        return state
+    if state.inputs is not None:
+        return record_answer(state, str(invoke_llm(state, prompt).content))
+    response = stream_llm(state, prompt, on_chunk=print_chunk)
+    print_chunk("\n")
+    state.last_message_shown = True
+    return record_answer(state, str(response.content))
+
+
+def print_chunk(chunk: str) -> None:
+    sys.stdout.write(chunk)
+    sys.stdout.flush()
+
+
+@log
+async def apost_execution(state: ChatState) -> ChatState:
     """
-    sql_results = AIMessage(content=f"SQL results are: {state.sql_event.sql_result}")
+    Asynchronous version of `post_execution`.
+    """
+    prompt = interpretation_prompt(state)
+    if prompt is None:
+        return state
+    return record_answer(state, str((await ainvoke_llm(state, prompt)).content))
+
+
+def interpretation_prompt(state: ChatState) -> List[BaseMessage] | None:
+    """
+    Returns the prompt to interpret the query result with, or None if the result is small
+    enough to be the answer itself.
+    """
+    result = state.sql_event.sql_result
+    if is_small(result):  # type: ignore
+        record_answer(state, render_small(result))  # type: ignore
+        return None
+
+    sql_results = AIMessage(content=f"{SQL_RESULT_PREFIX}{digest(result)}")  # type: ignore
     state.update_history(sql_results)
-    interpret_msgs = [
-        SystemMessage(
-            content="You are an intelligent assistant that summarizes SQL query results based on "
-            f"given table schemas. \nTable Schemas: {state.table_schemas}"
-        ),
-        HumanMessage(content=state.sql_event.user_question),
-        AIMessage(content=f"Generated SQL Text is: {state.sql_event.sql_text}"),
-        sql_results,
-    ]
-    llm_response = state.model.invoke(interpret_msgs)
-    state.update_history(AIMessage(content=llm_response.content))
-    state.sql_event.ai_response = llm_response.content
+    prompt, state.prompt_stats = state.prompt_builder.build(
+        "interpretation",
+        state.table_schemas,
+        [
+            HumanMessage(content=state.sql_event.user_question),
+            AIMessage(content=f"Generated SQL Text is: {state.sql_event.sql_text}"),
+            sql_results,
+        ],
+    )
+    return prompt
+
+
+def record_answer(state: ChatState, answer: str) -> ChatState:
+    """
+    Records the answer to the question, and returns to the user.
+    """
+    state.update_history(AIMessage(content=answer))
+    state.sql_event.ai_response = answer
+    state.record_retries()
+    if (
+        state.example_store is not None
+        and state.sql_event.sql_text
+        and state.sql_event.sql_result is not None
+    ):
+        # a question answered by a successful query becomes a few-shot example, stored under
+        # the question itself rather than a reply to a clarification question
+        state.example_store.add(
+            state.sql_event.original_question or state.sql_event.user_question,
+            state.sql_event.sql_text,
+            state.loaded_tables,
+        )
     state.next_step = "prompter"
     return state
 
@@ -0,0 +1,175 @@
+"""
+Non-interactive batch mode, answering questions from a JSONL file concurrently.
+
+Every input line is either a JSON object with a "question" and an optional "id", or a plain
+question. Tables are loaded once before the batch, and every question is answered in its own
+chat session over the shared database. Results are written as JSONL in completion order.
+"""
+
+import asyncio
+import json
+import sys
+import time
+from typing import IO, Any, Dict, Iterable, Iterator, List, Set, Tuple
+
+from sql_gpt.constants import (
+    BATCH_CONCURRENCY,
+    MAX_AGENT_RECURSION_LIMIT,
+    MAX_PROMPT_TOKENS,
+)
+from sql_gpt.context import ContextManager
+from sql_gpt.digest import digest
+from sql_gpt.examples import ExampleStore
+from sql_gpt.llm import LLM
+from sql_gpt.logging import log_to_stderr, logger
+from sql_gpt.querier import Querier
+from sql_gpt.state import ChatState, DataLoadEvent
+from sql_gpt.tracing import tracer
+
+
+def read_questions(lines: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """
+    Parses the batch input lines into question records, numbering records without an id.
+    """
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line) if line.startswith("{") else {"question": line}
+        record.setdefault("id", number)
+        yield record
+
+
+def load_tables(state: ChatState, loads: List[List[str]]) -> None:
+    """
+    Loads the tables of the batch once, as the /load command would.
+    """
+    from sql_gpt.agents import load_table
+
+    for load_args in loads:
+        state.data_load_event = DataLoadEvent(
+            table_name=load_args[0],
+            table_columns_description=load_args[1] if len(load_args) > 1 else None,
+        )
+        load_table(state)
+    if not state.table_schemas:
+        raise ValueError("No tables were loaded for the batch.")
+
+
+async def answer(graph, base: ChatState, record: Dict[str, Any], max_prompt_tokens: int) -> dict:
+    """
+    Answers a single question in its own chat session over the tables of the base session.
+    """
+    state = ChatState(
+        model=base.model,
+        querier=base.querier,
+        table_schemas=base.table_schemas,
+        schema_index=base.schema_index,
+        loaded_tables=base.loaded_tables,
+        example_store=base.example_store,
+        prompt_builder=base.prompt_builder,
+        context_manager=ContextManager(max_tokens=max_prompt_tokens),
+        inputs=[record["question"]],
+    )
+    stime = time.perf_counter()
+    output: Dict[str, Any] = {"id": record["id"], "question": record["question"]}
+    try:
+        with tracer.span("batch_question", question_id=str(record["id"])):
+            final_state = await graph.ainvoke(
+                state, config={"recursion_limit": MAX_AGENT_RECURSION_LIMIT}
+            )
+    except Exception as e:
+        logger.exception(f"Batch question {record['id']} failed.")
+        output["error"] = str(e)
+    else:
+        sql_event = final_state["sql_event"]
+        output.update(
+            sql=sql_event.sql_text,
+            digest=digest(sql_event.sql_result) if sql_event.sql_result else None,
+            answer=sql_event.ai_response or final_state["messages"][-1].content,
+            retries=sql_event.retry_count,
+            error=sql_event.error,
+        )
+    output["seconds"] = time.perf_counter() - stime
+    return output
+
+
+async def answer_all(
+    graph,
+    base: ChatState,
+    questions: Iterable[Dict[str, Any]],
+    output: IO[str],
+    concurrency: int,
+    max_prompt_tokens: int,
+) -> Tuple[int, int]:
+    """
+    Answers the questions as concurrent tasks, reading the next question whenever fewer than
+    `concurrency` are in flight, and returns the number of answered and failed questions.
+    """
+    count, failed = 0, 0
+    pending: Set[asyncio.Task] = set()
+    records, exhausted = iter(questions), False
+    while pending or not exhausted:
+        while not exhausted and len(pending) < concurrency:
+            # the input may be a pipe, so read it without blocking the running sessions
+            record = await asyncio.to_thread(next, records, None)
+            if record is None:
+                exhausted = True
+            else:
+                pending.add(asyncio.create_task(answer(graph, base, record, max_prompt_tokens)))
+        if not pending:
+            break
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            result = task.result()
+            count += 1
+            failed += int(result.get("error") is not None)
+            output.write(json.dumps(result, default=str) + "\n")
+        output.flush()
+    return count, failed
+
+
+def run_batch(
+    model: LLM,
+    querier: Querier,
+    loads: List[List[str]],
+    questions: Iterable[Dict[str, Any]],
+    output: IO[str],
+    concurrency: int = BATCH_CONCURRENCY,
+    max_prompt_tokens: int = MAX_PROMPT_TOKENS,
+    example_store: ExampleStore | None = None,
+) -> dict:
+    """
+    Answers the questions through the asynchronous graph with up to `concurrency` sessions in
+    flight, writing every result as a JSON line as soon as it completes, and returns
+    throughput statistics. Logs go to stderr when the results are written to stdout.
+    """
+    from sql_gpt.graph import Graph
+
+    if output is sys.stdout:
+        log_to_stderr()
+    base = ChatState(model=model, querier=querier, example_store=example_store)
+    load_tables(base, loads)
+    graph = Graph(asynchronous=True).graph
+
+    stime = time.perf_counter()
+    count, failed = asyncio.run(
+        answer_all(graph, base, questions, output, concurrency, max_prompt_tokens)
+    )
+    total_seconds = time.perf_counter() - stime
+    stats = {
+        "questions": count,
+        "failed": failed,
+        "concurrency": concurrency,
+        "total_seconds": total_seconds,
+        "questions_per_second": count / total_seconds if total_seconds else 0.0,
+    }
+    logger.info(f"Batch stats: {stats}")
+    return stats
+
+
+def open_questions(path: str) -> IO[str]:
+    """
+    Opens the batch input, reading from stdin for "-".
+    """
+    return sys.stdin if path == "-" else open(path, "r")
@@ -0,0 +1,305 @@
+"""
+Offline benchmark of the SQL GPT graph, with a scripted LLM and synthetic data.
+
+Example:
+    python -m sql_gpt.benchmark \
+        --script example_data/apple_sales_2024_script.jsonl \
+        --schema example_data/apple_sales_2024_schema.txt \
+        --rows 10000000 --format parquet
+
+    python -m sql_gpt.benchmark --startup
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from sql_gpt.constants import MAX_AGENT_RECURSION_LIMIT, STARTUP_BUDGET_SECONDS
+from sql_gpt.tracing import Span, tracer
+
+# States and regions of example_data/apple_sales_2024.csv
+STATES = {
+    "Europe": ["France", "Germany", "Italy", "Spain", "UK"],
+    "Greater China": ["Beijing", "Chongqing", "Hong Kong", "Shanghai", "Shenzhen"],
+    "North America": ["California", "Florida", "Illinois", "New York", "Texas"],
+    "Rest of Asia": ["India", "Indonesia", "Japan", "South Korea", "Thailand"],
+    "Rest of World": ["Australia", "Brazil", "Canada", "Mexico", "South Africa"],
+}
+# Value ranges of the sales columns of example_data/apple_sales_2024.csv
+SALES_RANGES = {
+    "iPhoneSales": (5, 30),
+    "iPadSales": (2, 15),
+    "MacSales": (1, 10),
+    "Wearables": (2, 12),
+    "ServicesRevenue": (5, 20),
+}
+
+
+def generate_sales_data(path: str, rows: int, seed: int = 0) -> str:
+    """
+    Writes a deterministic synthetic dataset shaped like example_data/apple_sales_2024.csv,
+    as CSV or Parquet depending on the file extension, and returns its path.
+    Data is generated by DuckDB in a streaming fashion, so it scales to hundreds of millions
+    of rows.
+    """
+    import duckdb
+
+    states = ", ".join(
+        f"({i}, '{state}', '{region}')"
+        for i, (state, region) in enumerate(
+            (state, region) for region, names in STATES.items() for state in names
+        )
+    )
+    columns = ", ".join(
+        f"round({low} + (hash(range, {seed}, {i}) % 1000000) / 1000000 * {high - low}, 2) "
+        f"AS {name}"
+        for i, (name, (low, high)) in enumerate(SALES_RANGES.items())
+    )
+    file_format = "PARQUET" if path.endswith(".parquet") else "CSV, HEADER"
+    duckdb.connect().execute(
+        f"COPY (SELECT s.state AS State, s.region AS Region, {columns} "
+        f"FROM range({rows}) JOIN (VALUES {states}) AS s(id, state, region) "
+        f"ON s.id = hash(range, {seed}) % {sum(map(len, STATES.values()))}) "
+        f"TO '{path}' (FORMAT {file_format});"
+    )
+    return path
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """
+    Returns count, total, mean, median, 95th and 99th percentiles and maximum of the values.
+    """
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    return {
+        "count": len(values),
+        "total": sum(values),
+        "mean": statistics.fmean(values),
+        "p50": statistics.median(values),
+        "p95": ordered[min(int(len(values) * 0.95), len(values) - 1)],
+        "p99": ordered[min(int(len(values) * 0.99), len(values) - 1)],
+        "max": ordered[-1],
+    }
+
+
+def peak_rss_bytes() -> int:
+    """
+    Returns the peak resident memory of the process.
+    """
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_benchmark(
+    script: str,
+    data_path: str,
+    schema_path: str | None = None,
+    llm_delay: float = 0.0,
+    executor_kwargs: dict | None = None,
+    candidates: int = 1,
+    consensus: bool = False,
+) -> dict:
+    """
+    Loads the data and asks every scripted question through the graph, and reports per node
+    latency, prompt sizes, retries and memory peaks. With several SQL candidates, it also
+    reports the wall-clock time of speculation against the estimated serial retry loop.
+    """
+    from sql_gpt.graph import Graph
+    from sql_gpt.llm import ScriptedLLM
+    from sql_gpt.querier import Querier
+    from sql_gpt.state import ChatState
+
+    llm = ScriptedLLM(script, delay_seconds=llm_delay)
+    load_command = " ".join(["/load", data_path, *([schema_path] if schema_path else [])])
+    state = ChatState(
+        model=llm,
+        querier=Querier.get("duckdb", executor_kwargs or {}),
+        inputs=[load_command, *(record["question"] for record in llm.responses.values())],
+        candidates=candidates,
+        consensus=consensus,
+    )
+    timings: Dict[str, List[float]] = defaultdict(list)
+    speculation: Dict[str, List[float]] = defaultdict(list)
+
+    def record(span: Span) -> None:
+        if span.attributes.get("kind") == "node":
+            timings[span.name].append(span.duration)
+        elif span.name == "speculate" and "wall_seconds" in span.attributes:
+            speculation["wall_seconds"].append(span.attributes["wall_seconds"])
+            speculation["serial_estimate_seconds"].append(
+                span.attributes["serial_estimate_seconds"]
+            )
+
+    tracer.listeners.append(record)
+    try:
+        stime = time.perf_counter()
+        final_state = Graph().graph.invoke(
+            state, config={"recursion_limit": MAX_AGENT_RECURSION_LIMIT}
+        )
+        total_seconds = time.perf_counter() - stime
+    finally:
+        tracer.listeners.remove(record)
+
+    return {
+        "data_path": data_path,
+        "data_bytes": os.path.getsize(data_path) if os.path.isfile(data_path) else None,
+        "questions": len(llm.responses),
+        "total_seconds": total_seconds,
+        "nodes": {name: summarize(values) for name, values in timings.items()},
+        "prompt_tokens": summarize([float(tokens) for tokens in llm.prompt_tokens]),
+        "retries": final_state["question_retries"],
+        "speculation": {name: summarize(values) for name, values in speculation.items()},
+        "peak_rss_bytes": peak_rss_bytes(),
+        "duckdb_memory_bytes": state.querier.memory_usage(state.querier.db_conn),
+        "rollups": state.querier.rollups.stats() if state.querier.rollups else None,
+    }
+
+
+def run_startup_benchmark(runs: int = 5, budget_seconds: float = STARTUP_BUDGET_SECONDS) -> dict:
+    """
+    Launches the CLI with a scripted LLM and quits at the first prompt, and reports the
+    wall-clock time to the first prompt, its breakdown by startup phase and the time of
+    `--help`, checking the median startup time against the budget.
+    """
+    command = [sys.executable, "-m", "sql_gpt", "-l", "scripted", "-e", "duckdb"]
+    command += ["--llm-kwargs", json.dumps({"script": []})]
+    startup: List[float] = []
+    help_seconds: List[float] = []
+    phases: Dict[str, List[float]] = defaultdict(list)
+    with tempfile.TemporaryDirectory() as directory:
+        profile_path = os.path.join(directory, "profile.json")
+        for _ in range(runs):
+            stime = time.perf_counter()
+            subprocess.run(
+                [*command, "--import-profile", profile_path],
+                input="/q\n",
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            startup.append(time.perf_counter() - stime)
+            with open(profile_path) as fp:
+                profile = json.load(fp)
+            for name, seconds in profile["phases"].items():
+                phases[name].append(seconds)
+            # interpreter startup, imports of the argument parser and exit
+            phases["interpreter"].append(startup[-1] - profile["startup_seconds"])
+
+            stime = time.perf_counter()
+            subprocess.run(
+                [sys.executable, "-m", "sql_gpt", "--help"], capture_output=True, check=True
+            )
+            help_seconds.append(time.perf_counter() - stime)
+
+    return {
+        "startup_seconds": summarize(startup),
+        "help_seconds": summarize(help_seconds),
+        "phases": {name: summarize(values) for name, values in phases.items()},
+        "budget_seconds": budget_seconds,
+        "within_budget": statistics.median(startup) <= budget_seconds,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SQL GPT offline benchmark")
+    parser.add_argument(
+        "--script",
+        type=str,
+        help="JSONL file of scripted questions, SQL queries and answers",
+    )
+    parser.add_argument(
+        "--startup",
+        action="store_true",
+        help="measure the CLI startup time against a budget instead, exiting with an error if "
+        "it is exceeded",
+    )
+    parser.add_argument(
+        "--runs", type=int, default=5, help="number of CLI launches of the startup benchmark"
+    )
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=STARTUP_BUDGET_SECONDS,
+        help="median startup time budget of the startup benchmark, in seconds",
+    )
+    parser.add_argument(
+        "--schema",
+        type=str,
+        help="table column description file, generated from the data if omitted",
+    )
+    parser.add_argument(
+        "--rows", type=int, default=100000, help="number of synthetic rows to generate"
+    )
+    parser.add_argument(
+        "--format", type=str, default="csv", choices=["csv", "parquet"], help="data format"
+    )
+    parser.add_argument(
+        "--data-dir",
+        type=str,
+        default=tempfile.gettempdir(),
+        help="directory of the generated data, reused across runs",
+    )
+    parser.add_argument(
+        "--llm-delay", type=float, default=0.0, help="simulated latency of each LLM call"
+    )
+    parser.add_argument(
+        "--executor-kwargs",
+        type=str,
+        help='json string of executor parameters (e.g., \'{"load_mode": "view"}\')',
+    )
+    parser.add_argument(
+        "--candidates",
+        type=int,
+        default=1,
+        help="number of SQL candidates to generate at once and try in parallel",
+    )
+    parser.add_argument(
+        "--consensus", action="store_true", help="pick the candidate most results agree on"
+    )
+    parser.add_argument("--output", type=str, help="file to write the JSON report to")
+    args = parser.parse_args()
+
+    if args.startup:
+        report = run_startup_benchmark(args.runs, args.budget)
+        if args.output:
+            with open(args.output, "w") as fp:
+                json.dump(report, fp, indent=2)
+        print(json.dumps(report, indent=2))
+        sys.exit(0 if report["within_budget"] else 1)
+    if not args.script:
+        parser.error("the following arguments are required: --script")
+
+    data_path = os.path.join(args.data_dir, f"sql_gpt_sales_{args.rows}.{args.format}")
+    data_seconds = 0.0
+    if not os.path.exists(data_path):
+        stime = time.perf_counter()
+        generate_sales_data(data_path, args.rows)
+        data_seconds = time.perf_counter() - stime
+
+    report = {
+        "rows": args.rows,
+        "data_generation_seconds": data_seconds,
+        **run_benchmark(
+            args.script,
+            data_path,
+            args.schema,
+            args.llm_delay,
+            json.loads(args.executor_kwargs) if args.executor_kwargs else None,
+            args.candidates,
+            args.consensus,
+        ),
+    }
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(report, fp, indent=2)
+    print(json.dumps(report, indent=2))
@@ -1,3 +1,40 @@
 MAX_ROW_LIMIT_SQL_QUERY = 100
 MAX_RETRY_SQL_GENERATION = 5
 MAX_AGENT_RECURSION_LIMIT = 1000
+CACHE_DIR = "~/.cache/sql_gpt"
+LLM_CACHE_MAX_ENTRIES = 256
+LLM_CACHE_HISTORY_TURNS = 0
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+MAX_RESULT_BYTES = 8 * 1024 * 1024
+QUERY_BATCH_ROWS = 2048
+MAX_PROMPT_TOKENS = 6000
+PROMPT_CACHE_MIN_TOKENS = 1024
+PROMPT_CACHE_BLOCK_TOKENS = 128
+KEEP_RECENT_TURNS = 2
+SQL_RESULT_PREFIX = "SQL results are: "
+SQL_ERROR_PREFIX = "Generated SQL query raised this error:"
+CLARIFICATION_PREFIX = "Your question is ambiguous."
+LOAD_WORKERS = 4
+LOAD_FILE_EXTENSIONS = (".csv", ".tsv", ".txt", ".parquet", ".json", ".jsonl", ".ndjson")
+LOAD_USAGE = "/load [--union] <file, directory or glob> [<table_columns_description>]"
+RESUME_USAGE = "/resume <session>"
+REFRESH_USAGE = "/refresh [<table> ...]"
+MAX_PLAN_ROWS = 1_000_000_000
+QUERY_TIMEOUT_SECONDS = 60.0
+DIGEST_MAX_TOKENS = 1000
+DIGEST_TOP_ROWS = 20
+SMALL_RESULT_ROWS = 5
+SMALL_RESULT_COLUMNS = 4
+BATCH_CONCURRENCY = 8
+LLM_MAX_CONCURRENCY = 16
+QUERY_WORKERS = 4
+CURSOR_POOL_SIZE = 8
+SERVER_MAX_SESSIONS = 256
+SERVER_SESSION_IDLE_SECONDS = 1800.0
+SERVER_SESSION_MAX_QUESTIONS = 200
+EXAMPLE_STORE_MAX_ENTRIES = 1000
+FEW_SHOT_EXAMPLES = 3
+QUERY_LOG_SIZE = 1000
+ROLLUP_MIN_QUERIES = 3
+ROLLUP_MAX_ROWS_RATIO = 0.1
+STARTUP_BUDGET_SECONDS = 1.5
@@ -0,0 +1,183 @@
+import math
+import re
+from functools import lru_cache
+from typing import List, Tuple
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from pydantic import BaseModel
+
+from sql_gpt.constants import (
+    KEEP_RECENT_TURNS,
+    MAX_PROMPT_TOKENS,
+    SQL_ERROR_PREFIX,
+    SQL_RESULT_PREFIX,
+)
+from sql_gpt.logging import logger
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    """
+    Returns the tiktoken encoding if tiktoken is installed, otherwise None.
+    """
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Counts tokens locally, with tiktoken if available or a conservative estimate otherwise.
+    """
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return max(len(re.findall(r"\w+|[^\w\s]", text)), math.ceil(len(text) / 4))
+
+
+def count_message_tokens(messages: List[BaseMessage]) -> int:
+    """
+    Counts tokens of the messages, including a small per message overhead.
+    """
+    return sum(count_tokens(str(message.content)) + 4 for message in messages)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Truncates the text so that it fits in the given number of tokens.
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+    suffix = " ...[truncated]"
+    length = len(text)
+    while length > 0 and count_tokens(text[:length] + suffix) > max_tokens:
+        length = int(length * 0.8)
+    return text[:length] + suffix
+
+
+class PromptStats(BaseModel):
+    """
+    Prompt size statistics of a single LLM call.
+
+    Attributes:
+        messages_before (int): Number of history messages before compaction.
+        messages_after (int): Number of messages sent, including the system message.
+        tokens_before (int): Prompt tokens before compaction.
+        tokens_after (int): Prompt tokens sent.
+        max_tokens (int): Token budget of the prompt.
+        prefix_tokens (int): Tokens of the instructions and schemas leading the prompt.
+        shared_prefix_tokens (int): Leading tokens shared with the previous prompt of its kind.
+        cached_prefix_tokens (int): Estimated tokens a provider prefix cache would serve.
+        cached_prefix_share (float): Estimated share of the prompt tokens served from cache.
+    """
+
+    messages_before: int = 0
+    messages_after: int = 0
+    tokens_before: int = 0
+    tokens_after: int = 0
+    max_tokens: int = 0
+    prefix_tokens: int = 0
+    shared_prefix_tokens: int = 0
+    cached_prefix_tokens: int = 0
+    cached_prefix_share: float = 0.0
+
+
+class ContextManager:
+    """
+    Compacts the chat history so that prompts stay under a token budget.
+
+    The most recent turns (a user question and everything following it) are kept verbatim.
+    In older turns failed SQL attempts and their error messages are dropped, SQL results are
+    reduced to a short summary, and system notices are reduced to their first line. If the
+    prompt is still over budget the oldest messages are dropped, and finally the remaining
+    messages of the latest turn are truncated.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = MAX_PROMPT_TOKENS,
+        keep_recent_turns: int = KEEP_RECENT_TURNS,
+        summary_tokens: int = 60,
+    ) -> None:
+        self.max_tokens = max_tokens
+        self.keep_recent_turns = keep_recent_turns
+        self.summary_tokens = summary_tokens
+
+    @staticmethod
+    def split_turns(messages: List[BaseMessage]) -> List[List[BaseMessage]]:
+        """
+        Splits the history into turns, each starting with a user message.
+        """
+        turns: List[List[BaseMessage]] = [[]]
+        for message in messages:
+            if isinstance(message, HumanMessage) and turns[-1]:
+                turns.append([])
+            turns[-1].append(message)
+        return [turn for turn in turns if turn]
+
+    def compact_turn(self, turn: List[BaseMessage]) -> List[BaseMessage]:
+        """
+        Drops failed attempts and summarizes SQL results and notices of an older turn.
+        """
+        compacted: List[BaseMessage] = []
+        for message in turn:
+            content = str(message.content)
+            if content.startswith(SQL_ERROR_PREFIX):
+                # the previous message is the SQL query that failed
+                if compacted and compacted[-1].type == "ai":
+                    compacted.pop()
+                continue
+            if content.startswith(SQL_RESULT_PREFIX):
+                content = truncate_to_tokens(content, self.summary_tokens)
+            elif isinstance(message, SystemMessage):
+                content = content.split("\n", 1)[0]
+            compacted.append(message.model_copy(update={"content": content}))
+        return compacted
+
+    def compact(
+        self, system: BaseMessage, messages: List[BaseMessage]
+    ) -> Tuple[List[BaseMessage], PromptStats]:
+        """
+        Returns the prompt made of the system message and the compacted history,
+        along with its size statistics.
+        """
+        stats = PromptStats(
+            messages_before=len(messages),
+            tokens_before=count_message_tokens([system] + messages),
+            max_tokens=self.max_tokens,
+        )
+        turns = self.split_turns(messages)
+        recent = max(len(turns) - self.keep_recent_turns, 0)
+        turns = [self.compact_turn(turn) for turn in turns[:recent]] + turns[recent:]
+        history = [message for turn in turns for message in turn]
+
+        budget = self.max_tokens - count_message_tokens([system])
+        last_turn = len(turns[-1]) if turns else 0
+        sizes = [count_message_tokens([message]) for message in history]
+        total, start = sum(sizes), 0
+        while len(history) - start > last_turn and total > budget:
+            total -= sizes[start]
+            start += 1
+        history = history[start:]
+        if total > budget and history:
+            # keep the latest question intact, and share the rest of the budget
+            first = history[0]
+            share = max((budget - count_message_tokens([first])) // len(history) - 4, 0)
+            history = [first] + [
+                message.model_copy(
+                    update={"content": truncate_to_tokens(str(message.content), share)}
+                )
+                for message in history[1:]
+            ]
+        prompt = [system] + history
+        stats.messages_after = len(prompt)
+        stats.tokens_after = count_message_tokens(prompt)
+        if stats.tokens_after > self.max_tokens:
+            logger.warning(
+                f"Prompt of {stats.tokens_after} tokens exceeds the budget of {self.max_tokens} "
+                "tokens, as the system message and latest question alone are too large."
+            )
+        return prompt, stats
@@ -0,0 +1,109 @@
+from collections import Counter
+from decimal import Decimal
+from typing import Any, List
+
+from sql_gpt.constants import (
+    DIGEST_MAX_TOKENS,
+    DIGEST_TOP_ROWS,
+    SMALL_RESULT_COLUMNS,
+    SMALL_RESULT_ROWS,
+)
+from sql_gpt.context import count_tokens, truncate_to_tokens
+from sql_gpt.querier import QueryResult
+
+
+def format_value(value: Any, max_width: int = 40) -> str:
+    """
+    Formats a value compactly, rounding floats and truncating long text.
+    """
+    if isinstance(value, float):
+        text = f"{value:.6g}" if abs(value) < 1e15 else f"{value:.4e}"
+    else:
+        text = str(value)
+    return text if len(text) <= max_width else text[: max_width - 3] + "..."
+
+
+def render_table(columns: List[str], rows: List[tuple], max_width: int = 40) -> str:
+    """
+    Renders rows as a pipe separated table with a header line.
+    """
+    lines = [" | ".join(columns)]
+    lines += [" | ".join(format_value(value, max_width) for value in row) for row in rows]
+    return "\n".join(lines)
+
+
+def column_stats(values: List[Any], top_k: int = 3) -> str:
+    """
+    Describes a column with its null count and either numeric or categorical statistics.
+    """
+    present = [value for value in values if value is not None]
+    nulls = f", {len(values) - len(present)} nulls" if len(present) < len(values) else ""
+    if not present:
+        return f"all null{nulls}"
+    if all(
+        isinstance(value, (int, float, Decimal)) and not isinstance(value, bool)
+        for value in present
+    ):
+        numbers = [float(value) for value in present]
+        return (
+            f"min {format_value(min(numbers))}, max {format_value(max(numbers))}, "
+            f"mean {format_value(sum(numbers) / len(numbers))}, "
+            f"sum {format_value(sum(numbers))}{nulls}"
+        )
+    counts = Counter(format_value(value) for value in present)
+    top = ", ".join(f"{value} ({count})" for value, count in counts.most_common(top_k))
+    stats = f"{len(counts)} distinct, most common: {top}{nulls}"
+    try:
+        stats += f", range {format_value(min(present))} to {format_value(max(present))}"
+    except TypeError:
+        pass
+    return stats
+
+
+def is_small(result: QueryResult) -> bool:
+    """
+    Returns whether the result is small enough to show as is, without summarizing it.
+    """
+    return (
+        not result.truncated
+        and result.row_count <= SMALL_RESULT_ROWS
+        and len(result.columns) <= SMALL_RESULT_COLUMNS
+    )
+
+
+def render_small(result: QueryResult) -> str:
+    """
+    Renders a small result directly as the answer.
+    """
+    if result.row_count == 0:
+        return "The query returned no rows."
+    if result.row_count == 1 and len(result.columns) == 1:
+        return f"{result.columns[0]}: {format_value(result.data[0][0], 200)}"
+    return render_table(result.columns, result.rows(), 200)
+
+
+def digest(
+    result: QueryResult, max_tokens: int = DIGEST_MAX_TOKENS, top_rows: int = DIGEST_TOP_ROWS
+) -> str:
+    """
+    Summarizes the result within a token budget: its shape and column types, statistics of
+    every column, and its leading rows. Fewer rows are included until the digest fits.
+    """
+    shape = f"{result.row_count} rows" + (
+        " (truncated, more rows exist)" if result.truncated else ""
+    )
+    columns = [
+        f"- {name} ({column_type}): {column_stats(values)}"
+        for name, column_type, values in zip(result.columns, result.types, result.data)
+    ]
+    header = "\n".join([shape, "Columns:", *columns])
+    rows = result.rows()
+    shown = min(top_rows, len(rows))
+    while True:
+        sample = render_table(result.columns, rows[:shown])
+        label = "All rows:" if shown == len(rows) else f"First {shown} rows:"
+        text = f"{header}\n{label}\n{sample}"
+        if shown == 0 or count_tokens(text) <= max_tokens:
+            break
+        shown //= 2
+    return truncate_to_tokens(text, max_tokens)
@@ -0,0 +1,201 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from pydantic import BaseModel
+
+from sql_gpt.cache import fingerprint
+from sql_gpt.constants import CACHE_DIR, EXAMPLE_STORE_MAX_ENTRIES, FEW_SHOT_EXAMPLES
+from sql_gpt.llm import normalize_text
+from sql_gpt.retrieval import BM25Index
+from sql_gpt.sql import identifiers, rename_identifiers
+
+
+class LoadedTable(BaseModel):
+    """
+    Describes where a loaded table came from.
+
+    Attributes:
+        path (str): Path of the loaded file.
+        table_columns_description (str): Path of the column description file, if given.
+        schema_fingerprint (str): Fingerprint of the table column names and types.
+        meta (str): Column descriptions of the table, as prompted.
+    """
+
+    path: str
+    table_columns_description: str | None = None
+    schema_fingerprint: str
+    meta: str = ""
+
+
+class ExampleStore:
+    """
+    SQLite backed store of verified question and SQL query pairs, used as few-shot examples.
+
+    Every example records the tables its query reads, by source path and schema fingerprint.
+    An example applies to a session that loaded tables with the same schema fingerprints, with
+    its table names rewritten to the names of the session: a table maps to the loaded table of
+    the same path and schema, or else to the only loaded table of the same schema. Examples of
+    a source path whose schema changed are pruned. Applicable examples are ranked with BM25
+    over their questions.
+    """
+
+    def __init__(
+        self,
+        path: str = os.path.join(CACHE_DIR, "examples.sqlite"),
+        max_entries: int = EXAMPLE_STORE_MAX_ENTRIES,
+        k: int = FEW_SHOT_EXAMPLES,
+    ) -> None:
+        path = os.path.expanduser(path)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.max_entries = max_entries
+        self.k = k
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS examples ("
+            "key TEXT PRIMARY KEY, question TEXT, sql TEXT, tables TEXT, verified REAL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS example_tables ("
+            "key TEXT, path TEXT, fingerprint TEXT, PRIMARY KEY (key, path))"
+        )
+        self._conn.commit()
+        # loaded tables, and the index and examples applicable to them with their table mapping
+        self._index: Tuple[frozenset, BM25Index, List[Tuple[str, str, Dict[str, str]]]] | None = (
+            None
+        )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT count(*) FROM examples").fetchone()[0]
+
+    def add(self, question: str, sql_text: str, tables: Dict[str, LoadedTable]) -> None:
+        """
+        Stores a verified example, replacing any previous query for the same question over
+        the same tables, and evicts the least recently verified examples over budget.
+        """
+        used = {name: tables[name] for name in sorted(identifiers(sql_text) & set(tables))}
+        if not used:
+            return
+        sources = {name: [table.path, table.schema_fingerprint] for name, table in used.items()}
+        question = normalize_text(question, True)
+        key = fingerprint(json.dumps([question, sorted(sources.values())]))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO examples VALUES (?, ?, ?, ?, ?)",
+                (key, question, sql_text, json.dumps(sources), time.time()),
+            )
+            self._conn.execute("DELETE FROM example_tables WHERE key = ?", (key,))
+            self._conn.executemany(
+                "INSERT INTO example_tables VALUES (?, ?, ?)",
+                [(key, table.path, table.schema_fingerprint) for table in used.values()],
+            )
+            self._conn.execute(
+                "DELETE FROM examples WHERE key IN ("
+                "SELECT key FROM examples ORDER BY verified DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._delete_orphans()
+            self._conn.commit()
+            self._index = None
+
+    def prune(self, tables: Dict[str, LoadedTable]) -> int:
+        """
+        Removes the examples reading a source path of the tables with a different schema.
+        """
+        with self._lock:
+            removed = 0
+            for table in tables.values():
+                removed += self._conn.execute(
+                    "DELETE FROM examples WHERE key IN (SELECT key FROM example_tables "
+                    "WHERE path = ? AND fingerprint != ?)",
+                    (table.path, table.schema_fingerprint),
+                ).rowcount
+            self._delete_orphans()
+            self._conn.commit()
+            if removed:
+                self._index = None
+            return removed
+
+    def _delete_orphans(self) -> None:
+        self._conn.execute(
+            "DELETE FROM example_tables WHERE key NOT IN (SELECT key FROM examples)"
+        )
+
+    def search(self, question: str, tables: Dict[str, LoadedTable]) -> List[Tuple[str, str]]:
+        """
+        Returns up to k (question, SQL) examples most similar to the question, among those
+        applicable to the tables, with table names rewritten to the session table names.
+        """
+        loaded = {(table.path, table.schema_fingerprint): name for name, table in tables.items()}
+        index, examples = self._applicable(loaded)
+        scores = index.scores(question)
+        ranked = sorted(
+            (position for position, score in enumerate(scores) if score > 0),
+            key=lambda position: scores[position],
+            reverse=True,
+        )
+        selected = []
+        for position in ranked[: self.k]:
+            example_question, sql_text, mapping = examples[position]
+            selected.append((example_question, rename_identifiers(sql_text, mapping)))
+        return selected
+
+    def _applicable(
+        self, loaded: Dict[Tuple[str, str], str]
+    ) -> Tuple[BM25Index, List[Tuple[str, str, Dict[str, str]]]]:
+        """
+        Returns the similarity index of the examples applicable to the loaded tables, keyed by
+        source path and schema fingerprint, along with the examples and their table mappings.
+        The index is rebuilt when the examples or the tables changed.
+        """
+        key = frozenset(loaded.items())
+        with self._lock:
+            if self._index is None or self._index[0] != key:
+                by_schema: Dict[str, List[str]] = defaultdict(list)
+                for (_, schema), name in sorted(loaded.items()):
+                    by_schema[schema].append(name)
+                rows = self._conn.execute("SELECT question, sql, tables FROM examples").fetchall()
+                index, examples = BM25Index(), []
+                for question, sql_text, tables in rows:
+                    mapping = table_mapping(json.loads(tables), loaded, by_schema)
+                    if mapping is not None:
+                        index.add(question)
+                        examples.append((question, sql_text, mapping))
+                self._index = (key, index, examples)
+            return self._index[1], self._index[2]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM examples")
+            self._conn.execute("DELETE FROM example_tables")
+            self._conn.commit()
+            self._index = None
+
+
+def table_mapping(
+    used: Dict[str, List[str]],
+    loaded: Dict[Tuple[str, str], str],
+    by_schema: Dict[str, List[str]],
+) -> Dict[str, str] | None:
+    """
+    Maps the tables read by an example, given as name -> [path, schema fingerprint], to the
+    loaded table of the same path and schema, or else to the only loaded table of the same
+    schema. Returns None if a table has no match or two tables map to the same table.
+    """
+    mapping = {}
+    for name, (path, schema) in used.items():
+        target = loaded.get((path, schema))
+        if target is None and len(by_schema.get(schema, [])) == 1:
+            target = by_schema[schema][0]
+        if target is None:
+            return None
+        mapping[name] = target
+    if len(set(mapping.values())) < len(mapping):
+        return None
+    return mapping
@@ -1,60 +1,131 @@
-from langgraph.graph import END, START, StateGraph
+import threading
+from typing import Any, Dict
 
 from sql_gpt.agents import (
+    abuild_query,
+    aexecute_query,
+    aload_table,
+    apost_execution,
+    aprompter,
+    arefresh_table,
+    aresume_session,
+    avalidate_query,
     build_query,
     execute_query,
     load_table,
     post_execution,
     prompter,
+    refresh_table,
+    resume_session,
     route_to_next_step,
+    validate_query,
 )
 from sql_gpt.state import ChatState
 
+# asynchronous -> compiled graph
+_compiled: Dict[bool, Any] = {}
+_compile_lock = threading.Lock()
 
-class Graph:
+
+def compile_graph(asynchronous: bool = False):
     """
-    This class represents the state graph for the SQL GPT agent.
-    It initializes the graph with nodes and edges, defining the flow of the agent's operations.
+    Returns the compiled state graph of the agent. Graphs are compiled once per process and
+    shared, as they hold no state of their own, and LangGraph is only imported on first use.
+    """
+    asynchronous = bool(asynchronous)
+    with _compile_lock:
+        if asynchronous not in _compiled:
+            _compiled[asynchronous] = build_graph(asynchronous).compile()
+        return _compiled[asynchronous]
+
+
+def build_graph(asynchronous: bool):
     """
+    Returns the state graph of the agent, with its nodes and edges.
+    """
+    from langgraph.graph import END, START, StateGraph
 
-    def __init__(self) -> None:
-        graph_builder = StateGraph(ChatState)
+    graph_builder = StateGraph(ChatState)
+    if asynchronous:
+        graph_builder.add_node("prompter", aprompter)
+        graph_builder.add_node("load_table", aload_table)
+        graph_builder.add_node("refresh_table", arefresh_table)
+        graph_builder.add_node("resume_session", aresume_session)
+        graph_builder.add_node("build_query", abuild_query)
+        graph_builder.add_node("validate_query", avalidate_query)
+        graph_builder.add_node("execute_query", aexecute_query)
+        graph_builder.add_node("post_execution", apost_execution)
+    else:
         graph_builder.add_node("prompter", prompter)
         graph_builder.add_node("load_table", load_table)
+        graph_builder.add_node("refresh_table", refresh_table)
+        graph_builder.add_node("resume_session", resume_session)
         graph_builder.add_node("build_query", build_query)
+        graph_builder.add_node("validate_query", validate_query)
         graph_builder.add_node("execute_query", execute_query)
         graph_builder.add_node("post_execution", post_execution)
 
-        # Define edges between nodes.
-        graph_builder.add_edge(START, "prompter")
-        graph_builder.add_conditional_edges(
-            "prompter",
-            route_to_next_step,
-            {
-                "prompter": "prompter",
-                "load_table": "load_table",
-                "build_query": "build_query",
-                "END": END,
-            },
-        )
-        graph_builder.add_edge("load_table", "prompter")
-        graph_builder.add_conditional_edges(
-            "build_query",
-            route_to_next_step,
-            {"prompter": "prompter", "execute_query": "execute_query"},
-        )
-        graph_builder.add_conditional_edges(
-            "execute_query",
-            route_to_next_step,
-            {
-                "build_query": "build_query",
-                "post_execution": "post_execution",
-                "prompter": "prompter",
-            },
-        )
-        graph_builder.add_edge("post_execution", "prompter")
-
-        self.graph = graph_builder.compile()
+    # Define edges between nodes.
+    graph_builder.add_edge(START, "prompter")
+    graph_builder.add_conditional_edges(
+        "prompter",
+        route_to_next_step,
+        {
+            "prompter": "prompter",
+            "load_table": "load_table",
+            "refresh_table": "refresh_table",
+            "resume_session": "resume_session",
+            "build_query": "build_query",
+            "END": END,
+        },
+    )
+    graph_builder.add_edge("load_table", "prompter")
+    graph_builder.add_edge("refresh_table", "prompter")
+    graph_builder.add_edge("resume_session", "prompter")
+    graph_builder.add_conditional_edges(
+        "build_query",
+        route_to_next_step,
+        {
+            "prompter": "prompter",
+            "validate_query": "validate_query",
+            "build_query": "build_query",
+            "post_execution": "post_execution",
+        },
+    )
+    graph_builder.add_conditional_edges(
+        "validate_query",
+        route_to_next_step,
+        {
+            "build_query": "build_query",
+            "execute_query": "execute_query",
+            "prompter": "prompter",
+        },
+    )
+    graph_builder.add_conditional_edges(
+        "execute_query",
+        route_to_next_step,
+        {
+            "build_query": "build_query",
+            "post_execution": "post_execution",
+            "prompter": "prompter",
+        },
+    )
+    graph_builder.add_edge("post_execution", "prompter")
+
+    return graph_builder
+
+
+class Graph:
+    """
+    This class represents the state graph for the SQL GPT agent.
+    Its nodes and edges, defined by `build_graph`, describe the flow of the agent's
+    operations, and instances of the same kind share the compiled graph.
+
+    An asynchronous graph uses the asynchronous agents, and must be run with `ainvoke`.
+    """
+
+    def __init__(self, asynchronous: bool = False) -> None:
+        self.graph = compile_graph(asynchronous)
 
     def visualize(self) -> None:
         """
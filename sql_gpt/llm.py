@@ -1,8 +1,25 @@
+import asyncio
+import json
+import os
+import re
+import time
 from abc import ABC, abstractmethod
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
 
-from langchain_core.messages import BaseMessage
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
 
+from sql_gpt.cache import CacheStats, DiskCache, LRUCache, fingerprint
+from sql_gpt.constants import (
+    CACHE_DIR,
+    CLARIFICATION_PREFIX,
+    LLM_CACHE_HISTORY_TURNS,
+    LLM_CACHE_MAX_ENTRIES,
+    LLM_MAX_CONCURRENCY,
+    SQL_ERROR_PREFIX,
+    SQL_RESULT_PREFIX,
+)
+from sql_gpt.context import count_message_tokens
 from sql_gpt.logging import logger
 
 
@@ -11,8 +28,15 @@ class LLM(ABC):
     Abstract base class for Language Model (LLM) implementations.
     This class defines the interface for invoking LLMs and provides a factory method
     to get an instance of a specific LLM implementation.
+
+    Asynchronous invocations that reach the model are bounded by a semaphore of
+    `max_concurrency` requests per event loop, so that concurrent sessions queue up instead of
+    flooding the model provider.
     """
 
+    max_concurrency: int = LLM_MAX_CONCURRENCY
+    _semaphore: Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore] | None = None
+
     @abstractmethod
     def invoke(self, prompt: List[BaseMessage]) -> BaseMessage:
         """
@@ -20,13 +44,65 @@ class LLM(ABC):
         """
         raise NotImplementedError("Subclasses must implement this method.")
 
+    def stream(self, prompt: List[BaseMessage]) -> Iterator[str]:
+        """
+        Invokes the LLM with the given prompt, and yields the response text in chunks as they
+        are generated. The consumer may stop early once it has read enough.
+        """
+        yield str(self.invoke(prompt).content)
+
+    def candidates(self, prompt: List[BaseMessage], n: int) -> List[BaseMessage]:
+        """
+        Generates `n` alternative responses to the prompt, by default with concurrent
+        invocations.
+        """
+        with ThreadPoolExecutor(max_workers=n) as pool:
+            return list(pool.map(lambda _: self.invoke(prompt), range(n)))
+
+    async def ainvoke(self, prompt: List[BaseMessage]) -> BaseMessage:
+        """
+        Invokes the LLM with the given prompt without blocking the event loop, by running the
+        synchronous invocation in a worker thread.
+        """
+        async with self.semaphore:
+            return await asyncio.to_thread(self.invoke, prompt)
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        """
+        The semaphore bounding the concurrent requests of the running event loop.
+        """
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore[0] is not loop:
+            self._semaphore = (loop, asyncio.Semaphore(self.max_concurrency))
+        return self._semaphore[1]
+
+    def on_schema_change(self, table_schemas: str) -> None:
+        """
+        Notifies the LLM that the loaded table schemas changed.
+        """
+
+    def on_stream_complete(self, prompt: List[BaseMessage], content: str) -> None:
+        """
+        Notifies the LLM that the consumer of a stream stopped reading early, as the text
+        received so far was a complete response.
+        """
+
     @classmethod
-    def get(cls, llm_name: str, llm_kwargs: dict):
+    def get(cls, llm_name: str, llm_kwargs: dict, cache_kwargs: Optional[dict] = None):
         """
-        Returns the LLM instance.
+        Returns the LLM instance, wrapped in a response cache if cache parameters are given.
+        A "max_concurrency" LLM parameter bounds its concurrent asynchronous requests.
         """
-        models = {"openai": OpenAI}
-        return models.get(llm_name.lower(), OpenAI)(**llm_kwargs)
+        models = {"openai": OpenAI, "scripted": ScriptedLLM}
+        llm_kwargs = dict(llm_kwargs)
+        max_concurrency = llm_kwargs.pop("max_concurrency", None)
+        llm = models.get(llm_name.lower(), OpenAI)(**llm_kwargs)
+        if max_concurrency is not None:
+            llm.max_concurrency = int(max_concurrency)
+        if cache_kwargs is not None:
+            llm = CachedLLM(llm, **cache_kwargs)
+        return llm
 
 
 class OpenAI(LLM):
@@ -45,3 +121,241 @@ class OpenAI(LLM):
         Invokes the LLM with the given prompt.
         """
         return self.model.invoke(prompt)
+
+    def stream(self, prompt: List[BaseMessage]) -> Iterator[str]:
+        """
+        Streams the response tokens of the LLM, closing the request if the consumer stops.
+        """
+        for chunk in self.model.stream(prompt):
+            if chunk.content:
+                yield str(chunk.content)
+
+    def candidates(self, prompt: List[BaseMessage], n: int) -> List[BaseMessage]:
+        """
+        Generates `n` alternative responses in a single request, sampling `n` choices.
+        """
+        result = self.model.generate([prompt], n=n)
+        return [generation.message for generation in result.generations[0]]
+
+    async def ainvoke(self, prompt: List[BaseMessage]) -> BaseMessage:
+        """
+        Invokes the LLM with the given prompt through the native asynchronous client.
+        """
+        async with self.semaphore:
+            return await self.model.ainvoke(prompt)
+
+
+class ScriptedLLM(LLM):
+    """
+    Deterministic LLM implementation that replays recorded responses, for offline benchmarks.
+
+    The script is a JSONL file (or a list) of records with a "question", the "sql" to answer it
+    with (or a list of queries to return on successive retries), and an optional "answer" to
+    summarize its result with. Questions without a record get a clarification response.
+    """
+
+    def __init__(self, script: str | List[Dict], delay_seconds: float = 0.0) -> None:
+        if isinstance(script, str):
+            with open(script, "r") as fp:
+                script = [json.loads(line) for line in fp if line.strip()]
+        self.responses = {normalize_text(record["question"], True): record for record in script}
+        self.delay_seconds = delay_seconds
+        self.prompt_tokens: List[int] = []
+
+    def invoke(self, prompt: List[BaseMessage]) -> BaseMessage:
+        """
+        Returns the recorded response for the latest question in the prompt.
+        """
+        self.prompt_tokens.append(count_message_tokens(prompt))
+        time.sleep(self.delay_seconds)
+        return self.respond(prompt)
+
+    def stream(self, prompt: List[BaseMessage]) -> Iterator[str]:
+        """
+        Streams the recorded response word by word, after the delay of the first token.
+        """
+        self.prompt_tokens.append(count_message_tokens(prompt))
+        time.sleep(self.delay_seconds)
+        yield from re.findall(r"\s*\S+", str(self.respond(prompt).content))
+
+    def candidates(self, prompt: List[BaseMessage], n: int) -> List[BaseMessage]:
+        """
+        Returns the recorded queries of the current and following retries as alternatives,
+        after a single delay.
+        """
+        self.prompt_tokens.append(count_message_tokens(prompt))
+        time.sleep(self.delay_seconds)
+        return [self.respond(prompt, offset) for offset in range(n)]
+
+    async def ainvoke(self, prompt: List[BaseMessage]) -> BaseMessage:
+        """
+        Returns the recorded response, simulating the delay without blocking the event loop.
+        """
+        async with self.semaphore:
+            self.prompt_tokens.append(count_message_tokens(prompt))
+            await asyncio.sleep(self.delay_seconds)
+            return self.respond(prompt)
+
+    def respond(self, prompt: List[BaseMessage], offset: int = 0) -> BaseMessage:
+        questions = [i for i, message in enumerate(prompt) if isinstance(message, HumanMessage)]
+        question = normalize_text(prompt[questions[-1]].content, True) if questions else ""
+        record = self.responses.get(question)
+        if record is None:
+            return AIMessage(content="[CLARIFICATION] There is no scripted response for this.")
+        if str(prompt[-1].content).startswith(SQL_RESULT_PREFIX):
+            return AIMessage(content=record.get("answer", str(prompt[-1].content)))
+        queries = record["sql"] if isinstance(record["sql"], list) else [record["sql"]]
+        start = questions[-1]
+        retries = sum(
+            str(message.content).startswith(SQL_ERROR_PREFIX) for message in prompt[start:]
+        )
+        return AIMessage(content=queries[min(retries + offset, len(queries) - 1)])
+
+
+class CachedLLM(LLM):
+    """
+    Response cache in front of any LLM implementation.
+
+    Responses are keyed on the system prompt and the normalized messages of the current
+    question, within a namespace given by the fingerprint of the table schemas, so that a
+    question repeated later in a conversation or in another session is served from the cache.
+    The messages of `history_turns` prior questions are keyed as well, for follow-up questions
+    whose meaning depends on them.
+    Lookups go through an in-memory LRU tier first, and an optional on-disk SQLite tier second,
+    both of which evict their least recently used entries.
+    """
+
+    def __init__(
+        self,
+        llm: LLM,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+        path: Optional[str] = os.path.join(CACHE_DIR, "llm_cache.sqlite"),
+        ttl_seconds: Optional[float] = None,
+        max_disk_entries: int = 10000,
+        history_turns: int = LLM_CACHE_HISTORY_TURNS,
+    ) -> None:
+        self.llm = llm
+        self.history_turns = history_turns
+        self.memory = LRUCache(max_entries=max_entries)
+        self.disk = (
+            DiskCache(os.path.expanduser(path), ttl_seconds, max_disk_entries) if path else None
+        )
+        self.stats = CacheStats()
+        self.namespace = fingerprint("")
+
+    def on_schema_change(self, table_schemas: str) -> None:
+        """
+        Moves the cache to the namespace of the new schemas. Entries of other namespaces are
+        kept, as the on-disk tier is shared with other sessions and processes, and they are
+        served again when the same schemas are loaded.
+        """
+        self.namespace = fingerprint(table_schemas)
+        self.llm.on_schema_change(table_schemas)
+
+    def cache_key(self, prompt: List[BaseMessage]) -> str:
+        """
+        Builds the cache key from the system prompt and the messages since the start of the
+        current question and its `history_turns` prior questions. Replies to a clarification
+        question are keyed along with the question they refer to.
+        """
+        system = [message.content for message in prompt[:1] if isinstance(message, SystemMessage)]
+        history = prompt[1:] if system else prompt
+        start, turns = 0, self.history_turns + 1
+        for index in range(len(history) - 1, -1, -1):
+            if history[index].type != "human":
+                continue
+            if index and str(history[index - 1].content).startswith(CLARIFICATION_PREFIX):
+                continue
+            turns -= 1
+            if not turns:
+                start = index
+                break
+        window = [
+            (message.type, normalize_text(message.content, message.type == "human"))
+            for message in history[start:]
+        ]
+        return fingerprint(json.dumps([self.namespace, system, window]))
+
+    def invoke(self, prompt: List[BaseMessage]) -> BaseMessage:
+        """
+        Returns the cached response for the prompt, or invokes the wrapped LLM and caches it.
+        """
+        key, content = self.lookup(prompt)
+        if content is None:
+            content = self.store(key, self.llm.invoke(prompt).content)
+        return AIMessage(content=content)
+
+    def stream(self, prompt: List[BaseMessage]) -> Iterator[str]:
+        """
+        Yields the cached response for the prompt at once, or streams the wrapped LLM and
+        caches the streamed text once read to the end. A stream closed early, by an error or
+        an interrupt, holds a truncated response and is not cached, unless its consumer reports
+        it complete with `on_stream_complete`.
+        """
+        key, content = self.lookup(prompt)
+        if content is not None:
+            yield content
+            return
+        chunks: List[str] = []
+        for chunk in self.llm.stream(prompt):
+            chunks.append(chunk)
+            yield chunk
+        self.store(key, "".join(chunks))
+
+    def on_stream_complete(self, prompt: List[BaseMessage], content: str) -> None:
+        """
+        Caches the response its consumer read up to completion.
+        """
+        self.store((self.namespace, self.cache_key(prompt)), content)
+
+    def candidates(self, prompt: List[BaseMessage], n: int) -> List[BaseMessage]:
+        """
+        Generates alternatives with the wrapped LLM, bypassing the cache that would make them
+        identical.
+        """
+        return self.llm.candidates(prompt, n)
+
+    async def ainvoke(self, prompt: List[BaseMessage]) -> BaseMessage:
+        """
+        Returns the cached response for the prompt, or invokes the wrapped LLM asynchronously
+        and caches it. Cache hits do not wait for the concurrency limit of the wrapped LLM.
+        """
+        key, content = self.lookup(prompt)
+        if content is None:
+            content = self.store(key, (await self.llm.ainvoke(prompt)).content)
+        return AIMessage(content=content)
+
+    def lookup(self, prompt: List[BaseMessage]) -> Tuple[Tuple[str, str], Optional[str]]:
+        """
+        Returns the cache key of the prompt, and its cached response if any.
+        """
+        key = (self.namespace, self.cache_key(prompt))
+        content = self.memory.get(key)
+        if content is not None:
+            self.stats.memory_hits += 1
+        elif self.disk is not None and (content := self.disk.get(key[1])) is not None:
+            self.stats.disk_hits += 1
+            self.memory.put(key, content)
+        else:
+            self.stats.misses += 1
+        logger.debug(f"LLM cache stats: {self.stats.as_dict()}")
+        return key, content
+
+    def store(self, key: Tuple[str, str], content: str) -> str:
+        """
+        Caches the response in memory and on disk, and returns it.
+        """
+        self.memory.put(key, content)
+        if self.disk is not None:
+            self.disk.put(key[1], content, namespace=key[0])
+        return content
+
+
+def normalize_text(text: str, question: bool = False) -> str:
+    """
+    Collapses whitespace, and for user questions also ignores case and trailing punctuation.
+    """
+    text = " ".join(str(text).split())
+    if question:
+        text = re.sub(r"[\s?.!]+$", "", text.lower())
+    return text
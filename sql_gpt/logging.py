@@ -1,9 +1,12 @@
+import inspect
 import logging
 import os
 import sys
 import time
 from functools import wraps
 
+from sql_gpt.tracing import tracer
+
 
 class ColoredFormatter(logging.Formatter):
     """Custom formatter for colored logs"""
@@ -32,20 +35,48 @@ console_handler.setFormatter(ColoredFormatter("%(message)s"))
 logger.addHandler(console_handler)
 
 
+def log_to_stderr() -> None:
+    """
+    Sends the logs to stderr, for modes that write their results to stdout.
+    """
+    console_handler.setStream(sys.stderr)
+
+
 def log(func):
     """
-    Decorator to log the start and finish of a function.
+    Decorator to log the start and finish of a function, and trace it as a span.
+    Coroutine functions are wrapped in a coroutine function.
     """
+    if inspect.iscoroutinefunction(func):
+
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            try:
+                stime = time.perf_counter()
+                with tracer.span(func.__name__, kind="node"):
+                    result = await func(*args, **kwargs)
+                logger.debug(
+                    f"Agent '{func.__name__}' ran for {time.perf_counter() - stime:.2f} seconds."
+                )
+            except Exception as e:
+                logger.exception(f"Error in agent '{func.__name__}': {e}")
+                raise
+            return result
+
+        return async_wrapper
 
     @wraps(func)
     def wrapper(*args, **kwargs):
         try:
-            stime = time.time()
-            result = func(*args, **kwargs)
+            stime = time.perf_counter()
+            with tracer.span(func.__name__, kind="node"):
+                result = func(*args, **kwargs)
             # state = args[0] if args else None
             # if state:
             #     logger.debug(f"State after {func.__name__}: {state}")
-            logger.debug(f"Agent '{func.__name__}' ran for {time.time() - stime:.2f} seconds.")
+            logger.debug(
+                f"Agent '{func.__name__}' ran for {time.perf_counter() - stime:.2f} seconds."
+            )
         except Exception as e:
             logger.exception(f"Error in agent '{func.__name__}': {e}")
             raise
@@ -0,0 +1,148 @@
+import threading
+from typing import Dict, List, Tuple
+
+from langchain_core.messages import BaseMessage, SystemMessage
+
+from sql_gpt.constants import (
+    MAX_ROW_LIMIT_SQL_QUERY,
+    PROMPT_CACHE_BLOCK_TOKENS,
+    PROMPT_CACHE_MIN_TOKENS,
+)
+from sql_gpt.context import (
+    ContextManager,
+    PromptStats,
+    count_message_tokens,
+    count_tokens,
+)
+from sql_gpt.logging import logger
+
+QUERY_INSTRUCTIONS = (
+    "You are an intelligent assistant that converts natural language questions "
+    "into correct DuckDB SQL queries.\n"
+    "Your goal is to generate a SQL query by considering the user's intent, "
+    "previous interactions, and the table schemas.\n\n"
+    "Return format:\n"
+    "1. If the intent is clear, generate a complete DuckDB SQL query that satisfies "
+    "the request. Return only the SQL query text without any extra commentary. Limit "
+    f"query response to {MAX_ROW_LIMIT_SQL_QUERY} rows at most.\n"
+    "2. If the intent is ambiguous, ask a follow-up clarification question that "
+    "requests additional details. Prefix your clarification question with "
+    '"[CLARIFICATION]" as output.\n\n'
+    "Instructions:\n"
+    "1. Consider the user's intent based on the current question.\n"
+    "2. If any previous SQL query resulted in an error, incorporate the error "
+    "message and generate a corrected query.\n"
+    "3. If previous user questions or clarifications are relevant, include them "
+    "in your analysis."
+)
+INTERPRETATION_INSTRUCTIONS = (
+    "You are an intelligent assistant that summarizes SQL query results based on "
+    "given table schemas."
+)
+INSTRUCTIONS = {"query": QUERY_INSTRUCTIONS, "interpretation": INTERPRETATION_INSTRUCTIONS}
+
+
+class PromptBuilder:
+    """
+    Lays out prompts from the most to the least stable content, so that consecutive prompts
+    share a long prefix that providers can cache: instructions, table schemas, examples, and
+    finally the history.
+
+    The system message prefix of instructions and schemas is rendered and counted once per
+    prompt kind, until the schemas change. Every prompt is compared with the previous prompt
+    of the same kind, to estimate the share of its tokens a provider prefix cache would serve,
+    cached in blocks of `cache_block_tokens` once the shared prefix reaches
+    `cache_min_tokens`.
+    """
+
+    def __init__(
+        self,
+        cache_min_tokens: int = PROMPT_CACHE_MIN_TOKENS,
+        cache_block_tokens: int = PROMPT_CACHE_BLOCK_TOKENS,
+    ) -> None:
+        self.cache_min_tokens = cache_min_tokens
+        self.cache_block_tokens = cache_block_tokens
+        # prompt kind -> (schemas, rendered prefix, prefix tokens)
+        self._prefixes: Dict[str, Tuple[str, str, int]] = {}
+        # prompt kind -> message contents of the previous prompt
+        self._previous: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+
+    def prefix(self, kind: str, schemas: str) -> Tuple[str, int]:
+        """
+        Returns the rendered instructions and schemas of the prompt kind, and their tokens.
+        """
+        with self._lock:
+            cached = self._prefixes.get(kind)
+            if cached is None or cached[0] != schemas:
+                rendered = f"{INSTRUCTIONS[kind]}\n\nTable schemas:\n{schemas}"
+                cached = (schemas, rendered, count_tokens(rendered))
+                self._prefixes[kind] = cached
+            return cached[1], cached[2]
+
+    def system_message(self, kind: str, schemas: str, examples: str = "") -> SystemMessage:
+        """
+        Returns the system message of the prompt kind, with the examples after the schemas.
+        """
+        prefix, _ = self.prefix(kind, schemas)
+        if examples:
+            prefix += f"\n\nExamples of verified questions and SQL queries:\n{examples}"
+        return SystemMessage(content=prefix)
+
+    def build(
+        self,
+        kind: str,
+        schemas: str,
+        history: List[BaseMessage],
+        examples: str = "",
+        context_manager: ContextManager | None = None,
+    ) -> Tuple[List[BaseMessage], PromptStats]:
+        """
+        Returns the prompt of the kind, with the history compacted by the context manager if
+        given, along with its size and prefix cache statistics.
+        """
+        system = self.system_message(kind, schemas, examples)
+        if context_manager is not None:
+            prompt, stats = context_manager.compact(system, history)
+        else:
+            prompt = [system, *history]
+            tokens = count_message_tokens(prompt)
+            stats = PromptStats(
+                messages_before=len(history),
+                messages_after=len(prompt),
+                tokens_before=tokens,
+                tokens_after=tokens,
+            )
+        stats.prefix_tokens = self.prefix(kind, schemas)[1]
+        stats.shared_prefix_tokens = self.shared_prefix_tokens(kind, prompt)
+        if stats.shared_prefix_tokens >= self.cache_min_tokens:
+            stats.cached_prefix_tokens = (
+                stats.shared_prefix_tokens // self.cache_block_tokens * self.cache_block_tokens
+            )
+        if stats.tokens_after:
+            stats.cached_prefix_share = stats.cached_prefix_tokens / stats.tokens_after
+        logger.debug(f"Prompt stats of {kind} prompt: {stats.model_dump()}")
+        return prompt, stats
+
+    def shared_prefix_tokens(self, kind: str, prompt: List[BaseMessage]) -> int:
+        """
+        Counts the leading tokens the prompt shares with the previous prompt of the same kind,
+        and remembers the prompt.
+        """
+        contents = [str(message.content) for message in prompt]
+        with self._lock:
+            previous = self._previous.get(kind, [])
+            self._previous[kind] = contents
+        shared = 0
+        for content, previous_content in zip(contents, previous):
+            if content == previous_content:
+                shared += count_message_tokens([SystemMessage(content=content)])
+                continue
+            common = 0
+            for char, previous_char in zip(content, previous_content):
+                if char != previous_char:
+                    break
+                common += 1
+            shared += count_tokens(content[:common]) if common else 0
+            break
+        return shared
@@ -1,7 +1,300 @@
+import asyncio
+import contextvars
+import functools
+import glob
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
 from abc import abstractmethod
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Tuple, TypeVar
 
+from pydantic import BaseModel, Field
+
+from sql_gpt.cache import LRUCache, fingerprint
+from sql_gpt.constants import (
+    CACHE_DIR,
+    CURSOR_POOL_SIZE,
+    MAX_PLAN_ROWS,
+    MAX_RESULT_BYTES,
+    MAX_ROW_LIMIT_SQL_QUERY,
+    QUERY_BATCH_ROWS,
+    QUERY_TIMEOUT_SECONDS,
+    QUERY_WORKERS,
+    RESULT_CACHE_MAX_BYTES,
+    ROLLUP_MAX_ROWS_RATIO,
+    ROLLUP_MIN_QUERIES,
+)
 from sql_gpt.logging import logger
+from sql_gpt.sql import (
+    canonicalize,
+    has_limit,
+    identifiers,
+    is_deterministic,
+    is_read_only,
+    tokenize,
+)
+from sql_gpt.tracing import tracer
+
+LOAD_MODES = ("table", "view", "parquet")
+# uncompressed text formats whose appended rows can be ingested from a byte offset
+APPENDABLE_EXTENSIONS = (".csv", ".tsv", ".txt")
+# plan operators whose output is small compared to their input
+REDUCING_OPERATORS = {
+    "UNGROUPED_AGGREGATE",
+    "HASH_GROUP_BY",
+    "PERFECT_HASH_GROUP_BY",
+    "STREAMING_LIMIT",
+    "LIMIT",
+    "TOP_N",
+    "DUMMY_SCAN",
+    "COLUMN_DATA_SCAN",
+}
+
+T = TypeVar("T")
+
+
+class QueryResult(BaseModel):
+    """
+    Columnar result of an SQL query.
+
+    Attributes:
+        columns (List[str]): Column names.
+        types (List[str]): Column types.
+        data (List[List[Any]]): Column values, one list per column.
+        row_count (int): Number of rows held.
+        truncated (bool): Whether the result was cut at the row or byte limit.
+        nbytes (int): Estimated memory held by the values.
+    """
+
+    columns: List[str] = Field(default_factory=list)
+    types: List[str] = Field(default_factory=list)
+    data: List[List[Any]] = Field(default_factory=list)
+    row_count: int = 0
+    truncated: bool = False
+    nbytes: int = 0
+
+    @classmethod
+    def from_rows(
+        cls, columns: List[str], types: List[str], rows: List[tuple], truncated: bool = False
+    ) -> "QueryResult":
+        data = [list(column) for column in zip(*rows)] if rows else [[] for _ in columns]
+        return cls(
+            columns=columns,
+            types=types,
+            data=data,
+            row_count=len(rows),
+            truncated=truncated,
+            nbytes=rows_size(rows),
+        )
+
+    def rows(self) -> List[tuple]:
+        """
+        Returns the result as a list of row tuples.
+        """
+        return list(zip(*self.data)) if self.data else []
+
+    def __str__(self) -> str:
+        lines = [" | ".join(self.columns)]
+        lines += [" | ".join(str(value) for value in row) for row in self.rows()]
+        if self.truncated:
+            lines.append(f"(truncated to the first {self.row_count} rows)")
+        return "\n".join(lines)
+
+
+class SourceFile(BaseModel):
+    """
+    State of a source file of a table when it was last ingested.
+
+    Attributes:
+        size (int): Size of the file.
+        mtime_ns (int): Modification time of the file.
+        tail (str): Fingerprint of the last bytes of the file, to tell appends from rewrites.
+    """
+
+    size: int
+    mtime_ns: int
+    tail: str = ""
+
+
+class TableLoad(BaseModel):
+    """
+    Describes how a table was loaded.
+
+    Attributes:
+        path (str): Path of the loaded file, or glob pattern of the loaded files.
+        mode (str): Load mode, one of "table", "view" or "parquet".
+        load_seconds (float): Time it took to load the table.
+        memory_bytes (int): Growth of DuckDB memory while loading, approximate when several
+            tables load concurrently.
+        files (Dict[str, SourceFile]): State of the source files when last ingested.
+    """
+
+    path: str
+    mode: str
+    load_seconds: float = 0.0
+    memory_bytes: int = 0
+    files: Dict[str, SourceFile] = Field(default_factory=dict)
+
+
+class TableRefresh(BaseModel):
+    """
+    Outcome of refreshing a table from its source files.
+
+    Attributes:
+        table_name (str): Name of the refreshed table.
+        appended_rows (int): Number of rows ingested from appended bytes and new files.
+        new_files (int): Number of new files matching the table glob pattern.
+        rebuilt (bool): Whether the table was loaded again from scratch, as when a file was
+            rewritten or removed.
+        version (int): Version of the table after the refresh.
+        seconds (float): Time it took to refresh the table.
+    """
+
+    table_name: str
+    appended_rows: int = 0
+    new_files: int = 0
+    rebuilt: bool = False
+    version: int = 0
+    seconds: float = 0.0
+
+    @property
+    def changed(self) -> bool:
+        return self.rebuilt or self.appended_rows > 0 or self.new_files > 0
+
+
+class QueryTimeoutError(Exception):
+    """
+    Raised when a query exceeds its wall-clock time limit.
+    """
+
+    def __init__(self, timeout: float) -> None:
+        super().__init__(
+            f"The query was stopped after exceeding the time limit of {timeout:g} seconds, as it "
+            "is too expensive. Write a cheaper query: filter rows early, aggregate before "
+            "joining, avoid cross joins and select only the needed columns."
+        )
+        self.timeout = timeout
+
+
+class QueryCancelledError(Exception):
+    """
+    Raised when the user cancels a running query.
+    """
+
+
+class ValidationResult(BaseModel):
+    """
+    Outcome of validating an SQL query before executing it.
+
+    Attributes:
+        errors (List[str]): Compact hints on why the query cannot or should not run.
+        warnings (List[str]): Notes on potentially expensive plans that do not block execution.
+        schema_error (bool): Whether the query referenced an unknown table or column.
+    """
+
+    errors: List[str] = Field(default_factory=list)
+    warnings: List[str] = Field(default_factory=list)
+    schema_error: bool = False
+
+
+class CursorPool:
+    """
+    Pool of cursors on a shared DuckDB connection.
+
+    Every cursor is a separate connection to the same database, so cursors can run queries
+    concurrently. At most `size` cursors are handed out at a time, further requests wait until
+    a cursor is released, and released cursors are reused instead of closed.
+    """
+
+    def __init__(self, connection, size: int) -> None:
+        self.connection = connection
+        self.size = size
+        self._idle: List[Any] = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self.in_use = 0
+        self.waits = 0
+
+    def acquire(self) -> Any:
+        """
+        Returns an idle cursor, or a new one, waiting while all cursors are in use.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.waits += 1
+            self._slots.acquire()
+        with self._lock:
+            self.in_use += 1
+            if self._idle:
+                return self._idle.pop()
+        return self.connection.cursor()
+
+    def release(self, cursor) -> None:
+        """
+        Returns the cursor to the pool.
+        """
+        with self._lock:
+            self.in_use -= 1
+            self._idle.append(cursor)
+        self._slots.release()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": self.size,
+                "in_use": self.in_use,
+                "idle": len(self._idle),
+                "waits": self.waits,
+            }
+
+
+class CancelScope:
+    """
+    Interrupts the queries running in its context once cancelled.
+
+    Queries attach their cursor to the scope of their context while they run, so that
+    cancelling the scope from another thread interrupts them, and queries started after the
+    scope was cancelled fail right away.
+    """
+
+    def __init__(self) -> None:
+        self.cancelled = False
+        self._cursors: List[Any] = []
+        self._lock = threading.Lock()
+
+    def cancel(self) -> None:
+        """
+        Interrupts the running queries of the scope, and fails the queries started later.
+        """
+        with self._lock:
+            self.cancelled = True
+            cursors = list(self._cursors)
+        for cursor in cursors:
+            cursor.interrupt()
+
+    def attach(self, cursor) -> bool:
+        """
+        Attaches the cursor of a starting query, returning false if the scope was cancelled.
+        """
+        with self._lock:
+            if not self.cancelled:
+                self._cursors.append(cursor)
+            return not self.cancelled
+
+    def detach(self, cursor) -> None:
+        with self._lock:
+            if cursor in self._cursors:
+                self._cursors.remove(cursor)
+
+
+cancel_scope: contextvars.ContextVar[CancelScope | None] = contextvars.ContextVar(
+    "cancel_scope", default=None
+)
 
 
 class Querier:
@@ -11,16 +304,87 @@ class Querier:
     Subclasses should implement the `connect` and `query` methods.
     """
 
-    def load_table(self, table_name: str) -> str:
+    def load_table(self, table_name: str, name: str | None = None) -> str:
         return table_name
 
+    def describe_table(self, table_name: str) -> str:
+        """
+        Generates a description of the table columns.
+        """
+        raise NotImplementedError("Subclasses must implement this method.")
+
+    def table_columns(self, table_name: str) -> List[Tuple[str, str]]:
+        """
+        Returns the names and types of the table columns, or nothing if unknown.
+        """
+        return []
+
+    def table_path(self, table_name: str) -> str | None:
+        """
+        Returns the path the table was loaded from by this querier, if it was.
+        """
+        return None
+
+    @staticmethod
+    def ends_with_line(path: str, size: int) -> bool:
+        """
+        Returns whether the bytes of the file preceding the given size end with a complete line.
+        """
+        if size == 0:
+            return True
+        with open(path, "rb") as fp:
+            fp.seek(size - 1)
+            return fp.read(1) == b"\n"
+
+    def changed_tables(self) -> List[str]:
+        """
+        Returns the loaded tables whose source files changed since they were ingested.
+        """
+        return []
+
+    def refresh_table(self, table_name: str, path: str | None = None) -> TableRefresh:
+        """
+        Ingests the rows appended to the source files of the table since it was loaded, or
+        loads it from the path if it was not loaded by this querier.
+        """
+        raise NotImplementedError("Subclasses must implement this method.")
+
+    def close(self) -> None:
+        """
+        Stops the background work of the querier.
+        """
+
+    def is_schema_error(self, error: Exception) -> bool:
+        """
+        Returns whether the error is caused by an unknown table or column.
+        """
+        return False
+
+    def validate(self, sql_text: str) -> ValidationResult:
+        """
+        Checks the SQL query without executing it.
+        """
+        return ValidationResult()
+
     @abstractmethod
-    def query(self, sql_text: str) -> List[tuple]:
+    def query(self, sql_text: str) -> QueryResult:
         """
         Executes the SQL query and returns the result.
         """
         raise NotImplementedError("Subclasses must implement this method.")
 
+    async def avalidate(self, sql_text: str) -> ValidationResult:
+        """
+        Checks the SQL query without executing it or blocking the event loop.
+        """
+        return await asyncio.to_thread(self.validate, sql_text)
+
+    async def aquery(self, sql_text: str) -> QueryResult:
+        """
+        Executes the SQL query without blocking the event loop, and returns the result.
+        """
+        return await asyncio.to_thread(self.query, sql_text)
+
     @classmethod
     def get(cls, querier_name: str, querier_kwargs: dict) -> "Querier":
         """
@@ -35,27 +399,761 @@ class DuckdbQuerier(Querier):
     Querier implementation for tabular files, such as parquet or CSV files.
     This class allows querying tabular data stored in files.
     Uses DuckDB for querying.
+
+    Files are either copied into tables, queried in place through views, or converted once into
+    a persistent Parquet cache that is queried through views.
+
+    Results are fetched in batches and capped at a maximum number of rows and bytes. Read only
+    queries are additionally wrapped in a LIMIT so that the engine stops scanning at the cap.
+
+    Queries run on cursors drawn from a bounded pool, so that concurrent sessions share the
+    loaded tables. Every query runs under a wall-clock timeout enforced by a watchdog thread that
+    interrupts its cursor, and a keyboard interrupt cancels the running query without closing
+    the connection. Cancelling the `CancelScope` of a query's context interrupts it as well.
+    The memory and thread budget of the database can be limited per session.
+
+    Asynchronous queries and validations run on a bounded pool of worker threads, so that
+    concurrent sessions cannot oversubscribe the database with more queries than workers.
+
+    Results of read only queries are cached, keyed on the canonicalized SQL text and the
+    versions of the loaded tables it references. Loading a table bumps its version.
     """
 
-    def __init__(self, **kwargs) -> None:
+    def __init__(
+        self,
+        max_rows: int = MAX_ROW_LIMIT_SQL_QUERY,
+        max_result_bytes: int = MAX_RESULT_BYTES,
+        result_cache_bytes: int = RESULT_CACHE_MAX_BYTES,
+        load_mode: str = "table",
+        parquet_cache_dir: str = os.path.join(CACHE_DIR, "parquet"),
+        query_timeout: float | None = QUERY_TIMEOUT_SECONDS,
+        memory_limit: str | None = None,
+        threads: int | None = None,
+        query_workers: int = QUERY_WORKERS,
+        max_cursors: int = CURSOR_POOL_SIZE,
+        rollups: bool = False,
+        rollup_min_queries: int = ROLLUP_MIN_QUERIES,
+        rollup_max_rows_ratio: float = ROLLUP_MAX_ROWS_RATIO,
+        **kwargs,
+    ) -> None:
         import duckdb
 
+        if load_mode not in LOAD_MODES:
+            raise ValueError(f"Unknown load mode '{load_mode}', expected one of {LOAD_MODES}.")
         self.db_conn = duckdb.connect(**kwargs)
-        self.df_counter = 1
+        if memory_limit is not None:
+            self.db_conn.execute(f"SET memory_limit = {quote_literal(memory_limit)};")
+        if threads is not None:
+            self.db_conn.execute(f"SET threads = {int(threads)};")
+        self.query_timeout = query_timeout
+        self.load_mode = load_mode
+        self.parquet_cache_dir = os.path.expanduser(parquet_cache_dir)
+        self.max_rows = max_rows
+        self.max_result_bytes = max_result_bytes
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self.table_versions: Dict[str, int] = {}
+        self.tables: Dict[str, TableLoad] = {}
+        self.result_cache = LRUCache(
+            max_bytes=result_cache_bytes, sizeof=lambda result: result.nbytes
+        )
+        self.cursors = CursorPool(self.db_conn, max_cursors)
+        self.query_workers = query_workers
+        self._executor: ThreadPoolExecutor | None = None
+        # a persistent database keeps the tables of previous sessions, never replace them
+        existing = self.db_conn.execute(
+            "SELECT max(CAST(table_name[3:] AS INTEGER)) FROM information_schema.tables "
+            "WHERE regexp_full_match(table_name, 'df[0-9]+')"
+        ).fetchone()[0]
+        self.df_counter = (existing or 0) + 1
+        self.rollups = None
+        if rollups:
+            from sql_gpt.rollups import RollupManager
 
-    def load_table(self, table_name: str) -> str:
+            self.rollups = RollupManager(self, rollup_min_queries, rollup_max_rows_ratio)
+
+    def load_table(self, table_name: str, name: str | None = None) -> str:
+        """
+        Builds a table connection with the configured load mode:
+            - "table" copies the file into a DuckDB table.
+            - "view" queries the file in place through a view.
+            - "parquet" converts the file once into a Parquet cache, keyed on the file path,
+              modification time and size, and queries the cached file through a view.
+
+        The table is named "dfN" with the next free number, unless a name is given, as when
+        restoring a session.
+        """
+        with self._lock:
+            if name is None:
+                name = f"df{self.df_counter}"
+                self.df_counter += 1
+            elif re.fullmatch(r"df[0-9]+", name):
+                self.df_counter = max(self.df_counter, int(name[2:]) + 1)
+        cursor = self.cursors.acquire()
+        try:
+            stime = time.perf_counter()
+            memory = self.memory_usage(cursor)
+            source = self.table_source(table_name, cursor)
+            kind = "TABLE" if self.load_mode == "table" else "VIEW"
+            cursor.execute(f"CREATE OR REPLACE {kind} {name} AS SELECT * FROM {source};")
+            load = TableLoad(
+                path=table_name,
+                mode=self.load_mode,
+                load_seconds=time.perf_counter() - stime,
+                memory_bytes=max(self.memory_usage(cursor) - memory, 0),
+                files=self.source_files(table_name),
+            )
+        finally:
+            self.cursors.release(cursor)
+        self.tables[name] = load
+        logger.info(
+            f"Table '{name}' loaded from '{table_name}' as {self.load_mode} in "
+            f"{load.load_seconds:.2f} seconds, holding {load.memory_bytes / 1024 ** 2:.1f} MB "
+            "in memory."
+        )
+        self.bump_version(name)
+        return name
+
+    def table_source(self, path: str, cursor) -> str:
+        """
+        Returns the SQL source to read the file from, converting it to Parquet if needed.
+        """
+        if self.load_mode != "parquet" or path.lower().endswith(".parquet"):
+            return quote_literal(path)
+        key = fingerprint(
+            ",".join(
+                f"{os.path.abspath(file)}:{source.mtime_ns}:{source.size}"
+                for file, source in self.source_files(path, tails=False).items()
+            )
+        )
+        stem = os.path.splitext(os.path.basename(path))[0]
+        cached = os.path.join(self.parquet_cache_dir, f"{stem}-{key}.parquet")
+        if not os.path.exists(cached):
+            os.makedirs(self.parquet_cache_dir, exist_ok=True)
+            partial = f"{cached}.{os.getpid()}.{threading.get_ident()}.tmp"
+            cursor.execute(
+                f"COPY (SELECT * FROM {quote_literal(path)}) TO {quote_literal(partial)} "
+                "(FORMAT PARQUET);"
+            )
+            os.replace(partial, cached)
+            logger.debug(f"File '{path}' converted to Parquet cache '{cached}'.")
+        return quote_literal(cached)
+
+    def memory_usage(self, cursor) -> int:
+        """
+        Returns the memory held by DuckDB in bytes.
+        """
+        return cursor.execute("SELECT sum(memory_usage_bytes) FROM duckdb_memory()").fetchone()[0]
+
+    def describe_table(self, table_name: str, sample_rows: int = 100000) -> str:
+        """
+        Describes the table columns from their types and statistics over a row sample,
+        computed in a single aggregation pass.
+        """
+        cursor = self.cursors.acquire()
+        try:
+            columns = cursor.execute(f"DESCRIBE {table_name}").fetchall()
+            aggregates = []
+            for column_name, column_type, *_ in columns:
+                column = quote_identifier(column_name)
+                aggregates.append(f"approx_count_distinct({column})")
+                if any(nested in column_type for nested in ("[]", "STRUCT", "MAP", "UNION")):
+                    aggregates += ["NULL", "NULL", "NULL"]
+                    continue
+                aggregates += [f"min({column})::VARCHAR", f"max({column})::VARCHAR"]
+                if column_type in ("VARCHAR", "BOOLEAN") or column_type.startswith("ENUM"):
+                    aggregates.append(f"approx_top_k({column}, 5)")
+                else:
+                    aggregates.append("NULL")
+            stats = cursor.execute(
+                f"SELECT count(*), {', '.join(aggregates)} "
+                f"FROM {table_name} USING SAMPLE {sample_rows} ROWS"
+            ).fetchone()
+        finally:
+            self.cursors.release(cursor)
+
+        lines = [f"Column descriptions generated from a sample of {stats[0]} rows."]
+        # every column has four consecutive statistics after the row count
+        column_stats = zip(*[iter(stats[1:])] * 4)
+        for (column_name, column_type, *_), (distinct, minimum, maximum, top) in zip(
+            columns, column_stats
+        ):
+            line = f"- {column_name}: {column_type}. About {distinct} distinct values"
+            if top:
+                line += ", most common: " + ", ".join(str(value) for value in top)
+            elif minimum is not None:
+                line += f", ranging from {minimum} to {maximum}"
+            lines.append(line + ".")
+        return "\n".join(lines)
+
+    def table_columns(self, table_name: str) -> List[Tuple[str, str]]:
+        cursor = self.cursors.acquire()
+        try:
+            columns = cursor.execute(f"DESCRIBE {table_name}").fetchall()
+        finally:
+            self.cursors.release(cursor)
+        return [(column_name, column_type) for column_name, column_type, *_ in columns]
+
+    def table_path(self, table_name: str) -> str | None:
+        load = self.tables.get(table_name)
+        return load.path if load else None
+
+    def source_files(self, path: str, tails: bool = True) -> Dict[str, SourceFile]:
+        """
+        Returns the state of the files matching the path, a glob pattern for union loads.
+        """
+        files = {}
+        for file in sorted(glob.glob(path, recursive=True)) if glob.has_magic(path) else [path]:
+            stat = os.stat(file)
+            tail = ""
+            # a partial last line was ingested as a row, so only complete files can grow by
+            # appending lines, others are loaded again when they change
+            if (
+                tails
+                and file.lower().endswith(APPENDABLE_EXTENSIONS)
+                and self.ends_with_line(file, stat.st_size)
+            ):
+                tail = self.tail_fingerprint(file, stat.st_size)
+            files[file] = SourceFile(size=stat.st_size, mtime_ns=stat.st_mtime_ns, tail=tail)
+        return files
+
+    @staticmethod
+    def tail_fingerprint(path: str, size: int, length: int = 4096) -> str:
+        """
+        Fingerprints the bytes of the file preceding the given size.
+        """
+        with open(path, "rb") as fp:
+            fp.seek(max(size - length, 0))
+            return fingerprint(fp.read(min(size, length)).decode("utf-8", "replace"))
+
+    def changed_tables(self) -> List[str]:
+        """
+        Returns the loaded tables whose source files changed in size or modification time,
+        or that gained or lost files, without reading any of them.
+        """
+        changed = []
+        for name, load in list(self.tables.items()):
+            try:
+                files = self.source_files(load.path, tails=False)
+            except OSError:
+                changed.append(name)
+                continue
+            if files.keys() != load.files.keys() or any(
+                (source.size, source.mtime_ns)
+                != (load.files[file].size, load.files[file].mtime_ns)
+                for file, source in files.items()
+            ):
+                changed.append(name)
+        return changed
+
+    def refresh_table(self, table_name: str, path: str | None = None) -> TableRefresh:
+        """
+        Brings the table up to date with its source files, under the same name.
+
+        Tables copied into DuckDB ingest only the delta: new files of their glob pattern, and
+        the bytes appended to CSV files since their last ingestion, up to the last complete
+        line. Views, and tables whose files were rewritten, shrank, were removed or ended with a
+        partial line when ingested, are loaded again from scratch, as are tables whose delta
+        fails to ingest. So are tables this querier did not load, from the given path, such
+        as tables of a persistent database reused by a resumed session. Any change bumps the
+        table version.
         """
-        Builds a table connection
+        with self._refresh_lock:
+            stime = time.perf_counter()
+            if table_name not in self.tables:
+                if path is None:
+                    raise KeyError(f"Table '{table_name}' was not loaded by this querier.")
+                self.load_table(path, name=table_name)
+                return TableRefresh(
+                    table_name=table_name,
+                    rebuilt=True,
+                    version=self.table_versions[table_name],
+                    seconds=time.perf_counter() - stime,
+                )
+            load = self.tables[table_name]
+            files = self.source_files(load.path)
+            refresh = TableRefresh(
+                table_name=table_name, new_files=len(files.keys() - load.files.keys())
+            )
+            appended = {
+                file: source
+                for file, source in files.items()
+                if file in load.files and source != load.files[file]
+            }
+            if not refresh.new_files and not appended and files.keys() == load.files.keys():
+                refresh.version = self.table_versions.get(table_name, 0)
+                return refresh
+            if (
+                load.mode != "table"
+                or not files.keys() >= load.files.keys()
+                or not all(self.is_append(file, load.files[file]) for file in appended)
+            ):
+                self.load_table(load.path, name=table_name)
+                refresh.rebuilt = True
+            else:
+                try:
+                    refresh.appended_rows = self.ingest_delta(table_name, load, files)
+                    self.bump_version(table_name)
+                except Exception:
+                    logger.exception(
+                        f"Ingesting the new rows of table '{table_name}' failed, loading it "
+                        "again from scratch."
+                    )
+                    self.load_table(load.path, name=table_name)
+                    refresh.rebuilt = True
+            refresh.version = self.table_versions[table_name]
+            refresh.seconds = time.perf_counter() - stime
+        logger.info(
+            f"Table '{table_name}' refreshed to version {refresh.version} in "
+            f"{refresh.seconds:.2f} seconds: "
+            + (
+                "loaded again from scratch."
+                if refresh.rebuilt
+                else f"{refresh.appended_rows} rows appended, {refresh.new_files} new files."
+            )
+        )
+        return refresh
+
+    def is_append(self, path: str, ingested: SourceFile) -> bool:
+        """
+        Returns whether the file only grew since it was ingested, keeping its ingested bytes.
+        """
+        if not path.lower().endswith(APPENDABLE_EXTENSIONS) or not ingested.tail:
+            return False
+        size = os.stat(path).st_size
+        return (
+            size >= ingested.size and self.tail_fingerprint(path, ingested.size) == ingested.tail
+        )
+
+    def ingest_delta(self, table_name: str, load: TableLoad, files: Dict[str, SourceFile]) -> int:
+        """
+        Inserts the new files and the appended CSV lines into the table in one transaction,
+        and records how far every file was ingested.
+        """
+        # resolved before acquiring the cursor, as describing the table takes a cursor as well
+        columns = ", ".join(
+            f"{quote_literal(column)}: {quote_literal(column_type)}"
+            for column, column_type in self.table_columns(table_name)
+        )
+        cursor = self.cursors.acquire()
+        try:
+            cursor.execute("BEGIN TRANSACTION;")
+            rows, partials = 0, []
+            try:
+                for file, source in files.items():
+                    if file not in load.files:
+                        rows += cursor.execute(
+                            f"INSERT INTO {table_name} SELECT * FROM {quote_literal(file)};"
+                        ).fetchone()[0]
+                    elif source != load.files[file]:
+                        delta, size = self.appended_lines(file, load.files[file].size)
+                        files[file] = load.files[file].model_copy(
+                            update={
+                                "size": size,
+                                "mtime_ns": source.mtime_ns,
+                                "tail": self.tail_fingerprint(file, size),
+                            }
+                        )
+                        if delta is None:
+                            continue
+                        partials.append(delta)
+                        # the delta is read with the column types of the table
+                        rows += cursor.execute(
+                            f"INSERT INTO {table_name} SELECT * FROM read_csv("
+                            f"{quote_literal(delta)}, header = true, columns = {{{columns}}});"
+                        ).fetchone()[0]
+                cursor.execute("COMMIT;")
+            except Exception:
+                cursor.execute("ROLLBACK;")
+                raise
+            finally:
+                for partial in partials:
+                    os.remove(partial)
+        finally:
+            self.cursors.release(cursor)
+        self.tables[table_name] = load.model_copy(update={"files": files})
+        return rows
+
+    def appended_lines(self, path: str, offset: int) -> Tuple[str | None, int]:
+        """
+        Copies the header line and the complete lines appended after the offset to a temporary
+        CSV file, and returns its path, or None if no line is complete, and the offset the
+        file is ingested up to.
+        """
+        with open(path, "rb") as fp:
+            # the header line was not ingested yet if the file was empty
+            header = fp.readline() if offset else b""
+            fp.seek(offset)
+            appended = fp.read()
+        complete = appended.rfind(b"\n") + 1
+        if complete == 0:
+            return None, offset
+        with tempfile.NamedTemporaryFile(suffix=".csv", delete=False) as delta:
+            delta.write(header + appended[:complete])
+        return delta.name, offset + complete
+
+    def bump_version(self, table_name: str) -> None:
+        """
+        Marks the table as changed, dropping cached results that depend on it.
+        """
+        self.table_versions[table_name] = self.table_versions.get(table_name, 0) + 1
+        self.result_cache.discard(lambda key: table_name in dict(key[1]))
+        if self.rollups is not None:
+            self.rollups.invalidate(table_name)
+
+    def close(self) -> None:
+        """
+        Stops the rollup builds and the query worker pool, without waiting for running queries.
+        """
+        if self.rollups is not None:
+            self.rollups.close()
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def is_schema_error(self, error: Exception) -> bool:
         """
-        self.db_conn.execute(
-            f"CREATE OR REPLACE TABLE df{self.df_counter} AS SELECT * FROM '{table_name}';"
+        Returns whether DuckDB failed to bind a table or column name.
+        """
+        import duckdb
+
+        return isinstance(error, (duckdb.CatalogException, duckdb.BinderException))
+
+    def validate(self, sql_text: str) -> ValidationResult:
+        """
+        Parses, binds and plans the SQL query with EXPLAIN, without scanning any data, and
+        inspects the plan for unbounded cross joins and very large estimated cardinalities.
+        A cross join is only an error when neither of its inputs is aggregated or limited, so
+        that combining rows with a total, as in shares of a total, is allowed.
+        """
+        if not is_read_only(sql_text):
+            return ValidationResult(
+                errors=[
+                    "Only a single read only query (SELECT, WITH, DESCRIBE, SUMMARIZE or SHOW) "
+                    "is allowed."
+                ]
+            )
+        cursor = self.cursors.acquire()
+        try:
+            plan = json.loads(
+                cursor.execute(f"EXPLAIN (FORMAT JSON) {sql_text}").fetchall()[0][-1]
+            )
+        except Exception as e:
+            return ValidationResult(
+                errors=[compact_error(str(e))], schema_error=self.is_schema_error(e)
+            )
+        finally:
+            self.cursors.release(cursor)
+
+        result = ValidationResult()
+        bounded = has_limit(sql_text)
+        nodes = list(plan_nodes(plan))
+        if not bounded and any(
+            node["name"].strip() == "CROSS_PRODUCT"
+            and not any(is_reduced(child) for child in node["children"])
+            for node in nodes
+        ):
+            result.errors.append(
+                "The query computes an unbounded cross join of tables. Join the tables on a "
+                "matching key column, or aggregate each table before combining them."
+            )
+        estimated_rows = max(
+            (
+                int(node["extra_info"]["Estimated Cardinality"])
+                for node in nodes
+                if str(node["extra_info"].get("Estimated Cardinality", "")).isdigit()
+            ),
+            default=0,
         )
-        logger.debug(f"Table 'df{self.df_counter}' loaded from '{table_name}'.")
-        self.df_counter += 1
-        return f"df{self.df_counter - 1}"
+        if estimated_rows > MAX_PLAN_ROWS:
+            result.warnings.append(f"The query plan estimates up to {estimated_rows} rows.")
+        if not bounded:
+            result.warnings.append("The query has no LIMIT clause.")
+        return result
 
-    def query(self, sql_text: str) -> List[tuple]:
+    def stream(self, sql_text: str, batch_size: int = QUERY_BATCH_ROWS) -> Iterator[List[tuple]]:
+        """
+        Executes the SQL query on a separate cursor and yields the result in row batches.
+        The first item yielded is the list of (column name, column type) pairs.
+        """
+        import duckdb
+
+        cursor = self.cursors.acquire()
+        scope = cancel_scope.get()
+        if scope is not None and not scope.attach(cursor):
+            self.cursors.release(cursor)
+            raise QueryCancelledError("The query was cancelled.")
+        watchdog = None
+        # set before interrupting, as the interrupt may be raised before the timer finishes
+        timed_out = threading.Event()
+
+        def expire() -> None:
+            timed_out.set()
+            cursor.interrupt()
+
+        if self.query_timeout:
+            watchdog = threading.Timer(self.query_timeout, expire)
+            watchdog.daemon = True
+            watchdog.start()
+        try:
+            result = self.execute_interruptible(cursor, sql_text, scope)
+            if result is None:
+                yield []
+                return
+            yield [
+                (column, str(column_type))
+                for column, column_type in zip(result.columns, result.types)
+            ]
+            while batch := result.fetchmany(batch_size):
+                if scope is not None and scope.cancelled:
+                    raise QueryCancelledError("The query was cancelled.")
+                yield batch
+        except KeyboardInterrupt:
+            cursor.interrupt()
+            raise QueryCancelledError("The query was cancelled by the user.")
+        except (duckdb.InterruptException, RuntimeError) as e:
+            if timed_out.is_set():
+                raise QueryTimeoutError(self.query_timeout) from e
+            if scope is not None and scope.cancelled:
+                raise QueryCancelledError("The query was cancelled.") from e
+            if isinstance(e, duckdb.InterruptException) or "interrupted" in str(e).lower():
+                raise QueryCancelledError("The query was cancelled by the user.") from e
+            raise
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+            if scope is not None:
+                scope.detach(cursor)
+            self.cursors.release(cursor)
+
+    def execute_interruptible(
+        self, cursor, sql_text: str, scope: CancelScope | None = None
+    ) -> Any:
+        """
+        Executes the SQL text on the cursor, and returns the relation of its result, or None for
+        statements without a result. The relation keeps the DuckDB types of the result columns,
+        which the cursor description reduces to DBAPI type codes.
+
+        On the main thread or in a cancel scope the execution runs in a helper thread, so that
+        a keyboard interrupt is received while DuckDB worker threads are busy and can be
+        forwarded to the cursor, and so that the cursor is interrupted until the execution
+        stops once the scope is cancelled, as an interrupt sent before the execution started
+        is lost.
+        """
+
+        def execute() -> Any:
+            # queries are executed once their relation is, other statements right away
+            relation = cursor.sql(sql_text)
+            return relation.execute() if relation is not None else None
+
+        if threading.current_thread() is not threading.main_thread() and scope is None:
+            return execute()
+        done = threading.Event()
+        results: List[Any] = []
+        errors: List[BaseException] = []
+
+        def run() -> None:
+            try:
+                results.append(execute())
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                done.set()
+
+        threading.Thread(target=run, daemon=True).start()
+        try:
+            while not done.wait(0.1 if scope is None else 0.01):
+                if scope is not None and scope.cancelled:
+                    cursor.interrupt()
+        except KeyboardInterrupt:
+            cursor.interrupt()
+            done.wait()
+            raise
+        if errors:
+            raise errors[0]
+        return results[0]
+
+    def fetch(self, sql_text: str) -> QueryResult:
+        """
+        Executes the SQL query and collects its result up to the row and byte limits.
+        """
+        if is_read_only(sql_text) and tokenize(sql_text)[0].upper() != "TABLE":
+            body = sql_text.strip().rstrip(";")
+            sql_text = f"SELECT * FROM (\n{body}\n) LIMIT {self.max_rows + 1}"
+        batches = self.stream(sql_text, min(QUERY_BATCH_ROWS, self.max_rows + 1))
+        description = next(batches, [])
+        rows: List[tuple] = []
+        nbytes, truncated = 0, False
+        for batch in batches:
+            nbytes += rows_size(batch)
+            rows += batch
+            if len(rows) > self.max_rows or nbytes > self.max_result_bytes:
+                truncated = True
+                batches.close()
+                break
+        if truncated:
+            keep = min(self.max_rows, len(rows))
+            while keep > 1 and rows_size(rows[:keep]) > self.max_result_bytes:
+                keep //= 2
+            rows = rows[:keep]
+        return QueryResult.from_rows(
+            [name for name, _ in description],
+            [column_type for _, column_type in description],
+            rows,
+            truncated,
+        )
+
+    def fetch_rollup(self, sql_text: str) -> QueryResult:
+        """
+        Executes the read only query, rewritten to read from a rollup if one covers it, and
+        logs it for rollup mining. Falls back to the query as is if the rewrite fails.
+        """
+        rewritten = None
+        if self.rollups is not None:
+            try:
+                rewritten = self.rollups.rewrite(sql_text)
+            except Exception:
+                logger.exception("Matching the query against the rollups failed.")
+        if rewritten is not None:
+            try:
+                return self.fetch(rewritten)
+            except (QueryTimeoutError, QueryCancelledError):
+                raise
+            except Exception:
+                logger.exception("Rewritten query failed, running the original query.")
+        return self.fetch(sql_text)
+
+    def query(self, sql_text: str) -> QueryResult:
         """
         Executes the SQL query and returns the result.
         """
-        return self.db_conn.execute(sql_text).fetchall()
+        with tracer.span("query") as span:
+            stime = time.perf_counter()
+            result, cached = self.cached_fetch(sql_text)
+            if span.recording:
+                span.set(
+                    rows=result.row_count,
+                    bytes=result.nbytes,
+                    duckdb_seconds=0.0 if cached else time.perf_counter() - stime,
+                    cache_hits=int(cached),
+                    truncated=int(result.truncated),
+                )
+        return result
+
+    async def avalidate(self, sql_text: str) -> ValidationResult:
+        """
+        Validates the SQL query on the query worker pool.
+        """
+        return await self.run_in_pool(self.validate, sql_text)
+
+    async def aquery(self, sql_text: str) -> QueryResult:
+        """
+        Executes the SQL query on the query worker pool.
+        """
+        return await self.run_in_pool(self.query, sql_text)
+
+    async def run_in_pool(self, func: Callable[..., T], *args: Any) -> T:
+        """
+        Runs the function on the query worker pool, in the context of the calling task so
+        that its spans nest under the active span.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.query_workers, thread_name_prefix="sql_gpt_query"
+                )
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, functools.partial(context.run, func, *args)
+        )
+
+    def cached_fetch(self, sql_text: str) -> Tuple[QueryResult, bool]:
+        """
+        Returns the result of the SQL query from the result cache if possible, otherwise
+        executes it, along with whether the result was cached.
+
+        Statements that are not read only bump the version of every table, as they may modify
+        any table, including those read by views. Queries of tables loaded as views over their
+        files are not cached, as the files may change without a version bump.
+        """
+        if not is_read_only(sql_text):
+            try:
+                return self.fetch(sql_text), False
+            finally:
+                for table_name in list(self.table_versions):
+                    self.bump_version(table_name)
+        tables = identifiers(sql_text) & set(self.table_versions)
+        in_place = [
+            table for table in tables if table in self.tables and self.tables[table].mode == "view"
+        ]
+        if not tables or in_place or not is_deterministic(sql_text):
+            return self.fetch(sql_text), False
+
+        key = (
+            canonicalize(sql_text),
+            tuple(sorted((table, self.table_versions[table]) for table in tables)),
+        )
+        result = self.result_cache.get(key)
+        cached = result is not None
+        if not cached:
+            result = self.fetch_rollup(sql_text)
+            self.result_cache.put(key, result)
+        logger.debug(
+            f"Result cache hit rate {self.result_cache.hit_rate:.2f}, "
+            f"holding {self.result_cache.bytes} bytes in {len(self.result_cache)} entries."
+        )
+        return result, cached
+
+
+def quote_literal(value: str) -> str:
+    """
+    Quotes the value as an SQL string literal.
+    """
+    return "'" + value.replace("'", "''") + "'"
+
+
+def plan_nodes(plan: List[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """
+    Yields every operator of a query plan in the EXPLAIN JSON format.
+    """
+    for node in plan:
+        yield node
+        yield from plan_nodes(node.get("children", []))
+
+
+def is_reduced(node: Dict[str, Any]) -> bool:
+    """
+    Returns whether the plan operator yields an aggregated, limited or constant row set,
+    looking through projections, filters and sorts.
+    """
+    name = node["name"].strip()
+    if name in REDUCING_OPERATORS:
+        return True
+    if name in ("PROJECTION", "FILTER", "ORDER_BY") and len(node["children"]) == 1:
+        return is_reduced(node["children"][0])
+    return False
+
+
+def compact_error(message: str) -> str:
+    """
+    Reduces a DuckDB error message to its description and hints, dropping the echoed query.
+    """
+    lines = [line.strip() for line in message.splitlines()]
+    return " ".join(line for line in lines if line and not line.startswith(("LINE ", "^")))
+
+
+def quote_identifier(value: str) -> str:
+    """
+    Quotes the value as an SQL identifier.
+    """
+    return '"' + value.replace('"', '""') + '"'
+
+
+def rows_size(rows: List[tuple]) -> int:
+    """
+    Estimates the memory held by a list of result rows.
+    """
+    return sys.getsizeof(rows) + sum(
+        sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row) for row in rows
+    )
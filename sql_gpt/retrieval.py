@@ -0,0 +1,152 @@
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from sql_gpt.context import count_tokens
+
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "each", "for", "from", "give", "how",
+    "i", "in", "is", "it", "me", "most", "of", "on", "or", "show", "than", "that", "the",
+    "their", "there", "this", "to", "what", "when", "where", "which", "who", "with",
+}  # fmt: skip
+
+
+def tokenize_words(text: str) -> List[str]:
+    """
+    Splits text into lower cased and singularized terms, splitting camel case and snake case
+    identifiers.
+    """
+    terms = []
+    for word in re.findall(r"[A-Za-z0-9]+", text):
+        parts = re.findall(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+", word)
+        for term in {word.lower(), *(part.lower() for part in parts)}:
+            if term not in STOP_WORDS:
+                terms.append(re.sub(r"(?<=[a-z]{3})s$", "", term))
+    return terms
+
+
+class BM25Index:
+    """
+    Okapi BM25 ranking over a small in-memory collection of documents.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self.documents: List[Counter] = []
+        self.lengths: List[int] = []
+        self.document_frequency: Counter = Counter()
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def add(self, text: str) -> int:
+        """
+        Adds a document and returns its position in the index.
+        """
+        terms = Counter(tokenize_words(text))
+        self.documents.append(terms)
+        self.lengths.append(sum(terms.values()))
+        self.document_frequency.update(terms.keys())
+        return len(self.documents) - 1
+
+    def remove(self, position: int) -> None:
+        """
+        Empties the document at the given position, keeping the other positions stable.
+        """
+        self.document_frequency.subtract(self.documents[position].keys())
+        self.documents[position] = Counter()
+        self.lengths[position] = 0
+
+    def scores(self, query: str) -> List[float]:
+        """
+        Returns the BM25 score of every document for the query.
+        """
+        terms = set(tokenize_words(query))
+        count = sum(1 for length in self.lengths if length)
+        average_length = sum(self.lengths) / count if count else 0.0
+        scores = [0.0] * len(self.documents)
+        for term in terms:
+            frequency = self.document_frequency.get(term, 0)
+            if frequency <= 0:
+                continue
+            idf = math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+            for position, document in enumerate(self.documents):
+                tf = document.get(term, 0)
+                if tf:
+                    norm = 1 - self.b + self.b * self.lengths[position] / average_length
+                    scores[position] += idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+        return scores
+
+
+class SchemaIndex:
+    """
+    Relevance index over table and column descriptions.
+
+    Every column description line of a table metadata file is indexed as a separate document,
+    prefixed with its table name. For a question only the highest ranked tables are selected,
+    and of wide tables only their highest ranked columns.
+    """
+
+    def __init__(
+        self, max_tables: int = 3, max_columns: int = 30, min_schema_tokens: int = 1000
+    ) -> None:
+        self.max_tables = max_tables
+        self.max_columns = max_columns
+        self.min_schema_tokens = min_schema_tokens
+        self.index = BM25Index()
+        # table name -> (header lines, column lines, index positions of the column lines)
+        self.tables: Dict[str, Tuple[List[str], List[str], List[int]]] = {}
+
+    def add_table(self, table_name: str, meta: str) -> None:
+        """
+        Indexes the table metadata, replacing any previous metadata of the same table.
+        """
+        self.remove_table(table_name)
+        header, columns = [], []
+        for line in meta.splitlines():
+            if re.match(r"\s*[-*]\s+\S", line):
+                columns.append(line)
+            elif line.strip():
+                header.append(line)
+        context = f"{table_name} {' '.join(header)}"
+        positions = [self.index.add(f"{context} {column}") for column in columns]
+        if not columns:
+            positions.append(self.index.add(context))
+        self.tables[table_name] = (header, columns, positions)
+
+    def remove_table(self, table_name: str) -> None:
+        if table_name in self.tables:
+            for position in self.tables.pop(table_name)[2]:
+                self.index.remove(position)
+
+    def render(self, table_name: str, columns: List[str] | None = None) -> str:
+        header, all_columns, _ = self.tables[table_name]
+        return "\n".join([f"Table: {table_name}", *header, *(columns or all_columns)]) + "\n"
+
+    def select(self, question: str) -> str | None:
+        """
+        Returns the schemas of the tables and columns relevant to the question, or None if
+        the full schemas should be used because they are small or nothing matched.
+        """
+        full = "".join(self.render(table_name) for table_name in self.tables)
+        if count_tokens(full) < self.min_schema_tokens:
+            return None
+        scores = self.index.scores(question)
+        ranked = []
+        for table_name, (_, columns, positions) in self.tables.items():
+            table_scores = [scores[position] for position in positions]
+            if max(table_scores, default=0.0) > 0:
+                ranked.append((max(table_scores), table_name, columns, table_scores))
+        if not ranked:
+            return None
+        ranked.sort(key=lambda item: item[0], reverse=True)
+        selected = []
+        for _, table_name, columns, table_scores in ranked[: self.max_tables]:
+            if len(columns) > self.max_columns:
+                best = sorted(range(len(columns)), key=lambda i: table_scores[i], reverse=True)
+                keep = set(best[: self.max_columns])
+                columns = [column for i, column in enumerate(columns) if i in keep]
+            selected.append(self.render(table_name, columns))
+        return "".join(selected)
@@ -0,0 +1,504 @@
+"""
+Materialized rollups of the loaded tables, mined from the log of aggregate queries.
+
+Aggregate queries over a single table are parsed with DuckDB's `json_serialize_sql`, and
+logged by table and dimensions, the columns they reference outside of aggregates. Once a
+pattern is frequent, a rollup table grouping the table by these dimensions is built in the
+background, with the partial aggregates the queries need. Matching queries are then rewritten
+to aggregate the rollup instead of scanning the table. Rollups of a table are dropped when its
+version is bumped, and built again on demand.
+"""
+
+import copy
+import functools
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, FrozenSet, Iterator, List, Set, Tuple, TypeVar
+
+from pydantic import BaseModel
+
+from sql_gpt.cache import fingerprint
+from sql_gpt.constants import QUERY_LOG_SIZE, ROLLUP_MAX_ROWS_RATIO, ROLLUP_MIN_QUERIES
+from sql_gpt.logging import logger
+from sql_gpt.querier import CancelScope, quote_identifier
+
+# aggregate -> partial aggregates kept in the rollup, and the expression combining them
+AGGREGATES: Dict[str, Tuple[Tuple[str, ...], str]] = {
+    "sum": (("sum",), "sum({sum})"),
+    "min": (("min",), "min({min})"),
+    "max": (("max",), "max({max})"),
+    # counts are 0 rather than NULL when no rollup row matches
+    "count": (("count",), "CAST(coalesce(sum({count}), 0) AS BIGINT)"),
+    "count_star": (("count_star",), "CAST(coalesce(sum({count_star}), 0) AS BIGINT)"),
+    "avg": (("sum", "count"), "CAST(sum({sum}) AS DOUBLE) / sum({count})"),
+    "mean": (("sum", "count"), "CAST(sum({sum}) AS DOUBLE) / sum({count})"),
+}
+MODIFIERS = {"ORDER_MODIFIER", "LIMIT_MODIFIER", "DISTINCT_MODIFIER"}
+ROLLUP_PREFIX = "sql_gpt_rollup_"
+
+T = TypeVar("T")
+
+
+class AggregateQuery(BaseModel):
+    """
+    An aggregate query over a single table.
+
+    Attributes:
+        table (str): Name of the table.
+        dimensions (FrozenSet[str]): Columns referenced outside of aggregates.
+        measures (FrozenSet[Tuple[str, str]]): Partial aggregates and columns it needs.
+        node (Dict[str, Any]): Parsed query.
+    """
+
+    table: str
+    dimensions: FrozenSet[str]
+    measures: FrozenSet[Tuple[str, str]]
+    node: Dict[str, Any]
+
+
+class Rollup(BaseModel):
+    """
+    A materialized rollup table.
+
+    Attributes:
+        name (str): Name of the rollup table.
+        table (str): Name of the table it aggregates.
+        version (int): Version of the table it was built from.
+        dimensions (FrozenSet[str]): Columns it is grouped by.
+        measures (FrozenSet[Tuple[str, str]]): Partial aggregates and columns it holds.
+        rows (int): Number of rows it holds.
+        memory_bytes (int): Growth of DuckDB memory while building it.
+        build_seconds (float): Time it took to build it.
+        hits (int): Number of queries rewritten to read from it.
+    """
+
+    name: str
+    table: str
+    version: int
+    dimensions: FrozenSet[str]
+    measures: FrozenSet[Tuple[str, str]]
+    rows: int = 0
+    memory_bytes: int = 0
+    build_seconds: float = 0.0
+    hits: int = 0
+
+
+def walk(obj: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Yields the outermost expression nodes nested in the parsed query fragment.
+    """
+    if isinstance(obj, dict):
+        if "class" in obj:
+            yield obj
+        else:
+            for value in obj.values():
+                yield from walk(value)
+    elif isinstance(obj, list):
+        for value in obj:
+            yield from walk(value)
+
+
+def transform(obj: Any, func: Callable[[Dict[str, Any]], Dict[str, Any] | None]) -> Any:
+    """
+    Returns a copy of the parsed query fragment, with every expression node replaced by the
+    result of the function, or transformed recursively when it returns None.
+    """
+    if isinstance(obj, dict):
+        if "class" in obj:
+            replaced = func(obj)
+            if replaced is not None:
+                return replaced
+        return {key: transform(value, func) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [transform(value, func) for value in obj]
+    return obj
+
+
+def measure_column(partial: str, column: str) -> str:
+    """
+    Returns the name of the rollup column holding the partial aggregate of the column.
+    """
+    return "count_star()" if partial == "count_star" else f"{partial}({column})"
+
+
+class RollupManager:
+    """
+    Logs the aggregate queries of a DuckDB querier, builds rollups of frequent patterns on a
+    background thread, and rewrites matching queries to read from them.
+
+    A pattern is a table and a set of dimensions, frequent once it is seen `min_queries` times
+    among the last `log_size` aggregate queries. Rollups holding more than `max_rows_ratio` of
+    the rows of their table are dropped as not worth keeping.
+    """
+
+    def __init__(
+        self,
+        querier,
+        min_queries: int = ROLLUP_MIN_QUERIES,
+        max_rows_ratio: float = ROLLUP_MAX_ROWS_RATIO,
+        log_size: int = QUERY_LOG_SIZE,
+    ) -> None:
+        self.querier = querier
+        self.min_queries = min_queries
+        self.max_rows_ratio = max_rows_ratio
+        # (table, dimensions, measures) of the most recent aggregate queries
+        self.log: deque = deque(maxlen=log_size)
+        self.rollups: Dict[str, Rollup] = {}
+        # patterns being built, and patterns rejected at a table version
+        self.pending: Set[Tuple[str, FrozenSet[str]]] = set()
+        self.rejected: Dict[Tuple[str, FrozenSet[str]], int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.builds = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sql_gpt_rollup")
+        # interrupts the build in progress once the manager is closed
+        self._scope = CancelScope()
+        # parsed expressions of the aggregate templates
+        self._expressions: Dict[str, Dict[str, Any]] = {}
+        # rollups left in a persistent database by a previous process
+        stale = self.execute(
+            lambda cursor: cursor.execute(
+                "SELECT table_name FROM information_schema.tables "
+                f"WHERE starts_with(table_name, '{ROLLUP_PREFIX}')"
+            ).fetchall()
+        )
+        self.drop([name for (name,) in stale])
+
+    def execute(self, func: Callable[[Any], T]) -> T:
+        """
+        Runs the function on a cursor of the querier pool.
+        """
+        cursor = self.querier.cursors.acquire()
+        try:
+            return func(cursor)
+        finally:
+            self.querier.cursors.release(cursor)
+
+    @functools.cached_property
+    def aggregate_functions(self) -> Set[str]:
+        rows = self.execute(
+            lambda cursor: cursor.execute(
+                "SELECT DISTINCT function_name FROM duckdb_functions() "
+                "WHERE function_type = 'aggregate'"
+            ).fetchall()
+        )
+        return {name.lower() for (name,) in rows}
+
+    def parse(self, sql_text: str) -> AggregateQuery | None:
+        """
+        Parses the SQL text, returning it as an aggregate query if it is one over a single
+        loaded table, whose aggregates can all be combined from partial aggregates.
+        """
+        parsed = json.loads(
+            self.execute(
+                lambda cursor: cursor.execute(
+                    "SELECT json_serialize_sql(?::VARCHAR)", [sql_text]
+                ).fetchone()[0]
+            )
+        )
+        if parsed.get("error") or len(parsed["statements"]) != 1:
+            return None
+        node = parsed["statements"][0]["node"]
+        source = node.get("from_table") or {}
+        if (
+            node.get("type") != "SELECT_NODE"
+            or source.get("type") != "BASE_TABLE"
+            or source.get("schema_name")
+            or source.get("sample")
+            or source.get("table_name") not in self.querier.table_versions
+            or node.get("cte_map", {}).get("map")
+            or node.get("qualify")
+            or node.get("sample")
+            or len(node.get("group_sets") or []) > 1
+            or node.get("aggregate_handling") != "STANDARD_HANDLING"
+            or any(modifier["type"] not in MODIFIERS for modifier in node.get("modifiers", []))
+        ):
+            return None
+        table = source["table_name"]
+        qualifiers = {table.lower(), source.get("alias", "").lower()} - {""}
+        columns = {name.lower(): name for name, _ in self.querier.table_columns(table)}
+        dimensions: Set[str] = set()
+        measures: Set[Tuple[str, str]] = set()
+
+        def column_of(expression: Dict[str, Any]) -> str | None:
+            names = expression["column_names"]
+            if len(names) > 2 or (len(names) == 2 and names[0].lower() not in qualifiers):
+                raise ValueError(f"unknown column {'.'.join(names)}")
+            return columns.get(names[-1].lower())
+
+        def visit(expression: Dict[str, Any]) -> None:
+            kind = expression["class"]
+            if kind in ("WINDOW", "SUBQUERY", "STAR", "LAMBDA", "PARAMETER"):
+                raise ValueError(f"unsupported expression {kind}")
+            if kind == "COLUMN_REF":
+                # names that are not table columns are aliases of the select list
+                column = column_of(expression)
+                if column is not None:
+                    dimensions.add(column)
+                return
+            name = expression["function_name"].lower() if kind == "FUNCTION" else ""
+            if name not in self.aggregate_functions:
+                for value in expression.values():
+                    for child in walk(value):
+                        visit(child)
+                return
+            children = expression["children"]
+            if (
+                name not in AGGREGATES
+                or expression["distinct"]
+                or expression["filter"]
+                or expression["order_bys"]["orders"]
+                or len(children) != (name != "count_star")
+            ):
+                raise ValueError(f"unsupported aggregate {name}")
+            column = ""
+            if children:
+                column = children[0]["class"] == "COLUMN_REF" and column_of(children[0]) or ""
+                if not column:
+                    raise ValueError(f"unsupported argument of aggregate {name}")
+            measures.update((partial, column) for partial in AGGREGATES[name][0])
+
+        try:
+            for part in (
+                "select_list",
+                "where_clause",
+                "group_expressions",
+                "having",
+                "modifiers",
+            ):
+                for expression in walk(node.get(part)):
+                    visit(expression)
+        except ValueError as e:
+            logger.debug(f"Query is not eligible for rollups: {e}")
+            return None
+        if not measures:
+            return None
+        return AggregateQuery(
+            table=table, dimensions=frozenset(dimensions), measures=frozenset(measures), node=node
+        )
+
+    def rewrite(self, sql_text: str) -> str | None:
+        """
+        Logs the query if it is an aggregate query, and returns it rewritten to read from a
+        rollup if one covers it. Otherwise schedules a rollup build if its pattern is frequent.
+        """
+        query = self.parse(sql_text)
+        if query is None:
+            return None
+        key = (query.table, query.dimensions)
+        with self._lock:
+            self.log.append((query.table, query.dimensions, query.measures))
+            version = self.querier.table_versions.get(query.table, 0)
+            covering = [
+                rollup
+                for rollup in self.rollups.values()
+                if rollup.table == query.table
+                and rollup.version == version
+                and rollup.dimensions >= query.dimensions
+                and rollup.measures >= query.measures
+            ]
+            if not covering:
+                self.misses += 1
+                pattern = [entry for entry in self.log if entry[:2] == key]
+                if (
+                    len(pattern) >= self.min_queries
+                    and key not in self.pending
+                    and self.rejected.get(key) != version
+                    and not self._scope.cancelled
+                ):
+                    self.pending.add(key)
+                    measures = frozenset().union(*(entry[2] for entry in pattern))
+                    self._executor.submit(self.build, *key, measures, version)
+                return None
+            rollup = min(covering, key=lambda rollup: rollup.rows)
+        try:
+            rewritten = self.render(sql_text, query, rollup)
+        except Exception:
+            logger.exception(f"Rewriting the query to read from rollup '{rollup.name}' failed.")
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            rollup.hits += 1
+        logger.debug(f"Query rewritten to read from rollup '{rollup.name}': {rewritten}")
+        return rewritten
+
+    def render(self, sql_text: str, query: AggregateQuery, rollup: Rollup) -> str:
+        """
+        Renders the query rewritten to combine the partial aggregates of the rollup, keeping
+        the names of the result columns.
+        """
+
+        columns = {name.lower(): name for name, _ in self.querier.table_columns(query.table)}
+
+        def replace(expression: Dict[str, Any]) -> Dict[str, Any] | None:
+            if expression["class"] == "COLUMN_REF":
+                names = expression["column_names"]
+                if len(names) == 2 and names[0].lower() == query.table.lower():
+                    return {**expression, "column_names": [rollup.name, names[1]]}
+                return expression
+            name = expression.get("function_name", "").lower()
+            if expression["class"] != "FUNCTION" or name not in self.aggregate_functions:
+                return None
+            children = expression["children"]
+            column = columns[children[0]["column_names"][-1].lower()] if children else ""
+            template = AGGREGATES[name][1].format(
+                **{
+                    partial: quote_identifier(measure_column(partial, column))
+                    for partial in ("sum", "min", "max", "count", "count_star")
+                }
+            )
+            return {**self.expression(template), "alias": expression["alias"]}
+
+        node = transform(query.node, replace)
+        node["from_table"]["table_name"] = rollup.name
+        names = self.execute(
+            lambda cursor: [row[0] for row in cursor.execute(f"DESCRIBE {sql_text}").fetchall()]
+        )
+        for expression, name in zip(node["select_list"], names):
+            expression["alias"] = expression["alias"] or name
+        statement = json.dumps({"error": False, "statements": [{"node": node}]})
+        return self.execute(
+            lambda cursor: cursor.execute(
+                "SELECT json_deserialize_sql(?::JSON)", [statement]
+            ).fetchone()[0]
+        )
+
+    def expression(self, sql_text: str) -> Dict[str, Any]:
+        """
+        Parses the SQL expression into an expression node.
+        """
+        if sql_text not in self._expressions:
+            parsed = self.execute(
+                lambda cursor: cursor.execute(
+                    "SELECT json_serialize_sql(?::VARCHAR)", [f"SELECT {sql_text}"]
+                ).fetchone()[0]
+            )
+            self._expressions[sql_text] = json.loads(parsed)["statements"][0]["node"][
+                "select_list"
+            ][0]
+        return copy.deepcopy(self._expressions[sql_text])
+
+    def build(
+        self,
+        table: str,
+        dimensions: FrozenSet[str],
+        measures: FrozenSet[Tuple[str, str]],
+        version: int,
+    ) -> None:
+        """
+        Builds the rollup of the table by the dimensions, keeping it if it is small enough and
+        the table did not change meanwhile.
+        """
+        key = (table, dimensions)
+        name = ROLLUP_PREFIX + fingerprint(
+            json.dumps([table, version, sorted(dimensions), sorted(measures)])
+        )
+        group = ", ".join(quote_identifier(column) for column in sorted(dimensions))
+        aggregates = ", ".join(
+            ("count(*)" if partial == "count_star" else f"{partial}({quote_identifier(column)})")
+            + f" AS {quote_identifier(measure_column(partial, column))}"
+            for partial, column in sorted(measures | {("count_star", "")})
+        )
+
+        def create(cursor) -> Rollup:
+            stime = time.perf_counter()
+            memory = self.querier.memory_usage(cursor)
+            self.querier.execute_interruptible(
+                cursor,
+                f"CREATE OR REPLACE TABLE {name} AS "
+                f"SELECT {', '.join(filter(None, [group, aggregates]))} FROM {table}"
+                + (f" GROUP BY {group};" if group else ";"),
+                self._scope,
+            )
+            return Rollup(
+                name=name,
+                table=table,
+                version=version,
+                dimensions=dimensions,
+                measures=measures | {("count_star", "")},
+                rows=cursor.execute(f"SELECT count(*) FROM {name}").fetchone()[0],
+                memory_bytes=max(self.querier.memory_usage(cursor) - memory, 0),
+                build_seconds=time.perf_counter() - stime,
+            )
+
+        try:
+            rollup = self.execute(create)
+            table_rows = self.execute(
+                lambda cursor: cursor.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+            )
+        except Exception:
+            if not self._scope.cancelled:
+                logger.exception(f"Building a rollup of table '{table}' failed.")
+            with self._lock:
+                self.pending.discard(key)
+                self.rejected[key] = version
+            return
+        with self._lock:
+            self.pending.discard(key)
+            keep = self.querier.table_versions.get(table) == version
+            if rollup.rows > table_rows * self.max_rows_ratio:
+                self.rejected[key] = version
+                keep = False
+            if keep:
+                self.rollups[name] = rollup
+                self.builds += 1
+        if not keep:
+            self.drop([name])
+            logger.debug(
+                f"Rollup of table '{table}' by {sorted(dimensions)} dropped, holding "
+                f"{rollup.rows} of {table_rows} rows."
+            )
+            return
+        logger.info(
+            f"Rollup '{name}' of table '{table}' by {sorted(dimensions)} built in "
+            f"{rollup.build_seconds:.2f} seconds, holding {rollup.rows} rows."
+        )
+
+    def invalidate(self, table: str) -> None:
+        """
+        Drops the rollups of the table, as its data changed.
+        """
+        with self._lock:
+            names = [name for name, rollup in self.rollups.items() if rollup.table == table]
+            for name in names:
+                del self.rollups[name]
+            self.invalidations += len(names)
+        self.drop(names)
+
+    def close(self) -> None:
+        """
+        Stops building rollups, interrupting the build in progress so that its worker thread
+        does not hold up the exit of the process.
+        """
+        self._scope.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def drop(self, names: List[str]) -> None:
+        cursor = self.querier.cursors.acquire()
+        try:
+            for name in names:
+                cursor.execute(f"DROP TABLE IF EXISTS {quote_identifier(name)};")
+        finally:
+            self.querier.cursors.release(cursor)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "rollups": len(self.rollups),
+                "rows": sum(rollup.rows for rollup in self.rollups.values()),
+                "memory_bytes": sum(rollup.memory_bytes for rollup in self.rollups.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "builds": self.builds,
+                "invalidations": self.invalidations,
+                "logged_queries": len(self.log),
+            }
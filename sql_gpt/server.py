@@ -0,0 +1,432 @@
+"""
+Local HTTP server keeping many concurrent chat sessions in memory.
+
+Tables are loaded once when the server starts, and shared by all sessions through the cursor
+pool of the querier. Every session has its own chat state and answers one message at a time.
+
+Endpoints:
+    POST   /sessions                 creates a session and returns its id
+    POST   /sessions/<id>/messages   answers {"message": "<question>"} within the session
+    DELETE /sessions/<id>            closes the session
+    GET    /stats                    returns session counts, latency percentiles and pool usage
+
+Example load test with the scripted LLM:
+    python -m sql_gpt.server \
+        --script example_data/apple_sales_2024_script.jsonl \
+        --data example_data/apple_sales_2024.csv \
+        --schema example_data/apple_sales_2024_schema.txt \
+        --sessions 32 --rounds 4 --llm-delay 0.2
+"""
+
+import argparse
+import json
+import threading
+import time
+import urllib.request
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+from sql_gpt.benchmark import summarize
+from sql_gpt.constants import (
+    MAX_AGENT_RECURSION_LIMIT,
+    MAX_PROMPT_TOKENS,
+    SERVER_MAX_SESSIONS,
+    SERVER_SESSION_IDLE_SECONDS,
+    SERVER_SESSION_MAX_QUESTIONS,
+)
+from sql_gpt.context import ContextManager
+from sql_gpt.examples import ExampleStore
+from sql_gpt.llm import LLM
+from sql_gpt.logging import logger
+from sql_gpt.querier import Querier
+from sql_gpt.state import ChatState
+
+# commands changing the tables, schemas or state shared by all sessions
+SHARED_COMMANDS = ("/load", "/refresh", "/resume")
+
+
+class SessionLimitError(Exception):
+    """
+    Raised when a request exceeds a limit of its session or of the server.
+    """
+
+    def __init__(self, message: str, status: int = 429) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+class Session:
+    """
+    A chat session with its state, and the lock serializing its messages.
+    """
+
+    def __init__(self, session_id: str, state: ChatState) -> None:
+        self.id = session_id
+        self.state = state
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.questions = 0
+
+
+class SessionManager:
+    """
+    Keeps the chat sessions of the server, sharing the loaded tables of a base state.
+
+    Sessions are limited in number and in questions, answer one message at a time, and are
+    evicted after being idle for `idle_seconds`. Request latencies of the most recent
+    `latency_window` messages are kept for percentile reporting.
+    """
+
+    def __init__(
+        self,
+        model: LLM,
+        querier: Querier,
+        loads: List[List[str]] | None = None,
+        max_sessions: int = SERVER_MAX_SESSIONS,
+        idle_seconds: float = SERVER_SESSION_IDLE_SECONDS,
+        max_questions: int = SERVER_SESSION_MAX_QUESTIONS,
+        max_prompt_tokens: int = MAX_PROMPT_TOKENS,
+        latency_window: int = 10000,
+        example_store: ExampleStore | None = None,
+    ) -> None:
+        from sql_gpt.batch import load_tables
+        from sql_gpt.graph import Graph
+
+        self.base = ChatState(model=model, querier=querier, example_store=example_store)
+        load_tables(self.base, loads or [])
+        self.graph = Graph().graph
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.max_questions = max_questions
+        self.max_prompt_tokens = max_prompt_tokens
+        self.sessions: Dict[str, Session] = {}
+        self._lock = threading.Lock()
+        self.latencies: deque = deque(maxlen=latency_window)
+        self.requests = 0
+        self.rejected = 0
+        self.evicted = 0
+        self._stop = threading.Event()
+        threading.Thread(target=self.evict_loop, daemon=True).start()
+
+    def create(self) -> str:
+        """
+        Creates a session and returns its id, evicting idle sessions if the server is full.
+        """
+        with self._lock:
+            if len(self.sessions) >= self.max_sessions:
+                self._evict(time.monotonic() - self.idle_seconds)
+            if len(self.sessions) >= self.max_sessions:
+                self.rejected += 1
+                raise SessionLimitError(
+                    f"The server is at its limit of {self.max_sessions} sessions.", 503
+                )
+            session_id = uuid.uuid4().hex
+            self.sessions[session_id] = Session(
+                session_id,
+                ChatState(
+                    model=self.base.model,
+                    querier=self.base.querier,
+                    table_schemas=self.base.table_schemas,
+                    schema_index=self.base.schema_index,
+                    loaded_tables=self.base.loaded_tables,
+                    example_store=self.base.example_store,
+                    prompt_builder=self.base.prompt_builder,
+                    context_manager=ContextManager(max_tokens=self.max_prompt_tokens),
+                ),
+            )
+        return session_id
+
+    def close(self, session_id: str) -> None:
+        with self._lock:
+            del self.sessions[session_id]
+
+    def send(self, session_id: str, message: str) -> Dict[str, Any]:
+        """
+        Answers a message within the session.
+        """
+        if message.strip().lower().startswith(SHARED_COMMANDS):
+            raise ValueError(
+                "Tables are shared by all sessions, and are only loaded and refreshed at "
+                "server start."
+            )
+        with self._lock:
+            session = self.sessions[session_id]
+        if not session.lock.acquire(blocking=False):
+            self.count_rejected()
+            raise SessionLimitError("The session is still answering its previous message.", 409)
+        try:
+            if session.questions >= self.max_questions:
+                self.count_rejected()
+                raise SessionLimitError(
+                    f"The session reached its limit of {self.max_questions} questions."
+                )
+            session.questions += 1
+            stime = time.perf_counter()
+            session.state.inputs = [message]
+            final_state = self.graph.invoke(
+                session.state, config={"recursion_limit": MAX_AGENT_RECURSION_LIMIT}
+            )
+            session.state = ChatState(**final_state)
+            seconds = time.perf_counter() - stime
+        finally:
+            session.last_used = time.monotonic()
+            session.lock.release()
+
+        with self._lock:
+            self.requests += 1
+            self.latencies.append(seconds)
+        sql_event = session.state.sql_event
+        return {
+            "session": session_id,
+            "answer": session.state.messages[-1].content,
+            "sql": sql_event.sql_text,
+            "retries": sql_event.retry_count,
+            "error": sql_event.error,
+            "seconds": seconds,
+        }
+
+    def count_rejected(self) -> None:
+        with self._lock:
+            self.rejected += 1
+
+    def _evict(self, cutoff: float) -> int:
+        """
+        Drops sessions idle since before the cutoff, holding the manager lock.
+        """
+        idle = [
+            session_id
+            for session_id, session in self.sessions.items()
+            if session.last_used < cutoff and not session.lock.locked()
+        ]
+        for session_id in idle:
+            del self.sessions[session_id]
+        self.evicted += len(idle)
+        return len(idle)
+
+    def evict_loop(self) -> None:
+        """
+        Periodically evicts idle sessions until the manager is stopped.
+        """
+        while not self._stop.wait(min(self.idle_seconds / 2, 30.0)):
+            with self._lock:
+                evicted = self._evict(time.monotonic() - self.idle_seconds)
+            if evicted:
+                logger.debug(f"Evicted {evicted} idle sessions.")
+
+    def stop(self) -> None:
+        """
+        Stops evicting idle sessions, and the background work of the shared querier.
+        """
+        self._stop.set()
+        self.base.querier.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {
+                "sessions": len(self.sessions),
+                "requests": self.requests,
+                "rejected": self.rejected,
+                "evicted": self.evicted,
+                "latency_seconds": summarize(list(self.latencies)),
+            }
+        cursors = getattr(self.base.querier, "cursors", None)
+        if cursors is not None:
+            stats["cursor_pool"] = cursors.stats()
+        rollups = getattr(self.base.querier, "rollups", None)
+        if rollups is not None:
+            stats["rollups"] = rollups.stats()
+        return stats
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    Routes the JSON requests of the server to its session manager.
+    """
+
+    server: "SqlGptServer"
+
+    def do_GET(self) -> None:
+        self.handle_request("GET")
+
+    def do_POST(self) -> None:
+        self.handle_request("POST")
+
+    def do_DELETE(self) -> None:
+        self.handle_request("DELETE")
+
+    def handle_request(self, method: str) -> None:
+        manager = self.server.manager
+        parts = [part for part in self.path.split("?")[0].split("/") if part]
+        try:
+            if method == "GET" and parts == ["stats"]:
+                self.reply(200, manager.stats())
+            elif method == "POST" and parts == ["sessions"]:
+                self.reply(201, {"session": manager.create()})
+            elif method == "POST" and len(parts) == 3 and parts[::2] == ["sessions", "messages"]:
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if not isinstance(body.get("message"), str) or not body["message"].strip():
+                    raise ValueError('Expected a JSON body with a "message".')
+                self.reply(200, manager.send(parts[1], body["message"]))
+            elif method == "DELETE" and len(parts) == 2 and parts[0] == "sessions":
+                manager.close(parts[1])
+                self.reply(200, {"session": parts[1]})
+            else:
+                self.reply(404, {"error": f"Unknown endpoint {method} {self.path}."})
+        except KeyError:
+            self.reply(404, {"error": "Unknown session."})
+        except SessionLimitError as e:
+            self.reply(e.status, {"error": str(e)})
+        except ValueError as e:
+            self.reply(400, {"error": str(e)})
+        except Exception as e:
+            logger.exception(f"Request {method} {self.path} failed.")
+            self.reply(500, {"error": str(e)})
+
+    def reply(self, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+class SqlGptServer(ThreadingHTTPServer):
+    """
+    HTTP server answering every request in its own thread.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, manager: SessionManager) -> None:
+        super().__init__(address, RequestHandler)
+        self.manager = manager
+
+
+def request(url: str, method: str = "GET", payload: Dict[str, Any] | None = None) -> dict:
+    """
+    Sends a JSON request to the server and returns the decoded response.
+    """
+    data = json.dumps(payload).encode() if payload is not None else None
+    req = urllib.request.Request(
+        url, data=data, method=method, headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(req) as response:
+        return json.loads(response.read())
+
+
+def load_test(url: str, questions: List[str], sessions: int, rounds: int = 1) -> dict:
+    """
+    Runs concurrent client sessions against the server, each asking all questions `rounds`
+    times, and reports client side throughput and latency percentiles.
+    """
+    latencies: List[float] = []
+    errors: List[str] = []
+    lock = threading.Lock()
+
+    def client(_: int) -> None:
+        try:
+            session_id = request(f"{url}/sessions", "POST")["session"]
+            for _ in range(rounds):
+                for question in questions:
+                    stime = time.perf_counter()
+                    request(f"{url}/sessions/{session_id}/messages", "POST", {"message": question})
+                    with lock:
+                        latencies.append(time.perf_counter() - stime)
+            request(f"{url}/sessions/{session_id}", "DELETE")
+        except Exception as e:
+            with lock:
+                errors.append(str(e))
+
+    stime = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        list(pool.map(client, range(sessions)))
+    total_seconds = time.perf_counter() - stime
+    return {
+        "sessions": sessions,
+        "requests": len(latencies),
+        "errors": errors,
+        "total_seconds": total_seconds,
+        "requests_per_second": len(latencies) / total_seconds if total_seconds else 0.0,
+        "latency_seconds": summarize(latencies),
+    }
+
+
+def serve(manager: SessionManager, host: str = "127.0.0.1", port: int = 8080) -> None:
+    """
+    Serves the sessions of the manager until interrupted.
+    """
+    server = SqlGptServer((host, port), manager)
+    logger.info(f"SQL GPT server listening on http://{host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        manager.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SQL GPT server load test")
+    parser.add_argument(
+        "--script",
+        type=str,
+        required=True,
+        help="JSONL file of scripted questions, SQL queries and answers",
+    )
+    parser.add_argument("--data", type=str, required=True, help="data file, directory or glob")
+    parser.add_argument("--schema", type=str, help="table column description file")
+    parser.add_argument("--sessions", type=int, default=16, help="number of client sessions")
+    parser.add_argument(
+        "--rounds", type=int, default=1, help="times every session asks all questions"
+    )
+    parser.add_argument(
+        "--llm-delay", type=float, default=0.0, help="simulated latency of each LLM call"
+    )
+    parser.add_argument(
+        "--executor-kwargs",
+        type=str,
+        help="json string of executor parameters (e.g., '{\"max_cursors\": 4}')",
+    )
+    parser.add_argument(
+        "--server-kwargs",
+        type=str,
+        help="json string of server parameters (e.g., '{\"max_sessions\": 64}')",
+    )
+    args = parser.parse_args()
+
+    from sql_gpt.llm import ScriptedLLM
+
+    llm = ScriptedLLM(args.script, delay_seconds=args.llm_delay)
+    manager = SessionManager(
+        llm,
+        Querier.get("duckdb", json.loads(args.executor_kwargs or "{}")),
+        [[args.data, *([args.schema] if args.schema else [])]],
+        **json.loads(args.server_kwargs or "{}"),
+    )
+    server = SqlGptServer(("127.0.0.1", 0), manager)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        report = {
+            "client": load_test(
+                url,
+                [record["question"] for record in llm.responses.values()],
+                args.sessions,
+                args.rounds,
+            ),
+            "server": request(f"{url}/stats"),
+        }
+    finally:
+        server.shutdown()
+        manager.stop()
+    print(json.dumps(report, indent=2))
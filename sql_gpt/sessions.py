@@ -0,0 +1,186 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Tuple
+
+from langchain_core.messages import BaseMessage, messages_from_dict, messages_to_dict
+from pydantic import BaseModel, ConfigDict
+
+from sql_gpt.constants import CACHE_DIR
+from sql_gpt.examples import LoadedTable
+
+
+class SavedSession(BaseModel):
+    """
+    A chat session as checkpointed in the session store.
+
+    Attributes:
+        session_id (str): Identifier of the session.
+        messages (List[BaseMessage]): Conversation history.
+        tables (Dict[str, LoadedTable]): Load descriptors of the session tables, by name.
+        question_retries (List[int]): Number of SQL retries of every question.
+    """
+
+    session_id: str
+    messages: List[BaseMessage]
+    tables: Dict[str, LoadedTable]
+    question_retries: List[int]
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+
+class SessionStore:
+    """
+    SQLite backed store of chat sessions, checkpointed incrementally.
+
+    Every checkpoint appends only the messages and SQL events added since the previous one,
+    and the load descriptors of new or changed tables, so its cost does not grow with the
+    session. Tables are restored by name from their descriptors, reusing them as is when the
+    database still holds them with the same columns.
+    """
+
+    def __init__(self, path: str = os.path.join(CACHE_DIR, "sessions.sqlite")) -> None:
+        path = os.path.expanduser(path)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, created REAL, updated REAL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "session TEXT, position INTEGER, message TEXT, PRIMARY KEY (session, position))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sql_events ("
+            "session TEXT, position INTEGER, event TEXT, PRIMARY KEY (session, position))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tables ("
+            "session TEXT, name TEXT, descriptor TEXT, PRIMARY KEY (session, name))"
+        )
+        self._conn.commit()
+        # session -> (saved messages, saved SQL events, saved table descriptors)
+        self._saved: Dict[str, Tuple[int, int, Dict[str, LoadedTable]]] = {}
+
+    def create(self) -> str:
+        """
+        Returns the identifier of a new session, which is recorded at its first checkpoint.
+        """
+        session_id = uuid.uuid4().hex[:8]
+        with self._lock:
+            self._saved[session_id] = (0, 0, {})
+        return session_id
+
+    def checkpoint(self, state) -> None:
+        """
+        Appends what the session state gained since its last checkpoint. Sessions without
+        tables or questions are not recorded, such as sessions that only resume another one.
+        """
+        if not state.loaded_tables and not any(
+            message.type == "human" for message in state.messages
+        ):
+            return
+        session_id = state.session_id
+        with self._lock:
+            messages, events, tables = self._saved.get(session_id) or self._counts(session_id)
+            if len(state.messages) > messages:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO messages VALUES (?, ?, ?)",
+                    [
+                        (session_id, position, json.dumps(messages_to_dict([message])[0]))
+                        for position, message in enumerate(
+                            state.messages[messages:], start=messages
+                        )
+                    ],
+                )
+            if len(state.question_retries) > events:
+                # the SQL event of the question answered since the last checkpoint
+                event = state.sql_event.model_dump_json(
+                    exclude={"sql_result", "selected_schemas", "examples"}
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sql_events VALUES (?, ?, ?)",
+                    (session_id, len(state.question_retries) - 1, event),
+                )
+            changed = {
+                name: table
+                for name, table in state.loaded_tables.items()
+                if tables.get(name) != table
+            }
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO tables VALUES (?, ?, ?)",
+                [(session_id, name, table.model_dump_json()) for name, table in changed.items()],
+            )
+            self._conn.execute(
+                "INSERT INTO sessions VALUES (?, ?, ?) ON CONFLICT (id) DO UPDATE SET updated = ?",
+                (session_id, time.time(), time.time(), time.time()),
+            )
+            self._conn.commit()
+            self._saved[session_id] = (
+                len(state.messages),
+                len(state.question_retries),
+                {**tables, **changed},
+            )
+
+    def _counts(self, session_id: str) -> Tuple[int, int, Dict[str, LoadedTable]]:
+        messages = self._conn.execute(
+            "SELECT count(*) FROM messages WHERE session = ?", (session_id,)
+        ).fetchone()[0]
+        events = self._conn.execute(
+            "SELECT count(*) FROM sql_events WHERE session = ?", (session_id,)
+        ).fetchone()[0]
+        return messages, events, self._tables(session_id)
+
+    def _tables(self, session_id: str) -> Dict[str, LoadedTable]:
+        rows = self._conn.execute(
+            "SELECT name, descriptor FROM tables WHERE session = ? ORDER BY rowid", (session_id,)
+        )
+        return {name: LoadedTable.model_validate_json(descriptor) for name, descriptor in rows}
+
+    def load(self, session_id: str) -> SavedSession | None:
+        """
+        Reads a checkpointed session, or returns None if it is unknown.
+        """
+        with self._lock:
+            if not self._conn.execute(
+                "SELECT 1 FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone():
+                return None
+            messages = messages_from_dict(
+                [
+                    json.loads(message)
+                    for (message,) in self._conn.execute(
+                        "SELECT message FROM messages WHERE session = ? ORDER BY position",
+                        (session_id,),
+                    )
+                ]
+            )
+            question_retries = [
+                json.loads(event)["retry_count"]
+                for (event,) in self._conn.execute(
+                    "SELECT event FROM sql_events WHERE session = ? ORDER BY position",
+                    (session_id,),
+                )
+            ]
+            tables = self._tables(session_id)
+            self._saved[session_id] = (len(messages), len(question_retries), dict(tables))
+        return SavedSession(
+            session_id=session_id,
+            messages=messages,
+            tables=tables,
+            question_retries=question_retries,
+        )
+
+    def list(self, limit: int = 10) -> List[str]:
+        """
+        Returns the most recently updated sessions.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM sessions ORDER BY updated DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [session_id for (session_id,) in rows]
@@ -0,0 +1,153 @@
+import re
+from typing import Dict, List, Set
+
+TOKEN_PATTERN = re.compile(
+    r"""
+    (?P<comment>--[^\n]*|/\*.*?\*/)
+    |(?P<string>'(?:[^']|'')*')
+    |(?P<quoted>"(?:[^"]|"")*")
+    |(?P<number>(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?)
+    |(?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+    |(?P<space>\s+)
+    |(?P<symbol><>|!=|<=|>=|::|\|\||->>|->|.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+READ_ONLY_KEYWORDS = {
+    "SELECT",
+    "WITH",
+    "FROM",
+    "VALUES",
+    "TABLE",
+    "DESCRIBE",
+    "SUMMARIZE",
+    "SHOW",
+}
+VOLATILE_FUNCTIONS = {
+    "RANDOM",
+    "SETSEED",
+    "UUID",
+    "GEN_RANDOM_UUID",
+    "NOW",
+    "TODAY",
+    "CURRENT_DATE",
+    "CURRENT_TIME",
+    "CURRENT_TIMESTAMP",
+    "GET_CURRENT_TIME",
+    "GET_CURRENT_TIMESTAMP",
+    "NEXTVAL",
+}
+
+
+def tokenize(sql_text: str) -> List[str]:
+    """
+    Splits the SQL text into tokens, dropping comments and whitespace.
+    """
+    return [
+        match.group()
+        for match in TOKEN_PATTERN.finditer(sql_text)
+        if match.lastgroup not in ("comment", "space")
+    ]
+
+
+def _normalize_number(token: str) -> str:
+    """
+    Normalizes the spelling of a numeric literal without changing its type.
+    """
+    if re.fullmatch(r"\d+", token):
+        return str(int(token))
+    mantissa, _, exponent = token.lower().partition("e")
+    whole, _, fraction = mantissa.partition(".")
+    mantissa = f"{int(whole or '0')}.{fraction.rstrip('0') or '0'}"
+    return f"{mantissa}e{int(exponent)}" if exponent else mantissa
+
+
+def canonicalize(sql_text: str) -> str:
+    """
+    Returns a canonical form of the SQL text, insensitive to whitespace, comments, keyword and
+    identifier case, numeric literal spelling and trailing semicolons.
+    String literals and quoted identifiers are kept verbatim.
+    """
+    tokens = []
+    for token in tokenize(sql_text):
+        if token[0] in "'\"":
+            tokens.append(token)
+        elif token[0].isdigit() or (token[0] == "." and len(token) > 1):
+            tokens.append(_normalize_number(token))
+        else:
+            tokens.append(token.upper())
+    while tokens and tokens[-1] == ";":
+        tokens.pop()
+    return " ".join(tokens)
+
+
+def identifiers(sql_text: str) -> Set[str]:
+    """
+    Returns the lower cased identifiers and keywords referenced by the SQL text.
+    """
+    return {
+        token.strip('"').lower()
+        for token in tokenize(sql_text)
+        if token[0].isalpha() or token[0] in '_"'
+    }
+
+
+def is_read_only(sql_text: str) -> bool:
+    """
+    Returns whether the SQL text is a single read only query.
+    """
+    tokens = canonicalize(sql_text).split(" ")
+    return tokens[0] in READ_ONLY_KEYWORDS and ";" not in tokens
+
+
+def is_deterministic(sql_text: str) -> bool:
+    """
+    Returns whether the SQL text is free of volatile functions.
+    """
+    return not any(token.upper() in VOLATILE_FUNCTIONS for token in tokenize(sql_text))
+
+
+def has_limit(sql_text: str) -> bool:
+    """
+    Returns whether the outermost query of the SQL text has a LIMIT clause.
+    """
+    depth = 0
+    for token in tokenize(sql_text):
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth == 0 and token.upper() == "LIMIT":
+            return True
+    return False
+
+
+def statement_end(sql_text: str) -> int | None:
+    """
+    Returns the end position of the first statement terminated by a semicolon, or None while
+    no statement is complete. Unterminated literals, quoted identifiers and block comments keep
+    the statement open.
+    """
+    for match in TOKEN_PATTERN.finditer(sql_text):
+        token = match.group()
+        if token in ("'", '"') or (token == "/" and sql_text.startswith("/*", match.start())):
+            return None
+        if token == ";":
+            return match.end()
+    return None
+
+
+def rename_identifiers(sql_text: str, mapping: Dict[str, str]) -> str:
+    """
+    Replaces unquoted identifiers by their lower cased name in the mapping, keeping literals,
+    comments and formatting intact.
+    """
+    return TOKEN_PATTERN.sub(
+        lambda match: (
+            mapping.get(match.group().lower(), match.group())
+            if match.lastgroup == "word"
+            else match.group()
+        ),
+        sql_text,
+    )
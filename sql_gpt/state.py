@@ -1,11 +1,17 @@
-from typing import List
+from typing import Dict, List
 
 from langchain_core.messages import BaseMessage, SystemMessage
 from pydantic import BaseModel, ConfigDict, Field
 
-from sql_gpt.constants import MAX_ROW_LIMIT_SQL_QUERY
+from sql_gpt.constants import LOAD_USAGE
+from sql_gpt.context import ContextManager, PromptStats
+from sql_gpt.examples import ExampleStore, LoadedTable
 from sql_gpt.llm import LLM
-from sql_gpt.querier import Querier
+from sql_gpt.logging import logger
+from sql_gpt.prompts import PromptBuilder
+from sql_gpt.querier import Querier, QueryResult
+from sql_gpt.retrieval import SchemaIndex
+from sql_gpt.sessions import SessionStore
 
 
 class SqlEvent(BaseModel):
@@ -14,19 +20,51 @@ class SqlEvent(BaseModel):
 
     Attributes:
         user_question (str): User's natural language question.
+        original_question (str): Question that started the exchange, when the user question
+            replies to a clarification question.
+        clarifying (bool): Whether a clarification question about the question was asked.
         sql_text (str): Generated SQL query text.
-        sql_result (List[tuple]): Query result.
+        sql_result (QueryResult): Columnar query result, flagged if truncated.
         ai_response (str): Human-friendly AI response generated from the SQL result.
         error (str): Error message (if any) from SQL execution.
         retry_count (int): Number of retries attempted.
+        selected_schemas (str): Schemas of the tables and columns relevant to the question.
+        full_schema (bool): Whether to fall back to the full table schemas.
+        examples (str): Verified examples of questions and SQL queries similar to the question.
     """
 
     user_question: str | None = Field(None)
+    original_question: str | None = Field(None)
+    clarifying: bool = False
     sql_text: str | None = Field(None)
-    sql_result: List[tuple] | None = Field(None)
+    sql_result: QueryResult | None = Field(None)
     ai_response: str | None = Field(None)
     error: str | None = Field(None)
     retry_count: int = 0
+    selected_schemas: str | None = Field(None)
+    full_schema: bool = False
+    examples: str | None = Field(None)
+
+
+class Candidate(BaseModel):
+    """
+    Outcome of validating and executing one of several speculative SQL candidates.
+
+    Attributes:
+        index (int): Position of the candidate among the generated candidates.
+        sql_text (str): Candidate SQL query text.
+        sql_result (QueryResult): Query result, if the candidate succeeded.
+        error (str): Validation or execution error, if the candidate failed.
+        schema_error (bool): Whether the candidate referenced an unknown table or column.
+        seconds (float): Time taken to validate and execute the candidate.
+    """
+
+    index: int
+    sql_text: str
+    sql_result: QueryResult | None = Field(None)
+    error: str | None = Field(None)
+    schema_error: bool = False
+    seconds: float = 0.0
 
 
 class DataLoadEvent(BaseModel):
@@ -36,10 +74,12 @@ class DataLoadEvent(BaseModel):
     Attributes:
         table_name (str): Name of the table to be loaded. If file based table, it is the file name.
         table_columns_description (str): Path to the metadata file.
+        union (bool): Whether to load all files of a glob pattern into a single table.
     """
 
     table_name: str | None = Field(None)
     table_columns_description: str | None = Field(None)
+    union: bool = False
 
 
 class ChatState(BaseModel):
@@ -51,7 +91,27 @@ class ChatState(BaseModel):
         sql_event (SqlEvent): Last SQL event.
         data_load_event (DataLoadEvent): Data loader details (if a table is being loaded).
         table_schemas (str): Table schemas and metadata.
+        schema_index (SchemaIndex): Relevance index over the table schemas.
+        loaded_tables (Dict[str, LoadedTable]): Source and schema fingerprint of every table.
+        example_store (ExampleStore): Store of verified few-shot examples, if enabled.
+        session_store (SessionStore): Store the session is checkpointed to, if enabled.
+        session_id (str): Identifier of the session in the session store.
+        resume_session_id (str): Identifier of the saved session to resume, if requested.
+        tables_to_refresh (List[str]): Tables to refresh from their files, all if empty.
+        auto_refresh (bool): Whether to refresh the tables whose files changed before every
+            question.
         next_step (str): Next step in the LangGraph.
+        context_manager (ContextManager): Compacts the history under a token budget.
+        prompt_builder (PromptBuilder): Lays out prompts so that their prefixes can be cached.
+        prompt_stats (PromptStats): Prompt size and prefix cache statistics of the last prompt.
+        question_retries (List[int]): Number of SQL retries of every answered or abandoned
+            question.
+        inputs (List[str]): Scripted user inputs replacing the interactive prompt, if set.
+        last_message_shown (bool): Whether the last message was already streamed to the user.
+        candidates (int): Number of SQL candidates generated at once and tried in parallel,
+            1 to generate and retry one query at a time.
+        consensus (bool): Whether to pick the candidate whose result most candidates agree
+            on, instead of the first candidate to succeed.
     """
 
     model: LLM
@@ -60,8 +120,7 @@ class ChatState(BaseModel):
         SystemMessage(
             content="Welcome to SQL GPT. This tool allows you to ask questions from your data, "
             "by querying the data for you.\n"
-            "Please load your data first using the command /load <table_name> "
-            "<table_columns_description>.\n"
+            f"Please load your data first using the command {LOAD_USAGE}.\n"
             "After loading your data, you can ask me questions about your data, and I will query "
             "your data for you for insights.\n"
             "You can quit the program by typing /q."
@@ -70,39 +129,78 @@ class ChatState(BaseModel):
     sql_event: SqlEvent = SqlEvent()
     data_load_event: DataLoadEvent = DataLoadEvent()
     table_schemas: str = ""
+    schema_index: SchemaIndex = Field(default_factory=SchemaIndex)
+    loaded_tables: Dict[str, LoadedTable] = Field(default_factory=dict)
+    example_store: ExampleStore | None = Field(None)
+    session_store: SessionStore | None = Field(None)
+    session_id: str | None = Field(None)
+    resume_session_id: str | None = Field(None)
+    tables_to_refresh: List[str] = Field(default_factory=list)
+    auto_refresh: bool = False
     next_step: str = "prompter"
+    context_manager: ContextManager = Field(default_factory=ContextManager)
+    prompt_builder: PromptBuilder = Field(default_factory=PromptBuilder)
+    prompt_stats: PromptStats | None = Field(None)
+    question_retries: List[int] = Field(default_factory=list)
+    inputs: List[str] | None = Field(None)
+    last_message_shown: bool = False
+    candidates: int = 1
+    consensus: bool = False
 
     model_config = ConfigDict(arbitrary_types_allowed=True)
 
     @property
-    def system_message(self):
-        """Define the system message with table schemas."""
-        return SystemMessage(
-            content=(
-                "You are an intelligent assistant that converts natural language questions "
-                "into correct DuckDB SQL queries.\n"
-                "Your goal is to generate a SQL query by considering the user's intent, "
-                "previous interactions, and the table schemas.\n\n"
-                "Return format:\n"
-                "1. If the intent is clear, generate a complete DuckDB SQL query that satisfies "
-                "the request. Return only the SQL query text without any extra commentary. Limit "
-                f"query response to {MAX_ROW_LIMIT_SQL_QUERY} rows at most.\n"
-                "2. If the intent is ambiguous, ask a follow-up clarification question that "
-                "requests additional details. Prefix your clarification question with "
-                '"[CLARIFICATION]" as output.\n\n'
-                "Instructions:\n"
-                "1. Consider the user's intent based on the current question.\n"
-                "2. If any previous SQL query resulted in an error, incorporate the error "
-                "message and generate a corrected query.\n"
-                "3. If previous user questions or clarifications are relevant, include them "
-                "in your analysis.\n\n"
-                "Table schemas: " + self.table_schemas
-            )
+    def system_message(self) -> SystemMessage:
+        """Define the system message with table schemas, followed by the examples."""
+        return self.prompt_builder.system_message(
+            "query", self.prompt_schemas, self.prompt_examples
+        )
+
+    @property
+    def prompt_examples(self) -> str:
+        """The verified examples similar to the current question, if any."""
+        return self.sql_event.examples
+
+    @property
+    def prompt_schemas(self) -> str:
+        """The schemas relevant to the current question, or all schemas as fallback."""
+        if self.sql_event.full_schema or not self.sql_event.selected_schemas:
+            return self.table_schemas
+        return self.sql_event.selected_schemas
+
+    def select_schemas(self, question: str) -> None:
+        """Select the schemas relevant to the question and recent user messages."""
+        recent = [message.content for message in self.messages if message.type == "human"][-2:]
+        self.sql_event.selected_schemas = self.schema_index.select(" ".join([*recent, question]))
+
+    def select_examples(self, question: str) -> None:
+        """Select the verified examples most similar to the question."""
+        if self.example_store is None:
+            return
+        examples = self.example_store.search(question, self.loaded_tables)
+        self.sql_event.examples = "\n\n".join(
+            f"Question: {example_question}\nSQL: {sql_text}"
+            for example_question, sql_text in examples
+        )
+
+    def record_retries(self) -> None:
+        """Record the number of retries the current question took."""
+        self.question_retries.append(self.sql_event.retry_count)
+        logger.debug(
+            f"Question took {self.sql_event.retry_count} retries, "
+            f"{sum(self.question_retries) / len(self.question_retries):.2f} on average."
         )
 
     def get_history(self):
-        """Return history formatted for OpenAI"""
-        return [self.system_message] + self.messages
+        """Return history formatted for OpenAI, compacted under the prompt token budget"""
+        prompt, self.prompt_stats = self.prompt_builder.build(
+            "query",
+            self.prompt_schemas,
+            self.messages,
+            self.prompt_examples,
+            self.context_manager,
+        )
+        return prompt
 
     def update_history(self, new_message):
         """Append new messages to history"""
@@ -0,0 +1,211 @@
+import contextvars
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+
+class Span:
+    """
+    A timed operation with attributes, nested under the span that was active when it started.
+    """
+
+    recording = True
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, **attributes: Any) -> None:
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.start = time.time()
+        self.duration = 0.0
+        self.attributes: Dict[str, Any] = attributes
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration": self.duration,
+            "attributes": self.attributes,
+        }
+
+
+class NoopSpan:
+    """
+    Span returned while tracing is disabled, ignoring all attributes.
+    """
+
+    recording = False
+
+    def set(self, **attributes: Any) -> None:
+        pass
+
+
+class JsonlExporter:
+    """
+    Appends every finished span as a JSON line to a trace file.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._lock = threading.Lock()
+        self._file = open(path, "a", buffering=1)
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.as_dict(), default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+
+class PrometheusExporter:
+    """
+    Aggregates finished spans into metrics, and writes them in the Prometheus text format.
+
+    Every span name gets a duration summary, and every numeric span attribute a counter named
+    after the span and the attribute. The file is rewritten when a top level span finishes.
+    """
+
+    def __init__(self, path: str, prefix: str = "sql_gpt") -> None:
+        self.path = path
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.durations: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0])
+        self.counters: Dict[str, float] = defaultdict(float)
+
+    def export(self, span: Span) -> None:
+        with self._lock:
+            duration = self.durations[span.name]
+            duration[0] += 1
+            duration[1] += span.duration
+            for key, value in span.attributes.items():
+                if isinstance(value, (int, float)):
+                    self.counters[self.metric_name(f"{span.name}_{key}_total")] += value
+        if span.parent_id is None:
+            self.write()
+
+    def metric_name(self, name: str) -> str:
+        return re.sub(r"[^a-zA-Z0-9_]", "_", f"{self.prefix}_{name}")
+
+    def render(self) -> str:
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        seconds = self.metric_name("span_duration_seconds")
+        lines = [f"# TYPE {seconds} summary"]
+        with self._lock:
+            for name, (count, total) in sorted(self.durations.items()):
+                lines.append(f'{seconds}_count{{span="{name}"}} {count}')
+                lines.append(f'{seconds}_sum{{span="{name}"}} {total}')
+            for name, value in sorted(self.counters.items()):
+                lines += [f"# TYPE {name} counter", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def write(self) -> None:
+        partial = f"{self.path}.tmp"
+        with open(partial, "w") as fp:
+            fp.write(self.render())
+        os.replace(partial, self.path)
+
+
+class StartupProfile:
+    """
+    Times the startup phases of the CLI, from its first line to the first prompt.
+    """
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Adds the time spent in the enclosed block to the phase.
+        """
+        stime = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - stime
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Returns the startup time so far, its breakdown by phase and the number of modules
+        imported.
+        """
+        total = time.perf_counter() - self.start
+        return {
+            "startup_seconds": total,
+            "phases": {
+                **self.phases,
+                "other": max(total - sum(self.phases.values()), 0.0),
+            },
+            "modules": len(sys.modules),
+        }
+
+    def write(self, path: str) -> None:
+        """
+        Writes the report as JSON to the file, or to stderr if the path is "-".
+        """
+        report = json.dumps(self.report(), indent=2)
+        if path == "-":
+            print(report, file=sys.stderr)
+            return
+        with open(path, "w") as fp:
+            fp.write(report)
+
+
+class Tracer:
+    """
+    Creates nested spans and hands finished spans to exporters and listeners.
+    Tracing is disabled, and costs a single check per span, until an exporter or listener
+    is added.
+    """
+
+    def __init__(self) -> None:
+        self.exporters: List[Any] = []
+        self.listeners: List[Callable[[Span], None]] = []
+        self._current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+            "current_span", default=None
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.exporters or self.listeners)
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Any]:
+        """
+        Times the enclosed block as a span nested under the currently active span.
+        """
+        if not self.enabled:
+            yield NoopSpan()
+            return
+        span = Span(name, self._current.get(), **attributes)
+        token = self._current.set(span)
+        stime = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.set(error=type(e).__name__)
+            raise
+        finally:
+            span.duration = time.perf_counter() - stime
+            self._current.reset(token)
+            for exporter in self.exporters:
+                exporter.export(span)
+            for listener in self.listeners:
+                listener(span)
+
+
+tracer = Tracer()
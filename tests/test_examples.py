@@ -0,0 +1,67 @@
+import pytest
+from langchain_core.messages import AIMessage
+
+from sql_gpt.agents import parse_query_response, prompter, record_answer
+from sql_gpt.examples import ExampleStore, LoadedTable
+from sql_gpt.llm import ScriptedLLM
+from sql_gpt.state import ChatState
+
+pytest.importorskip("duckdb")
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ExampleStore(path=str(tmp_path / "examples.sqlite"))
+
+
+def test_tables_of_the_same_schema_keep_their_source(store):
+    tables = {
+        "sales_2023": LoadedTable(path="sales_2023.csv", schema_fingerprint="abc"),
+        "sales_2024": LoadedTable(path="sales_2024.csv", schema_fingerprint="abc"),
+    }
+    sql_text = "SELECT * FROM sales_2024 EXCEPT SELECT * FROM sales_2023"
+    store.add("Which sales are new in 2024?", sql_text, tables)
+    resumed = {
+        "df1": LoadedTable(path="sales_2024.csv", schema_fingerprint="abc"),
+        "df2": LoadedTable(path="sales_2023.csv", schema_fingerprint="abc"),
+    }
+    assert store.search("new sales in 2024", resumed) == [
+        ("which sales are new in 2024", "SELECT * FROM df1 EXCEPT SELECT * FROM df2")
+    ]
+
+
+def test_tables_map_by_schema_when_their_path_differs(store):
+    tables = {"sales": LoadedTable(path="sales.csv", schema_fingerprint="abc")}
+    store.add("Total sales?", "SELECT sum(x) FROM sales", tables)
+    moved = {"df1": LoadedTable(path="data/sales.csv", schema_fingerprint="abc")}
+    assert store.search("total sales", moved) == [("total sales", "SELECT sum(x) FROM df1")]
+    ambiguous = {
+        "df1": LoadedTable(path="a.csv", schema_fingerprint="abc"),
+        "df2": LoadedTable(path="b.csv", schema_fingerprint="abc"),
+    }
+    assert store.search("total sales", ambiguous) == []
+
+
+def test_example_keeps_the_question_a_clarification_replies_to(store):
+    from sql_gpt.querier import DuckdbQuerier
+
+    querier = DuckdbQuerier()
+    querier.db_conn.execute("CREATE TABLE sales AS SELECT 2024 AS year, 1 AS x")
+    state = ChatState(
+        model=ScriptedLLM([]),
+        querier=querier,
+        table_schemas="sales(year, x)",
+        loaded_tables={"sales": LoadedTable(path="sales.csv", schema_fingerprint="abc")},
+        example_store=store,
+        inputs=["What were the total sales?", "In 2024"],
+    )
+    prompter(state)
+    parse_query_response(state, AIMessage(content="[CLARIFICATION] Which year?"))
+    prompter(state)
+    sql_text = "SELECT sum(x) FROM sales WHERE year = 2024"
+    parse_query_response(state, AIMessage(content=sql_text))
+    state.sql_event.sql_result = querier.query(sql_text)
+    record_answer(state, "1")
+    assert store.search("total sales", state.loaded_tables) == [
+        ("what were the total sales", sql_text)
+    ]
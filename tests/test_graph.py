@@ -0,0 +1,14 @@
+import pytest
+
+pytest.importorskip("langgraph")
+
+from sql_gpt.graph import Graph, compile_graph  # noqa: E402
+
+
+def test_graph_is_compiled_once_per_kind():
+    graph = compile_graph()
+    assert compile_graph(asynchronous=False) is graph
+    assert compile_graph(False) is graph
+    assert Graph().graph is graph
+    assert Graph(asynchronous=True).graph is compile_graph(True)
+    assert compile_graph(True) is not graph
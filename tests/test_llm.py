@@ -0,0 +1,76 @@
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from sql_gpt.cache import fingerprint
+from sql_gpt.llm import LLM, CachedLLM
+
+
+class ChunkedLLM(LLM):
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.calls = 0
+
+    def invoke(self, prompt):
+        self.calls += 1
+        return AIMessage(content="".join(self.chunks))
+
+    def stream(self, prompt):
+        self.calls += 1
+        yield from self.chunks
+
+
+PROMPT = [SystemMessage(content="schemas"), HumanMessage(content="How many rows?")]
+
+
+def test_closed_stream_is_not_cached():
+    llm = CachedLLM(ChunkedLLM(["SELECT ", "count(*) ", "FROM df1"]), path=None)
+    stream = llm.stream(PROMPT)
+    next(stream)
+    stream.close()
+    assert llm.lookup(PROMPT)[1] is None
+
+
+def test_stream_read_to_the_end_is_cached():
+    llm = CachedLLM(ChunkedLLM(["SELECT ", "count(*) ", "FROM df1"]), path=None)
+    assert "".join(llm.stream(PROMPT)) == "SELECT count(*) FROM df1"
+    assert "".join(llm.stream(PROMPT)) == "SELECT count(*) FROM df1"
+    assert llm.llm.calls == 1
+
+
+def test_stream_reported_complete_is_cached():
+    llm = CachedLLM(ChunkedLLM(["SELECT 1", "\nignored"]), path=None)
+    stream = llm.stream(PROMPT)
+    llm.on_stream_complete(PROMPT, next(stream))
+    stream.close()
+    assert llm.lookup(PROMPT)[1] == "SELECT 1"
+
+
+CLARIFICATION = AIMessage(content="Your question is ambiguous. Please provide details: Year?")
+
+
+def test_clarification_replies_are_keyed_with_their_question():
+    llm = CachedLLM(ChunkedLLM(["SELECT 1"]), path=None)
+    first = [*PROMPT, CLARIFICATION, HumanMessage("2024")]
+    other = [SystemMessage(content="schemas"), HumanMessage("Total sales?"), *first[2:]]
+    assert llm.cache_key(first) != llm.cache_key(other)
+
+
+def test_repeated_question_is_keyed_without_earlier_questions():
+    llm = CachedLLM(ChunkedLLM(["SELECT 1"]), path=None)
+    later = [
+        SystemMessage(content="schemas"),
+        HumanMessage("Total sales?"),
+        AIMessage(content="SELECT sum(x) FROM df1"),
+        AIMessage(content="The total is 3."),
+        HumanMessage("how many rows"),
+    ]
+    assert llm.cache_key(later) == llm.cache_key(PROMPT)
+    assert CachedLLM(llm.llm, path=None, history_turns=1).cache_key(later) != llm.cache_key(PROMPT)
+
+
+def test_responses_are_stored_under_the_namespace_of_their_lookup(tmp_path):
+    llm = CachedLLM(ChunkedLLM(["SELECT 1"]), path=str(tmp_path / "cache.sqlite"))
+    llm.on_schema_change("df1(x)")
+    key, _ = llm.lookup(PROMPT)
+    llm.on_schema_change("df2(y)")
+    llm.store(key, "SELECT 1")
+    assert llm.disk.discard_namespace(fingerprint("df1(x)")) == 1
@@ -0,0 +1,193 @@
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from sql_gpt.agents import try_candidates
+from sql_gpt.querier import (
+    CancelScope,
+    DuckdbQuerier,
+    QueryCancelledError,
+    QueryTimeoutError,
+    cancel_scope,
+)
+
+duckdb = pytest.importorskip("duckdb")
+
+
+@pytest.fixture
+def querier():
+    querier = DuckdbQuerier()
+    querier.db_conn.execute(
+        "CREATE TABLE df1 AS SELECT range AS x, range % 3 AS g FROM range(1000)"
+    )
+    querier.db_conn.execute("CREATE TABLE df2 AS SELECT range AS y FROM range(1000)")
+    return querier
+
+
+@pytest.mark.parametrize(
+    "sql_text",
+    [
+        "SELECT SUM(x) / (SELECT SUM(x) FROM df1) FROM df1",
+        "SELECT x, x / t.s FROM df1, (SELECT SUM(x) AS s FROM df1) t",
+        "SELECT g, SUM(x) / ANY_VALUE(t.s) FROM df1, (SELECT SUM(x) AS s FROM df1) t GROUP BY g",
+        "SELECT * FROM df1, df2 LIMIT 5",
+        "DESCRIBE df1",
+        "SUMMARIZE df1",
+        "SHOW TABLES",
+    ],
+)
+def test_validate_accepts(querier, sql_text):
+    assert querier.validate(sql_text).errors == []
+
+
+@pytest.mark.parametrize(
+    "sql_text, error",
+    [
+        ("SELECT * FROM df1, df2", "unbounded cross join"),
+        ("SELECT * FROM df1 a, df1 b, df1 c", "unbounded cross join"),
+        ("DELETE FROM df1", "read only"),
+        ("SELECT z FROM df1", "not found"),
+    ],
+)
+def test_validate_rejects(querier, sql_text, error):
+    errors = querier.validate(sql_text).errors
+    assert len(errors) == 1 and error in errors[0]
+
+
+def test_results_keep_duckdb_column_types(querier):
+    result = querier.query(
+        "SELECT x::INTEGER AS i, x::DOUBLE AS d, DATE '2024-01-01' AS day, "
+        "TIMESTAMP '2024-01-01 10:00' AS ts, g::VARCHAR AS s FROM df1 LIMIT 1"
+    )
+    assert result.types == ["INTEGER", "DOUBLE", "DATE", "TIMESTAMP", "VARCHAR"]
+
+
+def test_inspection_statements_run(querier):
+    assert querier.query("DESCRIBE df1").columns[0] == "column_name"
+    assert querier.query("SUMMARIZE df1").row_count == 2
+
+
+def write(path, text, mode="w"):
+    with open(path, mode) as fp:
+        fp.write(text)
+
+
+def test_refresh_appends_complete_lines(tmp_path):
+    path = str(tmp_path / "data.csv")
+    write(path, "a,b\n1,2\n")
+    querier = DuckdbQuerier()
+    name = querier.load_table(path)
+    write(path, "3,4\n5,", "a")
+    refresh = querier.refresh_table(name)
+    assert (refresh.appended_rows, refresh.rebuilt) == (1, False)
+    write(path, "6\n", "a")
+    assert querier.refresh_table(name).appended_rows == 1
+    assert querier.query(f"SELECT * FROM {name} ORDER BY a").rows() == [(1, 2), (3, 4), (5, 6)]
+
+
+def test_refresh_with_a_single_cursor(tmp_path):
+    path = str(tmp_path / "data.csv")
+    write(path, "a,b\n1,2\n")
+    querier = DuckdbQuerier(max_cursors=1)
+    name = querier.load_table(path)
+    write(path, "3,4\n", "a")
+    refreshes = []
+    # a daemon thread, so that a deadlocked refresh fails the test instead of hanging it
+    thread = threading.Thread(
+        target=lambda: refreshes.append(querier.refresh_table(name)), daemon=True
+    )
+    thread.start()
+    thread.join(timeout=30)
+    assert [(refresh.appended_rows, refresh.rebuilt) for refresh in refreshes] == [(1, False)]
+
+
+def test_refresh_rebuilds_a_table_loaded_with_a_partial_line(tmp_path):
+    path = str(tmp_path / "data.csv")
+    write(path, "a,b\n1,2\n3,")
+    querier = DuckdbQuerier()
+    name = querier.load_table(path)
+    write(path, "4\n5,6\n", "a")
+    refresh = querier.refresh_table(name)
+    assert refresh.rebuilt
+    assert querier.query(f"SELECT * FROM {name} ORDER BY a").rows() == [(1, 2), (3, 4), (5, 6)]
+    write(path, "7,8\n", "a")
+    assert not querier.refresh_table(name).rebuilt
+
+
+def test_refresh_rebuilds_when_the_delta_fails(tmp_path):
+    path = str(tmp_path / "data.csv")
+    write(path, "a,b\n1,2\n")
+    querier = DuckdbQuerier()
+    name = querier.load_table(path)
+    write(path, "x,y\n", "a")
+    assert querier.refresh_table(name).rebuilt
+    assert querier.query(f"SELECT count(*) FROM {name}").rows() == [(2,)]
+
+
+def test_timeout_on_a_worker_thread():
+    querier = DuckdbQuerier(query_timeout=0.2)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(
+            querier.fetch, "SELECT sum(hash(i)) FROM range(100000000000) t(i)"
+        )
+        with pytest.raises(QueryTimeoutError):
+            future.result(timeout=30)
+
+
+def test_losing_candidates_are_interrupted():
+    querier = DuckdbQuerier(query_timeout=0)
+    slow = "SELECT sum(hash(i)) FROM range(100000000000) t(i)"
+    outcomes = try_candidates(querier, [slow, "SELECT 42"], consensus=False)
+    assert outcomes[-1].sql_result.rows() == [(42,)]
+    assert querier.cursors.stats()["in_use"] == 0
+
+
+def test_cancelling_before_the_execution_starts_interrupts_it():
+    querier = DuckdbQuerier(query_timeout=0)
+    scope = CancelScope()
+    cursor = querier.cursors.acquire()
+    scope.attach(cursor)
+    # the interrupt is sent while the cursor is idle, before the query starts
+    scope.cancel()
+    slow = "SELECT sum(hash(i)) FROM range(100000000000) t(i)"
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(querier.execute_interruptible, cursor, slow, scope)
+        with pytest.raises(duckdb.InterruptException):
+            future.result(timeout=30)
+
+
+def test_queries_of_a_cancelled_scope_fail():
+    querier = DuckdbQuerier()
+    scope = CancelScope()
+    scope.cancel()
+    context = contextvars.copy_context()
+    context.run(cancel_scope.set, scope)
+    with pytest.raises(QueryCancelledError):
+        context.run(querier.fetch, "SELECT 1")
+    assert querier.fetch("SELECT 1").rows() == [(1,)]
+
+
+def test_statements_drop_cached_results(tmp_path):
+    path = str(tmp_path / "data.csv")
+    write(path, "a,b\n1,2\n3,4\n")
+    querier = DuckdbQuerier()
+    name = querier.load_table(path)
+    sql_text = f"SELECT count(*) FROM {name}"
+    assert querier.query(sql_text).rows() == [(2,)]
+    querier.query(f"DELETE FROM {name} WHERE a = 1")
+    assert querier.query(sql_text).rows() == [(1,)]
+    querier.query(f"CREATE OR REPLACE TABLE {name} AS SELECT 1 AS a FROM range(5)")
+    assert querier.query(sql_text).rows() == [(5,)]
+
+
+def test_tables_loaded_as_views_are_not_cached(tmp_path):
+    path = str(tmp_path / "data.csv")
+    write(path, "a,b\n1,2\n")
+    querier = DuckdbQuerier(load_mode="view")
+    name = querier.load_table(path)
+    sql_text = f"SELECT count(*) FROM {name}"
+    assert querier.query(sql_text).rows() == [(1,)]
+    write(path, "3,4\n", "a")
+    assert querier.query(sql_text).rows() == [(2,)]
@@ -0,0 +1,129 @@
+import pytest
+
+from sql_gpt.querier import DuckdbQuerier
+
+duckdb = pytest.importorskip("duckdb")
+
+
+@pytest.fixture
+def data_path(tmp_path):
+    path = str(tmp_path / "sales.csv")
+    duckdb.connect().execute(
+        "COPY (SELECT "
+        "CASE WHEN i % 7 = 0 THEN NULL ELSE i % 3 END AS region, "
+        "['a', 'b', 'c', 'd'][i % 4 + 1] AS state, "
+        "CASE WHEN i % 5 = 0 OR i % 4 = 3 THEN NULL ELSE i END AS x, "
+        "i / 10 AS y "
+        f"FROM range(200) t(i)) TO '{path}' (FORMAT CSV, HEADER)"
+    )
+    return path
+
+
+@pytest.fixture
+def querier(data_path):
+    querier = DuckdbQuerier(
+        rollups=True, rollup_min_queries=1, rollup_max_rows_ratio=1.0, result_cache_bytes=0
+    )
+    querier.load_table(data_path)
+    return querier
+
+
+def normalize(rows):
+    return [
+        tuple(round(value, 9) if isinstance(value, float) else value for value in row)
+        for row in rows
+    ]
+
+
+def rewritten(querier, sql_text):
+    """
+    Logs the query so that a rollup covering it is built, and returns its rewrite.
+    """
+    assert querier.rollups.rewrite(sql_text) is None
+    querier.rollups._executor.submit(lambda: None).result()
+    return querier.rollups.rewrite(sql_text)
+
+
+@pytest.mark.parametrize(
+    "sql_text",
+    [
+        # filters matching no row
+        "SELECT count(*) AS n FROM df1 WHERE region = 99",
+        "SELECT count(x), count(*), sum(x), avg(x), min(y), max(y) FROM df1 WHERE region = 99",
+        # groups
+        "SELECT region, count(*) AS n, sum(x) AS s FROM df1 GROUP BY region ORDER BY region",
+        "SELECT state, region, min(x), max(x) FROM df1 GROUP BY state, region "
+        "ORDER BY state, region",
+        # HAVING
+        "SELECT state, sum(x) FROM df1 GROUP BY state HAVING count(*) > 49 ORDER BY state",
+        "SELECT region, avg(y) AS a FROM df1 GROUP BY region HAVING sum(x) IS NULL OR "
+        "avg(x) > 90 ORDER BY region",
+        # aggregates nested in expressions
+        "SELECT region, round(avg(x), 2) AS a, sum(x) * 100.0 / count(*) AS r, "
+        "coalesce(max(x), -1) - min(x) AS spread FROM df1 GROUP BY region ORDER BY region",
+        "SELECT sum(y) / (count(*) + 1) FROM df1 WHERE state IN ('a', 'b')",
+        # NULL dimensions and measures
+        "SELECT count(*) FROM df1 WHERE region IS NULL",
+        "SELECT state, count(x) AS c, sum(x) AS s, avg(x) AS a, min(x) FROM df1 "
+        "WHERE x IS NULL GROUP BY state ORDER BY state",
+        "SELECT region, count(x), avg(x) FROM df1 GROUP BY region ORDER BY region NULLS FIRST",
+        # modifiers
+        "SELECT state, sum(x) AS s FROM df1 GROUP BY state ORDER BY s DESC LIMIT 2",
+    ],
+)
+def test_rewrite_matches_original(querier, sql_text):
+    rewrite = rewritten(querier, sql_text)
+    assert rewrite is not None
+    assert "sql_gpt_rollup_" in rewrite
+    original = querier.fetch(sql_text)
+    result = querier.fetch(rewrite)
+    assert result.columns == original.columns
+    assert normalize(result.rows()) == normalize(original.rows())
+
+
+@pytest.mark.parametrize(
+    "sql_text",
+    [
+        "SELECT count(DISTINCT x) FROM df1",
+        "SELECT median(x) FROM df1",
+        "SELECT sum(x + 1) FROM df1",
+        "SELECT sum(x) FILTER (WHERE region = 1) FROM df1",
+        "SELECT region, sum(x) OVER () FROM df1",
+        "SELECT x FROM df1 WHERE region = 1",
+        "SELECT state, sum(x) FROM df1 GROUP BY ALL",
+        "SELECT sum(x) / (SELECT sum(x) FROM df1) FROM df1",
+    ],
+)
+def test_unsupported_queries_are_not_rewritten(querier, sql_text):
+    assert querier.rollups.parse(sql_text) is None
+
+
+def test_count_of_empty_filter_is_zero(data_path):
+    querier = DuckdbQuerier(rollups=True)
+    querier.load_table(data_path)
+    for region in range(3):
+        querier.query(f"SELECT count(*) AS n FROM df1 WHERE region = {region}")
+    querier.rollups._executor.submit(lambda: None).result()
+    result = querier.query("SELECT count(*) AS n FROM df1 WHERE region = 99")
+    assert querier.rollups.hits == 1
+    assert result.rows() == [(0,)]
+
+
+def test_rollups_are_dropped_when_the_table_changes(querier, data_path):
+    sql_text = "SELECT region, sum(x) FROM df1 GROUP BY region ORDER BY region"
+    assert rewritten(querier, sql_text) is not None
+    querier.load_table(data_path, name="df1")
+    assert querier.rollups.stats()["rollups"] == 0
+    assert querier.rollups.rewrite(sql_text) is None
+
+
+def test_close_interrupts_the_build_in_progress():
+    querier = DuckdbQuerier(rollups=True, rollup_min_queries=1, rollup_max_rows_ratio=1.0)
+    querier.db_conn.execute(
+        "CREATE VIEW df1 AS SELECT range AS x, range % 1000000 AS g FROM range(1000000000)"
+    )
+    querier.bump_version("df1")
+    assert querier.rollups.rewrite("SELECT g, sum(x) FROM df1 GROUP BY g") is None
+    querier.close()
+    querier.rollups._executor.shutdown(wait=True)
+    assert querier.rollups.stats()["builds"] == 0
@@ -0,0 +1,32 @@
+import pytest
+
+from sql_gpt.llm import ScriptedLLM
+from sql_gpt.querier import DuckdbQuerier
+from sql_gpt.server import SessionManager
+
+pytest.importorskip("duckdb")
+
+
+@pytest.fixture
+def manager(tmp_path):
+    path = tmp_path / "data.csv"
+    path.write_text("a,b\n1,2\n")
+    manager = SessionManager(
+        ScriptedLLM([{"question": "How many rows?", "sql": "SELECT count(*) AS n FROM df1"}]),
+        DuckdbQuerier(),
+        [[str(path)]],
+    )
+    yield manager
+    manager.stop()
+
+
+@pytest.mark.parametrize("message", ["/load other.csv", "/refresh", " /REFRESH df1", "/resume x"])
+def test_shared_commands_are_rejected(manager, message):
+    session_id = manager.create()
+    with pytest.raises(ValueError):
+        manager.send(session_id, message)
+    assert manager.sessions[session_id].questions == 0
+
+
+def test_questions_are_answered_over_the_shared_tables(manager):
+    assert manager.send(manager.create(), "How many rows?")["answer"] == "n: 1"
@@ -0,0 +1,26 @@
+import pytest
+from langchain_core.messages import HumanMessage
+
+from sql_gpt.llm import ScriptedLLM
+from sql_gpt.querier import DuckdbQuerier
+from sql_gpt.sessions import SessionStore
+from sql_gpt.state import ChatState
+
+pytest.importorskip("duckdb")
+
+
+def test_sessions_are_recorded_once_they_have_a_question(tmp_path):
+    store = SessionStore(path=str(tmp_path / "sessions.sqlite"))
+    state = ChatState(
+        model=ScriptedLLM([]),
+        querier=DuckdbQuerier(),
+        session_store=store,
+        session_id=store.create(),
+    )
+    store.checkpoint(state)
+    assert store.list() == []
+    assert store.load(state.session_id) is None
+    state.update_history(HumanMessage(content="How many rows?"))
+    store.checkpoint(state)
+    assert store.list() == [state.session_id]
+    assert len(store.load(state.session_id).messages) == 2